@@ -0,0 +1,66 @@
+import logging
+
+from pymongo import ReturnDocument
+
+from app.db import orders_collection, cart_collection, rewards_collection, users_collection
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class CheckoutWriter:
+    """
+    Writes a checkout's records: the order, its cart lines, the reward record
+    and the coin credit, four round trips however large the cart.
+
+    Inside a transaction (pass its session) a failure aborts them all. Without
+    one they run in that fixed order, and a failure undoes the ones already
+    written before it is re-raised, so a failed checkout leaves no order,
+    reward or coins behind its returned stock. The coin credit goes last: it
+    is the one write that can't be told apart from a retry, so it is only
+    attempted once everything else has landed.
+    """
+
+    def __init__(self, orders, cart, rewards, users):
+        self.orders = orders
+        self.cart = cart
+        self.rewards = rewards
+        self.users = users
+
+    async def write(self, order_doc: dict, cart_items: list, reward_doc: dict, user_id, coins: int, session=None):
+        """Returns the user's document with its new coin balance."""
+        # Recorded before each insert: the driver sets the documents' _id before sending them,
+        # so an insert that failed part-way (or whose reply was lost) can still be undone
+        written = []
+        try:
+            written.append((self.orders, [order_doc]))
+            await self.orders.insert_one(order_doc, session=session)
+            if cart_items:
+                written.append((self.cart, cart_items))
+                await self.cart.insert_many(cart_items, session=session)
+            written.append((self.rewards, [reward_doc]))
+            await self.rewards.insert_one(reward_doc, session=session)
+            return await self.users.find_one_and_update(
+                {"_id": user_id},
+                {"$inc": {"coins": coins}},
+                projection={"coins": 1},
+                return_document=ReturnDocument.AFTER,
+                session=session
+            )
+        except Exception:
+            if session is None:
+                await self._undo(written)
+            raise
+
+    @staticmethod
+    async def _undo(written: list):
+        for collection, documents in reversed(written):
+            ids = [document["_id"] for document in documents if "_id" in document]
+            if not ids:
+                continue
+            try:
+                await collection.delete_many({"_id": {"$in": ids}})
+            except Exception as e:
+                logger.error(f"Undoing {len(ids)} {collection.name} checkout writes failed: {e}")
+
+
+checkout_writer = CheckoutWriter(orders_collection, cart_collection, rewards_collection, users_collection)
@@ -1,26 +1,224 @@
-from transformers import CLIPProcessor, CLIPModel
+# Heavy ML libraries (torch, transformers) are imported inside load_model() so that
+# importing this module is cheap and the API can serve requests while the model loads.
 from PIL import Image
-import torch
-import pandas as pd
+import numpy as np
+import hashlib
+import logging
 import os
+import threading
+import time
+
+from app.config import (
+    CLIP_MODEL_NAME,
+    CLIP_LABEL_CACHE_DIR,
+    PREDICTION_MAX_TOP_K,
+    PREDICTION_MIN_CONFIDENCE,
+    LABEL_INDEX_ANN_THRESHOLD,
+    LABEL_INDEX_NPROBE,
+    CLIP_BACKEND,
+    CLIP_EXPORT_DIR
+)
+from app.label_index import build_label_index
+
+logger = logging.getLogger("uvicorn.error")
+
+CSV_PATH = os.path.join(os.path.dirname(__file__), "../product_list.csv")
+TEXT_ENCODE_BATCH_SIZE = 256
+UNKNOWN_LABEL = "unknown"
+
+# Populated by load_model()
+model = None
+processor = None
+LOGIT_SCALE = None # CLIP's logits are cosine similarity scaled by this learned temperature
+LABELS = []
+LABEL_EMBEDDINGS = None
+LABEL_INDEX = None
+IMAGE_ENCODER = None
+
+_ready = threading.Event()
+_load_lock = threading.Lock()
+_load_state = {"status": "not_started", "error": None, "load_seconds": None}
+_label_revision = 0 # Bumped whenever the live label set changes
+_csv_fingerprint = {"stat": None, "sha256": None}
+
+
+class ModelNotReadyError(RuntimeError):
+    pass
 
-# Load model and processor
-model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
 
 # Load product names from CSV
 def load_product_labels():
-    csv_path = os.path.join(os.path.dirname(__file__), "../product_list.csv")
-    df = pd.read_csv(csv_path)
+    import pandas as pd
+    df = pd.read_csv(CSV_PATH)
     return df["product_name"].tolist()
 
-LABELS = load_product_labels()
+def catalogue_hash(csv_path: str = CSV_PATH) -> str:
+    """SHA-256 of the label CSV, used to key the embedding cache."""
+    with open(csv_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def catalogue_fingerprint() -> str:
+    """catalogue_hash() of the CSV, recomputed only when its size or mtime changes."""
+    try:
+        st = os.stat(CSV_PATH)
+    except OSError:
+        return None
+    stat = (st.st_mtime_ns, st.st_size)
+    if _csv_fingerprint["stat"] != stat:
+        _csv_fingerprint.update(stat=stat, sha256=catalogue_hash())
+    return _csv_fingerprint["sha256"]
+
+def label_set_version() -> tuple:
+    """Changes whenever the label set changes, on disk in product_list.csv or through add/remove_labels()."""
+    return (catalogue_fingerprint(), _label_revision)
+
+def encode_labels(labels: list) -> np.ndarray:
+    """Runs the text tower over the labels and returns L2-normalised float32 embeddings."""
+    import torch
+    chunks = []
+    with torch.no_grad():
+        for start in range(0, len(labels), TEXT_ENCODE_BATCH_SIZE):
+            batch = labels[start:start + TEXT_ENCODE_BATCH_SIZE]
+            inputs = processor(text=batch, return_tensors="pt", padding=True)
+            features = model.get_text_features(**inputs)
+            features = features / features.norm(dim=-1, keepdim=True)
+            chunks.append(features.cpu().numpy().astype(np.float32))
+    return np.concatenate(chunks, axis=0)
+
+def load_label_embeddings(labels: list) -> np.ndarray:
+    """
+    Returns the label embedding matrix, loading it from the on-disk cache when the
+    model name and CSV contents match, otherwise encoding and saving it.
+    """
+    key = hashlib.sha256(f"{CLIP_MODEL_NAME}:{catalogue_hash()}".encode()).hexdigest()[:16]
+    model_slug = CLIP_MODEL_NAME.replace("/", "--")
+    cache_path = os.path.join(CLIP_LABEL_CACHE_DIR, f"{model_slug}-{key}.npy")
+
+    if os.path.exists(cache_path):
+        try:
+            embeddings = np.load(cache_path)
+            if embeddings.shape[0] == len(labels):
+                logger.info(f"Loaded {len(labels)} label embeddings from {cache_path}")
+                return embeddings
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable label embedding cache {cache_path}: {e}")
+
+    embeddings = encode_labels(labels)
+    try:
+        os.makedirs(CLIP_LABEL_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, embeddings)
+        os.replace(tmp_path, cache_path) # Atomic, so concurrent workers never read a partial file
+    except OSError as e:
+        logger.warning(f"Could not write label embedding cache {cache_path}: {e}")
+    return embeddings
+
+def load_model():
+    """Loads the model, processor and label index. Safe to call from several threads."""
+    global model, processor, LOGIT_SCALE, LABELS, LABEL_EMBEDDINGS, LABEL_INDEX, IMAGE_ENCODER, _label_revision
+    with _load_lock:
+        if _ready.is_set():
+            return
+        _load_state.update(status="loading", error=None)
+        started = time.perf_counter()
+        try:
+            from transformers import CLIPProcessor, CLIPModel
+            from app.inference_backends import create_image_encoder
+
+            model = CLIPModel.from_pretrained(CLIP_MODEL_NAME)
+            processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+            model.eval()
+            LOGIT_SCALE = model.logit_scale.exp().item()
+            IMAGE_ENCODER = create_image_encoder(CLIP_BACKEND, model, CLIP_MODEL_NAME, CLIP_EXPORT_DIR)
+            if IMAGE_ENCODER.name != "torch":
+                # The encoder holds its own copy of the image tower; only the text tower is still needed here
+                model.vision_model = None
+                model.visual_projection = None
+
+            LABELS = load_product_labels()
+            LABEL_EMBEDDINGS = load_label_embeddings(LABELS)
+            LABEL_INDEX = build_label_index(
+                LABELS,
+                LABEL_EMBEDDINGS,
+                ann_threshold=LABEL_INDEX_ANN_THRESHOLD,
+                n_probe=LABEL_INDEX_NPROBE
+            )
+            _label_revision += 1
+        except Exception as e:
+            _load_state.update(status="failed", error=str(e))
+            logger.error(f"❌ Failed to load CLIP model: {e}", exc_info=True)
+            raise
+        _load_state.update(status="ready", load_seconds=round(time.perf_counter() - started, 2))
+        _ready.set()
+        logger.info(f"✅ CLIP model ready with {len(LABEL_INDEX)} labels in {_load_state['load_seconds']}s")
+
+def start_background_load() -> threading.Thread:
+    """Starts loading the model on a daemon thread and returns immediately."""
+    def _load():
+        try:
+            load_model()
+        except Exception:
+            pass # Already logged and recorded in load_status()
+    thread = threading.Thread(target=_load, name="clip-model-loader", daemon=True)
+    thread.start()
+    return thread
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+def wait_until_ready(timeout: float = None) -> bool:
+    return _ready.wait(timeout)
+
+def load_status() -> dict:
+    return {
+        **_load_state,
+        "backend": CLIP_BACKEND,
+        "labels": len(LABEL_INDEX) if LABEL_INDEX is not None else 0
+    }
+
+def add_labels(labels: list):
+    """Adds labels to the live index without rebuilding it."""
+    global _label_revision
+    if not _ready.is_set():
+        raise ModelNotReadyError("CLIP model is still loading")
+    LABEL_INDEX.add(labels, encode_labels(labels))
+    _label_revision += 1
+
+def remove_labels(labels: list) -> int:
+    global _label_revision
+    if not _ready.is_set():
+        raise ModelNotReadyError("CLIP model is still loading")
+    removed = LABEL_INDEX.remove(labels)
+    _label_revision += 1
+    return removed
+
+def predict_candidate_batch(images: list, k: int = PREDICTION_MAX_TOP_K) -> list:
+    """
+    Classifies a batch of images with a single forward pass of the image tower and
+    returns, per image, the top-k labels with their softmax probabilities.
+    """
+    if not _ready.is_set():
+        raise ModelNotReadyError("CLIP model is still loading")
+
+    # Only the image tower runs per request; labels are scored by the label index
+    inputs = processor(images=images, return_tensors="np")
+    image_features = IMAGE_ENCODER.encode(inputs["pixel_values"])
+    image_features = image_features / np.linalg.norm(image_features, axis=-1, keepdims=True)
+    return LABEL_INDEX.search(image_features, max(1, k), LOGIT_SCALE)
+
+def best_label(candidates: list, min_confidence: float = PREDICTION_MIN_CONFIDENCE) -> str:
+    """Top-1 label, or UNKNOWN_LABEL when the classifier is not confident enough."""
+    if not candidates or candidates[0]["probability"] < min_confidence:
+        return UNKNOWN_LABEL
+    return candidates[0]["label"]
+
+def predict_product_candidates(image: Image.Image, k: int = PREDICTION_MAX_TOP_K) -> list:
+    return predict_candidate_batch([image], k)[0]
+
+def predict_product_names(images: list) -> list:
+    return [best_label(candidates) for candidates in predict_candidate_batch(images, 1)]
 
 # Prediction function
 def predict_product_name(image: Image.Image) -> str:
-    inputs = processor(text=LABELS, images=image, return_tensors="pt", padding=True)
-    outputs = model(**inputs)
-    logits_per_image = outputs.logits_per_image
-    probs = logits_per_image.softmax(dim=1)
-    best_idx = torch.argmax(probs, dim=1).item()
-    return LABELS[best_idx]
+    return predict_product_names([image])[0]
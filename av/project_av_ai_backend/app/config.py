@@ -16,6 +16,127 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
 
 # You can also load your other secrets here for consistency
 MONGO_URI = os.getenv("MONGO_URI")
+
+# --- MongoDB client (one shared pool per worker, built in app/db.py) ---
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "5"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+# A request waiting this long for a free connection fails instead of queueing forever
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+# zlib ships with Python; zstd/snappy need the zstandard/python-snappy packages
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zlib")
+MONGO_APP_NAME = os.getenv("MONGO_APP_NAME", "project-av-backend")
 # In config.py
 GOOGLE_WEB_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
-GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
\ No newline at end of file
+GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
+
+# --- CLIP product classifier ---
+CLIP_MODEL_NAME = os.getenv("CLIP_MODEL_NAME", "openai/clip-vit-base-patch32")
+# Text embeddings of product_list.csv are cached here, keyed by model name + CSV hash
+CLIP_LABEL_CACHE_DIR = os.getenv("CLIP_LABEL_CACHE_DIR", os.path.join(BASE_DIR, "label_cache"))
+# Image tower backend: "torch" (fp32), "torch-int8" (dynamic quantisation) or "onnx" (ONNX Runtime)
+CLIP_BACKEND = os.getenv("CLIP_BACKEND", "torch")
+CLIP_EXPORT_DIR = os.getenv("CLIP_EXPORT_DIR", os.path.join(BASE_DIR, "model_cache"))
+# How long /upload-and-predict/ waits for a cold model before answering 503
+MODEL_READY_TIMEOUT_SECONDS = float(os.getenv("MODEL_READY_TIMEOUT_SECONDS", "10"))
+
+# --- Image uploads ---
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(5 * 1024 * 1024)))
+# Uploads are decoded/downscaled so the shortest side is about this many pixels (CLIP needs 224)
+IMAGE_DECODE_MIN_SIDE = int(os.getenv("IMAGE_DECODE_MIN_SIDE", "256"))
+
+# --- Product image uploads (Cloudinary) ---
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+UPLOAD_MAX_QUEUE_SIZE = int(os.getenv("UPLOAD_MAX_QUEUE_SIZE", "256"))
+UPLOAD_MAX_ATTEMPTS = int(os.getenv("UPLOAD_MAX_ATTEMPTS", "5"))
+UPLOAD_RETRY_BASE_SECONDS = float(os.getenv("UPLOAD_RETRY_BASE_SECONDS", "2"))
+UPLOAD_RETRY_MAX_SECONDS = float(os.getenv("UPLOAD_RETRY_MAX_SECONDS", "120"))
+UPLOAD_RESUME_INTERVAL_SECONDS = int(os.getenv("UPLOAD_RESUME_INTERVAL_SECONDS", "60"))
+
+# --- temp_uploads/ lifecycle ---
+# Photos not claimed by /add-product/ within the TTL are swept; claimed ones wait for the upload worker
+TEMP_UPLOAD_TTL_SECONDS = float(os.getenv("TEMP_UPLOAD_TTL_SECONDS", "3600"))
+TEMP_UPLOAD_CLAIMED_TTL_SECONDS = float(os.getenv("TEMP_UPLOAD_CLAIMED_TTL_SECONDS", "86400"))
+TEMP_UPLOAD_MAX_BYTES = int(os.getenv("TEMP_UPLOAD_MAX_BYTES", str(512 * 1024 * 1024)))
+TEMP_UPLOAD_SWEEP_INTERVAL_SECONDS = int(os.getenv("TEMP_UPLOAD_SWEEP_INTERVAL_SECONDS", "300"))
+
+# --- Micro-batching for /upload-and-predict/ ---
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "8"))
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "15"))
+INFERENCE_MAX_QUEUE_SIZE = int(os.getenv("INFERENCE_MAX_QUEUE_SIZE", "256"))
+
+# --- Inference placement ---
+# "inprocess" loads CLIP in every API worker; "sidecar" sends images to one
+# `python -m app.inference_sidecar` process over a Unix socket
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "inprocess")
+INFERENCE_SOCKET_PATH = os.getenv("INFERENCE_SOCKET_PATH", "/tmp/project-av-clip.sock")
+INFERENCE_SIDECAR_TIMEOUT_SECONDS = float(os.getenv("INFERENCE_SIDECAR_TIMEOUT_SECONDS", "30"))
+
+# --- Prediction response ---
+# Upper bound for ?top_k on /upload-and-predict/; candidates are always computed to this depth
+PREDICTION_MAX_TOP_K = int(os.getenv("PREDICTION_MAX_TOP_K", "5"))
+# Below this top-1 probability the predicted name is "unknown" (0 disables the cutoff)
+PREDICTION_MIN_CONFIDENCE = float(os.getenv("PREDICTION_MIN_CONFIDENCE", "0"))
+
+# --- Prediction cache ---
+# Results keyed by a 64-bit dHash of the image; photos within MAX_DISTANCE bits reuse a result (size 0 disables)
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "4096"))
+PREDICTION_CACHE_TTL_SECONDS = float(os.getenv("PREDICTION_CACHE_TTL_SECONDS", "21600"))
+PREDICTION_CACHE_MAX_DISTANCE = int(os.getenv("PREDICTION_CACHE_MAX_DISTANCE", "4"))
+
+# --- Label index ---
+# Catalogues with at least this many labels use the approximate IVF index instead of brute force
+LABEL_INDEX_ANN_THRESHOLD = int(os.getenv("LABEL_INDEX_ANN_THRESHOLD", "20000"))
+LABEL_INDEX_NPROBE = int(os.getenv("LABEL_INDEX_NPROBE", "8"))
+
+# --- Shop search (/get-shops) ---
+# Clients may ask for a radius and page size; requests above the maximums are clamped
+SHOP_SEARCH_RADIUS_KM = float(os.getenv("SHOP_SEARCH_RADIUS_KM", "15"))
+SHOP_SEARCH_MAX_RADIUS_KM = float(os.getenv("SHOP_SEARCH_MAX_RADIUS_KM", "50"))
+SHOP_SEARCH_LIMIT = int(os.getenv("SHOP_SEARCH_LIMIT", "20"))
+SHOP_SEARCH_MAX_LIMIT = int(os.getenv("SHOP_SEARCH_MAX_LIMIT", "50"))
+SHOP_SEARCH_MAX_PRODUCTS_PER_SHOP = int(os.getenv("SHOP_SEARCH_MAX_PRODUCTS_PER_SHOP", "10"))
+
+# --- products.shop_id rollout ---
+# products.shop_id is being migrated from the shop's _id as a string to the ObjectId itself
+# (python -m app.migrations.product_shop_ids). While true, shop -> products joins match both forms;
+# set it to false once the migration has run everywhere.
+PRODUCT_SHOP_ID_DUAL_READ = os.getenv("PRODUCT_SHOP_ID_DUAL_READ", "true").lower() in ("1", "true", "yes")
+
+# --- Home feed cache (deals, trending, best-price) ---
+# Feeds are cached per geohash tile (precision 6 is about 1.2 x 0.6 km), category and feed (size 0 disables)
+FEED_CACHE_TTL_SECONDS = float(os.getenv("FEED_CACHE_TTL_SECONDS", "60"))
+FEED_CACHE_MAX_ENTRIES = int(os.getenv("FEED_CACHE_MAX_ENTRIES", "5000"))
+# Ranked items kept per tile; pages beyond this are queried directly
+FEED_CACHE_MAX_ITEMS = int(os.getenv("FEED_CACHE_MAX_ITEMS", "200"))
+FEED_CACHE_GEOHASH_PRECISION = int(os.getenv("FEED_CACHE_GEOHASH_PRECISION", "6"))
+
+# --- Product price index (cross-shop price comparison) ---
+# One product_price_index document per normalised product name and geohash cell of the selling shops
+# (precision 5 is about 4.9 x 4.9 km)
+PRICE_INDEX_GEOHASH_PRECISION = int(os.getenv("PRICE_INDEX_GEOHASH_PRECISION", "5"))
+PRICE_INDEX_CHEAPEST_SHOPS = int(os.getenv("PRICE_INDEX_CHEAPEST_SHOPS", "3"))
+
+# --- Checkout ---
+# Run the /checkout-cart/ order, cart, reward and coin writes in one multi-document transaction. Stock is
+# reserved before it (app/inventory.py) and put back if it fails. Needs a replica set or Atlas; a
+# standalone mongod rejects transactions.
+CHECKOUT_TRANSACTIONS = os.getenv("CHECKOUT_TRANSACTIONS", "false").lower() in ("1", "true", "yes")
+
+# --- Stock holds (POST /stock-holds) ---
+# A hold keeps stock aside while the customer walks to the shop; unclaimed holds give it back
+STOCK_HOLD_TTL_SECONDS = float(os.getenv("STOCK_HOLD_TTL_SECONDS", "900"))
+STOCK_HOLD_MAX_TTL_SECONDS = float(os.getenv("STOCK_HOLD_MAX_TTL_SECONDS", "3600"))
+STOCK_HOLD_SWEEP_INTERVAL_SECONDS = float(os.getenv("STOCK_HOLD_SWEEP_INTERVAL_SECONDS", "60"))
+
+# --- Telemetry event buffer (app/event_buffer.py) ---
+# View/sale events are written behind the request in batches: on EVENT_BUFFER_BATCH_SIZE pending events or
+# every EVENT_BUFFER_FLUSH_INTERVAL_SECONDS. At EVENT_BUFFER_MAX_EVENTS, requests wait up to
+# EVENT_BUFFER_ENQUEUE_TIMEOUT_SECONDS for a flush before getting a 503.
+EVENT_BUFFER_MAX_EVENTS = int(os.getenv("EVENT_BUFFER_MAX_EVENTS", "20000"))
+EVENT_BUFFER_BATCH_SIZE = int(os.getenv("EVENT_BUFFER_BATCH_SIZE", "1000"))
+EVENT_BUFFER_FLUSH_INTERVAL_SECONDS = float(os.getenv("EVENT_BUFFER_FLUSH_INTERVAL_SECONDS", "1"))
+EVENT_BUFFER_ENQUEUE_TIMEOUT_SECONDS = float(os.getenv("EVENT_BUFFER_ENQUEUE_TIMEOUT_SECONDS", "2"))
@@ -1,17 +1,107 @@
+import asyncio
 import os
-from pymongo import MongoClient, GEOSPHERE, IndexModel
+import threading
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import GEOSPHERE, IndexModel, monitoring
 from dotenv import load_dotenv
 import certifi # --- 1. ADD THIS IMPORT ---
 
+from app.config import (
+    MONGO_MAX_POOL_SIZE,
+    MONGO_MIN_POOL_SIZE,
+    MONGO_MAX_IDLE_TIME_MS,
+    MONGO_CONNECT_TIMEOUT_MS,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_SOCKET_TIMEOUT_MS,
+    MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    MONGO_COMPRESSORS,
+    MONGO_APP_NAME,
+    PRODUCT_SHOP_ID_DUAL_READ
+)
+
 load_dotenv()
 
 MONGO_URI = os.getenv("MONGO_URI")
 DB_NAME = "project_av"
 
-# --- 2. ADD these two lines and MODIFY the third to use the certificates ---
-ca = certifi.where()
-client = MongoClient(MONGO_URI, tlsCAFile=ca)
-# --------------------------------------------------------------------
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Counts connection pool events; the driver calls these from its own threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {
+            "connections_open": 0,
+            "connections_in_use": 0,
+            "connections_created_total": 0,
+            "connections_closed_total": 0,
+            "checkouts_total": 0,
+            "checkout_failures_total": 0,
+            "pool_clears_total": 0,
+        }
+
+    def _bump(self, **deltas):
+        with self._lock:
+            for key, delta in deltas.items():
+                self._stats[key] += delta
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+
+    def pool_cleared(self, event):
+        self._bump(pool_clears_total=1)
+
+    def connection_created(self, event):
+        self._bump(connections_open=1, connections_created_total=1)
+
+    def connection_closed(self, event):
+        self._bump(connections_open=-1, connections_closed_total=1)
+
+    def connection_checked_out(self, event):
+        self._bump(connections_in_use=1, checkouts_total=1)
+
+    def connection_check_out_failed(self, event):
+        self._bump(checkout_failures_total=1)
+
+    def connection_checked_in(self, event):
+        self._bump(connections_in_use=-1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+
+pool_stats = PoolStatsListener()
+
+
+def create_client(uri: str = MONGO_URI) -> AsyncIOMotorClient:
+    """
+    The one place a MongoDB client is built. Every module shares the client
+    below, so each worker process has exactly one connection pool.
+    """
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "appname": MONGO_APP_NAME,
+        "event_listeners": [pool_stats],
+    }
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    # Atlas (mongodb+srv) and explicit tls=true need certifi's CA bundle; a plain local mongod does not
+    if uri and (uri.startswith("mongodb+srv://") or "tls=true" in uri.lower() or "ssl=true" in uri.lower()):
+        options["tlsCAFile"] = certifi.where()
+    return AsyncIOMotorClient(uri, **options)
+
+
+client = create_client()
 db = client[DB_NAME]
 
 # Initialize collections
@@ -25,25 +115,95 @@ payments_collection = db["payments"]
 product_views_collection = db["product_views"]
 product_sales_collection = db["product_sales"]
 orders_collection = db["orders"]
+product_price_index_collection = db["product_price_index"]
+stock_holds_collection = db["stock_holds"]
+shop_daily_metrics_collection = db["shop_daily_metrics"]
+# Checkpoints of resumable migrations (app/migrations)
+migrations_collection = db["migrations"]
+
+# Create indexes (single efficient creation). Motor needs a running event loop,
+# so this is awaited from the app's startup hook instead of running at import.
+async def ensure_indexes():
+    await shops_collection.create_indexes([
+        IndexModel([("location", GEOSPHERE)]),
+        IndexModel([("owner_id", 1)])
+    ])
+
+    await products_collection.create_index([("owner_id", 1)])
+    # Multikey index behind product search (app/search.py); replaces the unanchored $regex scans
+    await products_collection.create_index([("search_grams", 1), ("inStock", 1), ("count", 1)])
+    # The per-shop product join in /get-shops: owner equality, then the search grams
+    await products_collection.create_index([("owner_id", 1), ("search_grams", 1)])
+    # Shop -> products joins (shop_products_lookup); category narrows the category-filtered feeds
+    await products_collection.create_index([("shop_id", 1), ("category", 1)])
+    # Lets the price index rebuild one (name, cell) group with an indexed find (app/price_index.py)
+    await products_collection.create_index([("name_key", 1), ("price_cell", 1)])
+    # Lets the upload worker find unfinished image uploads without scanning products
+    await products_collection.create_index([("upload_job.state", 1)], sparse=True)
+    await orders_collection.create_index([("user_id", 1), ("timestamp", -1)])
+    # Best-price reads every name in the cells around a user; competitor prices read (name, cell) pairs
+    await product_price_index_collection.create_indexes([
+        IndexModel([("cell", 1), ("categories", 1)]),
+        IndexModel([("name_key", 1), ("cell", 1)])
+    ])
+    # The hold expiry sweep (app/inventory.py) and a user's holds
+    await stock_holds_collection.create_indexes([
+        IndexModel([("status", 1), ("expires_at", 1)]),
+        IndexModel([("user_id", 1), ("status", 1)])
+    ])
+    # Rollups are read by _id ("<shop_id>|<day>"); the rebuild replaces a day at a time
+    await shop_daily_metrics_collection.create_index([("date", 1)])
+    # Create compound indexes for performance
+    await product_views_collection.create_indexes([
+        IndexModel([("shop_id", 1), ("timestamp", 1)]),
+        IndexModel([("timestamp", 1)])
+    ])
+
+    await product_sales_collection.create_indexes([
+        IndexModel([("shop_id", 1), ("timestamp", 1)]),
+        IndexModel([("product_id", 1)]),
+        IndexModel([("timestamp", 1)])
+    ])
+
+    print("✅ Connected to MongoDB with optimized indexes")
+
+
+def shop_products_lookup(as_field: str, pipeline: list = None) -> list:
+    """
+    Stages that join each shop to its products as an indexed equality on
+    products.shop_id, replacing the $toString/$expr form that scanned products
+    once per shop. During the ObjectId rollout the join key is the shop's _id
+    in both forms, so migrated and unmigrated products are found alike.
+    """
+    lookup = {"from": "products", "foreignField": "shop_id", "as": as_field}
+    if pipeline:
+        lookup["pipeline"] = pipeline
+    if not PRODUCT_SHOP_ID_DUAL_READ:
+        return [{"$lookup": {**lookup, "localField": "_id"}}]
+    return [
+        {"$addFields": {"_shop_keys": ["$_id", {"$toString": "$_id"}]}},
+        {"$lookup": {**lookup, "localField": "_shop_keys"}},
+        {"$unset": "_shop_keys"}
+    ]
+
+
+async def connect_db(warmup_connections: int = MONGO_MIN_POOL_SIZE):
+    """Fails fast if MongoDB is unreachable, opens pool connections before traffic arrives, and creates indexes."""
+    await client.admin.command("ping")
+    # Concurrent pings each check out their own connection, so the pool is warm for the first requests
+    await asyncio.gather(*(client.admin.command("ping") for _ in range(max(0, warmup_connections))))
+    await ensure_indexes()
+
+
+def close_db():
+    client.close()
+
 
-# Create indexes (single efficient creation)
-shops_collection.create_indexes([
-    IndexModel([("location", GEOSPHERE)]),
-    IndexModel([("owner_id", 1)])
-])
-
-products_collection.create_index([("owner_id", 1)])
-orders_collection.create_index([("user_id", 1), ("timestamp", -1)])
-# Create compound indexes for performance
-product_views_collection.create_indexes([
-    IndexModel([("shop_id", 1), ("timestamp", 1)]),
-    IndexModel([("timestamp", 1)])
-])
-
-product_sales_collection.create_indexes([
-    IndexModel([("shop_id", 1), ("timestamp", 1)]),
-    IndexModel([("product_id", 1)]),
-    IndexModel([("timestamp", 1)])
-])
-
-print("✅ Connected to MongoDB with optimized indexes")
\ No newline at end of file
+def pool_metrics() -> dict:
+    return {
+        **pool_stats.snapshot(),
+        "max_pool_size": MONGO_MAX_POOL_SIZE,
+        "min_pool_size": MONGO_MIN_POOL_SIZE,
+        "wait_queue_timeout_ms": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "compressors": MONGO_COMPRESSORS,
+    }
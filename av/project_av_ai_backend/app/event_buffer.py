@@ -0,0 +1,288 @@
+"""
+Write-behind buffer for view and sale telemetry.
+
+The record-* endpoints and /cart/add-item hand their event documents and
+counter bumps to event_buffer and return without waiting on MongoDB. A single
+flusher task writes them out when batch_size events are pending or every
+flush_interval_seconds:
+
+  - documents, one insert_many per collection (unordered)
+  - counters, summed per (collection, _id) and one unordered bulk_write of
+    $inc per collection, so a thousand views of one shop cost one update
+  - product sale_count bumps, mirrored into product_price_index
+    (price_index.record_sales) once they have landed
+  - written product_views/product_sales documents, folded into the
+    shop_daily_metrics rollup (shop_metrics.record)
+
+When max_events are pending, producers wait for the next flush (up to
+enqueue_timeout_seconds) instead of growing the buffer, and get
+EventBufferFull if it does not make room in time. stop() drains everything
+still buffered.
+
+Documents for product_views and product_sales are validated against
+app/schemas/events.py before they are buffered, so ids are stored as
+ObjectIds whatever the caller sent; an invalid event raises ValueError.
+
+Delivery is best effort. A failed insert_many is retried on the next flush;
+the driver has already set each document's _id, so a retry after a partial
+insert skips the duplicates. A failed counter bulk_write may have been
+partly applied, so its counters are dropped (and counted) rather than risk
+counting twice.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app import price_index, shop_metrics
+from app.db import products_collection, product_views_collection, product_sales_collection
+from app.schemas.events import ViewEvent, SaleEvent
+from app.config import (
+    EVENT_BUFFER_MAX_EVENTS,
+    EVENT_BUFFER_BATCH_SIZE,
+    EVENT_BUFFER_FLUSH_INTERVAL_SECONDS,
+    EVENT_BUFFER_ENQUEUE_TIMEOUT_SECONDS
+)
+
+logger = logging.getLogger("uvicorn.error")
+
+_EVENT_SCHEMAS = {
+    product_views_collection.name: ViewEvent,
+    product_sales_collection.name: SaleEvent
+}
+
+# BulkWriteError code for a document whose _id is already stored: a retried insert that had landed
+_DUPLICATE_KEY = 11000
+
+
+class EventBufferFull(RuntimeError):
+    pass
+
+
+class EventBuffer:
+    def __init__(self, max_events: int = 20000, batch_size: int = 1000, flush_interval_seconds: float = 1.0,
+                 enqueue_timeout_seconds: float = 2.0):
+        self.max_events = max(1, max_events)
+        self.batch_size = max(1, min(batch_size, self.max_events))
+        self.flush_interval = flush_interval_seconds
+        self.enqueue_timeout = enqueue_timeout_seconds
+        self._collections = {} # name -> collection
+        self._documents = {} # name -> [document]
+        self._counters = {} # (name, _id, upsert) -> {field: amount}
+        self._pending = 0 # Buffered documents plus distinct counters
+        self._task = None
+        self._stopping = False
+        # Created in start(): on Python 3.9 asyncio primitives bind to the loop current at creation
+        self._wake = None
+        self._flush_lock = None
+        self._waiters = deque() # Producers held back by a full buffer, released in order as flushes make room
+        self._stats = {
+            "events_total": 0,
+            "documents_written_total": 0,
+            "counter_updates_total": 0,
+            "flushes_total": 0,
+            "flush_errors_total": 0,
+            "backpressure_waits_total": 0,
+            "rejected_total": 0,
+            "dropped_total": 0,
+            "last_flush_ms": 0.0
+        }
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Event buffer started (batch_size={self.batch_size}, interval={self.flush_interval}s)")
+
+    async def stop(self):
+        """Stops the flusher and writes out whatever is still buffered."""
+        if self._task is None:
+            return
+        # Let a flush in progress finish rather than cancel it with its batch half written
+        self._stopping = True
+        self._wake.set()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        # A flush that fails puts its documents back; stop after a few tries rather than hang shutdown
+        for _ in range(3):
+            if not self._pending:
+                break
+            await self.flush()
+        if self._pending:
+            logger.warning(f"Event buffer stopped with {self._pending} events unwritten")
+
+    async def insert(self, collection, document: dict):
+        """Buffers one document for collection.insert_many(); ValueError if it fails its event schema."""
+        schema = _EVENT_SCHEMAS.get(collection.name)
+        if schema is not None:
+            typed = schema(**document).document()
+            if "_id" in document: # Callers that return the event's id set it themselves
+                typed["_id"] = document["_id"]
+            document = typed
+        await self._admit()
+        self._collections[collection.name] = collection
+        self._documents.setdefault(collection.name, []).append(document)
+        self._stats["events_total"] += 1
+        self._added(1)
+
+    async def increment(self, collection, _id, fields: dict, upsert: bool = False):
+        """Buffers {"$inc": fields} on one document; bumps to the same _id are summed until the flush."""
+        key = (collection.name, _id, upsert)
+        if key not in self._counters:
+            await self._admit()
+        # Checked again: the buffers may have been flushed, or the key added, while waiting
+        if key not in self._counters:
+            self._collections[collection.name] = collection
+            self._counters[key] = {}
+            self._added(1)
+        self._stats["events_total"] += 1
+        counters = self._counters[key]
+        for field, amount in fields.items():
+            counters[field] = counters.get(field, 0) + amount
+
+    def _added(self, count: int):
+        self._pending += count
+        if self._pending >= self.batch_size and self._wake is not None:
+            self._wake.set()
+
+    async def _admit(self):
+        """Backpressure: waits its turn for a flush to make room, or raises EventBufferFull."""
+        if self._pending < self.max_events and not self._waiters:
+            return
+        if self._wake is None:
+            self._stats["rejected_total"] += 1
+            raise EventBufferFull("Event buffer is full and not running")
+        self._stats["backpressure_waits_total"] += 1
+        turn = asyncio.get_running_loop().create_future()
+        self._waiters.append(turn)
+        self._wake.set()
+        try:
+            await asyncio.wait_for(turn, self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            # The cancelled turn stays queued; _release_waiters() skips it
+            self._stats["rejected_total"] += 1
+            raise EventBufferFull(f"Event buffer is full; no room after waiting {self.enqueue_timeout}s for a flush")
+
+    def _release_waiters(self):
+        # One waiter per free slot, so a flush doesn't wake every blocked producer at once
+        room = self.max_events - self._pending
+        while self._waiters and room > 0:
+            turn = self._waiters.popleft()
+            if not turn.done():
+                turn.set_result(None)
+                room -= 1
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping:
+                return
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e: # flush() logs its own write errors; never let the flusher die
+                logger.error(f"Event buffer flush crashed: {e}")
+
+    async def flush(self):
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._pending:
+                self._release_waiters()
+                return
+            # Swap the buffers out before the first await so producers keep appending to fresh ones
+            documents, self._documents = self._documents, {}
+            counters, self._counters = self._counters, {}
+            self._pending = 0
+            started = time.perf_counter()
+
+            by_collection = {}
+            for (name, _id, upsert), fields in counters.items():
+                by_collection.setdefault(name, []).append(UpdateOne({"_id": _id}, {"$inc": fields}, upsert=upsert))
+            try:
+                results = await asyncio.gather(*(self._insert(name, batch) for name, batch in documents.items()),
+                                               *(self._bump(name, updates) for name, updates in by_collection.items()))
+                inserted = dict(zip(documents, results))
+                bumped = dict(zip(by_collection, results[len(documents):]))
+
+                # Requeued documents are rolled up by the flush that finally writes them
+                views, sales = (documents.get(collection.name) if inserted.get(collection.name) else None
+                                for collection in (product_views_collection, product_sales_collection))
+                if views or sales:
+                    await shop_metrics.record(views or [], sales or [])
+
+                # Only mirror sale counts that landed; a failed bulk_write's counters were dropped
+                if bumped.get(products_collection.name):
+                    sales = {_id: fields["sale_count"] for (name, _id, _), fields in counters.items()
+                             if name == products_collection.name and fields.get("sale_count")}
+                    if sales:
+                        await price_index.record_sales(sales)
+            finally:
+                # The buffers were swapped out above, so their room is free whatever the hooks did
+                self._stats["flushes_total"] += 1
+                self._stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 2)
+                self._release_waiters()
+
+    async def _insert(self, name: str, documents: list) -> bool:
+        """True once every document is stored; otherwise they are requeued."""
+        # The driver splits a large insert_many into wire-sized batches itself
+        try:
+            await self._collections[name].insert_many(documents, ordered=False)
+            self._stats["documents_written_total"] += len(documents)
+            return True
+        except BulkWriteError as e:
+            if all(error.get("code") == _DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+                self._stats["documents_written_total"] += e.details.get("nInserted", 0)
+                return True
+            self._requeue(name, documents, e)
+        except Exception as e:
+            self._requeue(name, documents, e)
+        return False
+
+    def _requeue(self, name: str, documents: list, error: Exception):
+        self._stats["flush_errors_total"] += 1
+        room = max(0, self.max_events - self._pending)
+        kept = documents[:room]
+        if kept:
+            self._documents.setdefault(name, [])[:0] = kept
+            self._pending += len(kept)
+        self._stats["dropped_total"] += len(documents) - len(kept)
+        logger.warning(f"Writing {len(documents)} {name} events failed, {len(kept)} kept for retry: {error}")
+
+    async def _bump(self, name: str, updates: list) -> bool:
+        """True once the counters are applied; otherwise they are dropped."""
+        try:
+            await self._collections[name].bulk_write(updates, ordered=False)
+            self._stats["counter_updates_total"] += len(updates)
+            return True
+        except Exception as e:
+            self._stats["flush_errors_total"] += 1
+            self._stats["dropped_total"] += len(updates)
+            logger.warning(f"Applying {len(updates)} {name} counter updates failed: {e}")
+            return False
+
+    def metrics(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "pending": self._pending,
+            "max_events": self.max_events,
+            "batch_size": self.batch_size,
+            **self._stats
+        }
+
+
+event_buffer = EventBuffer(
+    max_events=EVENT_BUFFER_MAX_EVENTS,
+    batch_size=EVENT_BUFFER_BATCH_SIZE,
+    flush_interval_seconds=EVENT_BUFFER_FLUSH_INTERVAL_SECONDS,
+    enqueue_timeout_seconds=EVENT_BUFFER_ENQUEUE_TIMEOUT_SECONDS
+)
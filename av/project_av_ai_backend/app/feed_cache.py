@@ -0,0 +1,272 @@
+"""
+Geo-tiled cache for the home feeds (deals, deals-extended, trending, best-price).
+
+Users in the same neighbourhood see nearly the same feed, so each feed is
+computed once per geohash tile (precision 6, about 1.2 x 0.6 km) and category,
+from the tile centre, and kept for a short TTL. The cached list is ranked and
+covers the feed's radius widened by the tile's half-diagonal. Each request then
+recomputes distances from the user's own location, drops shops outside the
+feed's radius, and slices out the requested page, so results match an uncached
+query up to ranking ties.
+
+Entries are invalidated when a product near them changes price, promotion or
+stock (invalidate_for_product/owner/shop). The cache is per worker process:
+invalidation only reaches the worker that handled the write, and other workers
+catch up within the TTL.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+
+from app.utils.distance import haversine
+from app.utils.geohash import geohash
+from app.config import (
+    FEED_CACHE_TTL_SECONDS,
+    FEED_CACHE_MAX_ENTRIES,
+    FEED_CACHE_MAX_ITEMS,
+    FEED_CACHE_GEOHASH_PRECISION
+)
+
+logger = logging.getLogger("uvicorn.error")
+
+# Fields the feed pipelines add for the cache; stripped before items are returned
+SHOP_LAT_FIELD = "_shop_lat"
+SHOP_LNG_FIELD = "_shop_lng"
+
+
+class _Entry:
+    __slots__ = ("items", "category", "expires_at", "centre", "reach_km", "shop_ids", "product_keys", "full",
+                 "boundary_km")
+
+    def __init__(self, items, category, expires_at, centre, reach_km, full, boundary_km):
+        self.items = items
+        self.category = category
+        self.expires_at = expires_at
+        self.centre = centre
+        self.reach_km = reach_km
+        self.shop_ids = {item.get("shop_id") for item in items}
+        # Ids and names: feeds that keep one product per name can swap in another shop's product of that name
+        self.product_keys = {str(item.get("_id")) for item in items} | \
+            {item["product_name"] for item in items if item.get("product_name")}
+        # A full list can only gain a product that outranks its last item; for distance-ordered
+        # feeds that means a shop nearer than boundary_km
+        self.full = full
+        self.boundary_km = boundary_km
+
+
+class FeedCache:
+    """
+    get_page() serves one page of a feed, computing the tile's ranked list
+    through compute(lat, lng, min_km, max_km, limit) on a miss. Concurrent
+    misses on the same tile share one computation.
+    """
+
+    def __init__(self, ttl_seconds: float = 60, max_entries: int = 5000, max_items: int = 200, precision: int = 6):
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self.max_items = max_items
+        self.precision = precision
+        self._entries = OrderedDict()
+        self._inflight = {}
+        # (sequence, lat, lng, shop_id, product) of recent invalidations, checked against results computed meanwhile
+        self._invalidation_seq = 0
+        self._recent_invalidations = deque(maxlen=1024)
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "bypassed": 0,
+            "invalidations": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "compute_ms_total": 0.0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl > 0
+
+    async def get_page(self, feed: str, user_lat: float, user_lng: float, category, skip: int, limit: int,
+                       compute, max_km: float, min_km: float = 0, order_by_distance: bool = False) -> list:
+        skip, limit = max(0, skip), max(0, limit)
+        if not self.enabled or skip + limit > self.max_items:
+            # Deep pages (or a disabled cache) go straight to the database
+            self._stats["bypassed"] += 1
+            items = await compute(user_lat, user_lng, min_km, max_km, skip + limit)
+            return self._localise(items, user_lat, user_lng, min_km, max_km, order_by_distance)[skip:skip + limit]
+
+        tile, centre_lat, centre_lng, margin_km = geohash(user_lat, user_lng, self.precision)
+        key = (feed, tile, category or "All")
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at <= time.monotonic():
+            del self._entries[key]
+            self._stats["expirations"] += 1
+            entry = None
+
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            items = entry.items
+        elif key in self._inflight:
+            self._stats["coalesced"] += 1
+            items = await asyncio.shield(self._inflight[key])
+        else:
+            self._stats["misses"] += 1
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[key] = future
+            seq = self._invalidation_seq
+            started = time.perf_counter()
+            try:
+                items = await compute(centre_lat, centre_lng, max(0.0, min_km - margin_km), max_km + margin_km,
+                                      self.max_items)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                future.set_exception(e)
+                future.exception() # Mark retrieved when nobody else was waiting
+                raise
+            finally:
+                self._inflight.pop(key, None)
+            self._stats["compute_ms_total"] += (time.perf_counter() - started) * 1000
+            future.set_result(items)
+            boundary_km = None
+            if order_by_distance and items and items[-1].get(SHOP_LAT_FIELD) is not None:
+                boundary_km = haversine(centre_lat, centre_lng, items[-1][SHOP_LAT_FIELD], items[-1][SHOP_LNG_FIELD])
+            entry = _Entry(items, key[2], time.monotonic() + self.ttl, (centre_lat, centre_lng), max_km + 2 * margin_km,
+                           len(items) >= self.max_items, boundary_km)
+            # A write while computing may have made this result stale: serve it once, don't keep it
+            if not self._invalidated_since(seq, entry):
+                self._store(key, entry)
+
+        return self._localise(items, user_lat, user_lng, min_km, max_km, order_by_distance)[skip:skip + limit]
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    @staticmethod
+    def _localise(items, user_lat, user_lng, min_km, max_km, order_by_distance):
+        """Copies items with the user's own distance, dropping shops outside [min_km, max_km]."""
+        localised = []
+        for item in items:
+            shop_lat, shop_lng = item.get(SHOP_LAT_FIELD), item.get(SHOP_LNG_FIELD)
+            if shop_lat is None or shop_lng is None:
+                distance = item.get("distance")
+            else:
+                distance = haversine(user_lat, user_lng, shop_lat, shop_lng)
+                if distance < min_km or distance > max_km:
+                    continue
+            public = {k: v for k, v in item.items() if k not in (SHOP_LAT_FIELD, SHOP_LNG_FIELD)}
+            public["distance"] = distance
+            localised.append(public)
+        if order_by_distance:
+            localised.sort(key=lambda item: item["distance"] if item["distance"] is not None else float("inf"))
+        return localised
+
+    @staticmethod
+    def _affects(entry, lat, lng, shop_id, product) -> bool:
+        distance = haversine(entry.centre[0], entry.centre[1], lat, lng)
+        if distance > entry.reach_km:
+            return False
+        if product is not None and (product[0] in entry.product_keys or product[1] in entry.product_keys):
+            return True
+        if product is not None and product[2] and entry.category not in ("All", product[2]):
+            return False # Another category's product can't join this list
+        if not entry.full or (entry.boundary_km is not None and distance <= entry.boundary_km):
+            return True
+        return product is None and (shop_id is None or shop_id in entry.shop_ids)
+
+    def _invalidated_since(self, seq, entry) -> bool:
+        if self._invalidation_seq == seq:
+            return False
+        if not self._recent_invalidations or self._recent_invalidations[0][0] > seq + 1:
+            return True # The log no longer reaches back that far
+        return any(self._affects(entry, lat, lng, shop_id, product)
+                   for event_seq, lat, lng, shop_id, product in self._recent_invalidations if event_seq > seq)
+
+    def invalidate_near(self, lat: float, lng: float, shop_id: str = None, product_id: str = None,
+                        product_name: str = None, category: str = None) -> int:
+        """
+        Drops the entries a product change at a shop at (lat, lng) could
+        affect: those within reach that are not full, would rank the shop
+        above their last item (distance-ordered feeds), or list the changed
+        product (by id or name) - or, when only the shop is known, any of the
+        shop's products. Without either every entry within reach is dropped.
+        Given the product's category, lists for other categories are kept
+        unless they list the product.
+
+        Full sales-ranked lists that don't list the product are kept, so a new
+        entrant to e.g. trending shows up within the TTL.
+        """
+        product = (str(product_id), product_name, category) if product_id is not None else None
+        self._invalidation_seq += 1
+        self._recent_invalidations.append((self._invalidation_seq, lat, lng, shop_id, product))
+        stale = [key for key, entry in self._entries.items() if self._affects(entry, lat, lng, shop_id, product)]
+        for key in stale:
+            del self._entries[key]
+        self._stats["invalidations"] += len(stale)
+        return len(stale)
+
+    def clear(self):
+        self._invalidation_seq += 1
+        self._recent_invalidations.append((self._invalidation_seq, 0.0, 0.0, None, None))
+        self._entries.clear()
+
+    def metrics(self) -> dict:
+        lookups = self._stats["hits"] + self._stats["misses"] + self._stats["coalesced"]
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            **self._stats,
+            "compute_ms_total": round(self._stats["compute_ms_total"], 1),
+            "hit_rate": round((self._stats["hits"] + self._stats["coalesced"]) / lookups, 4) if lookups else None,
+        }
+
+
+feed_cache = FeedCache(FEED_CACHE_TTL_SECONDS, FEED_CACHE_MAX_ENTRIES, FEED_CACHE_MAX_ITEMS, FEED_CACHE_GEOHASH_PRECISION)
+
+
+async def _invalidate_shop(query: dict, what: str, product: dict = None):
+    from app.db import shops_collection # Import here so the cache itself has no database dependency
+    try:
+        shop = await shops_collection.find_one(query, {"location": 1})
+        coordinates = (shop or {}).get("location", {}).get("coordinates")
+        if coordinates and product:
+            feed_cache.invalidate_near(coordinates[1], coordinates[0], str(shop["_id"]),
+                                       product["_id"], product.get("product_name"), product.get("category"))
+        elif coordinates:
+            feed_cache.invalidate_near(coordinates[1], coordinates[0], str(shop["_id"]))
+    except Exception as e:
+        # A failed invalidation must not fail the write; the TTL bounds the staleness
+        logger.warning(f"Feed cache invalidation failed for {what}: {e}")
+
+
+async def invalidate_for_shop(shop_id):
+    from bson import ObjectId
+    if isinstance(shop_id, str):
+        if not ObjectId.is_valid(shop_id):
+            return
+        shop_id = ObjectId(shop_id)
+    await _invalidate_shop({"_id": shop_id}, f"shop {shop_id}")
+
+
+async def invalidate_for_owner(owner_id: str):
+    await _invalidate_shop({"owner_id": owner_id}, f"owner {owner_id}")
+
+
+async def invalidate_for_product(product_id):
+    """Call after the write, or before a delete, so the product can still be found."""
+    from app.db import products_collection
+    try:
+        product = await products_collection.find_one({"_id": product_id}, {"owner_id": 1, "product_name": 1, "category": 1})
+    except Exception as e:
+        logger.warning(f"Feed cache invalidation failed for product {product_id}: {e}")
+        return
+    if product and product.get("owner_id"):
+        await _invalidate_shop({"owner_id": product["owner_id"]}, f"product {product_id}", product)
@@ -0,0 +1,100 @@
+import copy
+import logging
+import os
+
+import numpy as np
+import torch
+
+logger = logging.getLogger("uvicorn.error")
+
+BACKENDS = ("torch", "torch-int8", "onnx")
+
+
+class ImageTower(torch.nn.Module):
+    """The vision half of CLIPModel: pixel values in, projected image embeddings out."""
+
+    def __init__(self, vision_model, visual_projection):
+        super().__init__()
+        self.vision_model = vision_model
+        self.visual_projection = visual_projection
+
+    def forward(self, pixel_values):
+        pooled_output = self.vision_model(pixel_values=pixel_values)[1]
+        return self.visual_projection(pooled_output)
+
+
+class TorchImageEncoder:
+    """The fp32 PyTorch image tower, as shipped in the checkpoint."""
+
+    name = "torch"
+
+    def __init__(self, model):
+        self.tower = ImageTower(model.vision_model, model.visual_projection).eval()
+
+    def encode(self, pixel_values: np.ndarray) -> np.ndarray:
+        with torch.no_grad():
+            return self.tower(torch.from_numpy(pixel_values)).numpy()
+
+
+class QuantizedTorchImageEncoder(TorchImageEncoder):
+    """Image tower with every Linear layer dynamically quantised to int8."""
+
+    name = "torch-int8"
+
+    def __init__(self, model):
+        tower = ImageTower(copy.deepcopy(model.vision_model), copy.deepcopy(model.visual_projection)).eval()
+        self.tower = torch.quantization.quantize_dynamic(tower, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class OnnxImageEncoder:
+    """
+    Image tower exported to ONNX and run with ONNX Runtime on CPU. The export is
+    cached in export_dir, keyed by model name, and reused on the next start.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model, model_name: str, export_dir: str):
+        import onnxruntime as ort
+
+        model_slug = model_name.replace("/", "--")
+        path = os.path.join(export_dir, f"{model_slug}-image.onnx")
+        if not os.path.exists(path):
+            self.export(model, path)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+
+    @staticmethod
+    def export(model, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tower = ImageTower(model.vision_model, model.visual_projection).eval()
+        size = model.config.vision_config.image_size
+        dummy = torch.zeros(1, 3, size, size)
+        tmp_path = f"{path}.tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                tower,
+                (dummy,),
+                tmp_path,
+                input_names=["pixel_values"],
+                output_names=["image_embeds"],
+                dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+                opset_version=14
+            )
+        os.replace(tmp_path, path)
+        logger.info(f"Exported CLIP image tower to {path}")
+
+    def encode(self, pixel_values: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {"pixel_values": pixel_values.astype(np.float32)})[0]
+
+
+def create_image_encoder(backend: str, model, model_name: str, export_dir: str):
+    if backend == "torch":
+        return TorchImageEncoder(model)
+    if backend == "torch-int8":
+        return QuantizedTorchImageEncoder(model)
+    if backend == "onnx":
+        return OnnxImageEncoder(model, model_name, export_dir)
+    raise ValueError(f"Unknown CLIP backend '{backend}'. Must be one of: {', '.join(BACKENDS)}")
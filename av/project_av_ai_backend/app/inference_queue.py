@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class InferenceBatcher:
+    """
+    Collects images submitted by concurrent requests and runs them through one
+    batched forward pass on a worker thread, so the event loop is never blocked.
+    A batch is dispatched once it holds max_batch_size images or the oldest
+    image has waited max_wait_ms, whichever comes first.
+    """
+
+    def __init__(self, predict_batch, max_batch_size: int = 8, max_wait_ms: float = 15, max_queue_size: int = 256):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.max_queue_size = max_queue_size
+        self._queue = None
+        self._worker = None
+        self._batch = [] # Taken off the queue by the worker and not yet answered
+        # A single thread: torch already parallelises one forward pass across cores
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="clip-inference")
+        self._stats = {
+            "requests_total": 0,
+            "batches_total": 0,
+            "failed_batches_total": 0,
+            "inference_seconds_total": 0.0,
+            "last_batch_size": 0,
+            "max_queue_depth": 0,
+            "batch_size_counts": {},
+        }
+
+    async def start(self):
+        if self._worker is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._worker = asyncio.create_task(self._run())
+        logger.info(f"Inference batcher started (max_batch_size={self.max_batch_size}, max_wait_ms={self.max_wait * 1000:g})")
+
+    async def stop(self):
+        """Stops the worker and fails every request still waiting, in flight or queued."""
+        if self._worker is None:
+            return
+        worker, self._worker = self._worker, None
+        worker.cancel()
+        try:
+            await worker
+        except asyncio.CancelledError:
+            pass
+        stopped = RuntimeError("Inference batcher stopped")
+        pending, self._batch = self._batch, []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for _, future in pending:
+            if not future.done():
+                future.set_exception(stopped)
+        self._executor.shutdown(wait=False)
+
+    async def submit(self, image):
+        """Queues an image and waits for its prediction. Blocks while the queue is full."""
+        if self._worker is None:
+            raise RuntimeError("Inference batcher is not running")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image, future))
+        if self._worker is None: # Stopped while this caller waited for room in the queue
+            raise RuntimeError("Inference batcher stopped")
+        self._stats["requests_total"] += 1
+        self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._queue.qsize())
+        return await future
+
+    async def _collect_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = self._batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        # Callers that gave up (e.g. client disconnected) don't need a forward pass
+        return [(image, future) for image, future in batch if not future.done()]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect_batch()
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(self._executor, self.predict_batch, [image for image, _ in batch])
+            except Exception as e:
+                logger.error(f"Batched inference failed for {len(batch)} image(s): {e}", exc_info=True)
+                self._stats["failed_batches_total"] += 1
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                self._batch = []
+                continue
+
+            self._record_batch(len(batch), time.perf_counter() - started)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+            self._batch = []
+
+    def _record_batch(self, size: int, seconds: float):
+        stats = self._stats
+        stats["batches_total"] += 1
+        stats["inference_seconds_total"] += seconds
+        stats["last_batch_size"] = size
+        stats["batch_size_counts"][size] = stats["batch_size_counts"].get(size, 0) + 1
+
+    def metrics(self) -> dict:
+        stats = self._stats
+        batches = stats["batches_total"]
+        batched_images = sum(size * count for size, count in stats["batch_size_counts"].items())
+        return {
+            "running": self._worker is not None,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue_depth": stats["max_queue_depth"],
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "requests_total": stats["requests_total"],
+            "batches_total": batches,
+            "failed_batches_total": stats["failed_batches_total"],
+            "last_batch_size": stats["last_batch_size"],
+            "avg_batch_size": round(batched_images / batches, 2) if batches else 0,
+            "avg_batch_latency_ms": round(stats["inference_seconds_total"] / batches * 1000, 2) if batches else 0,
+            "batch_size_counts": {str(size): count for size, count in sorted(stats["batch_size_counts"].items())},
+        }
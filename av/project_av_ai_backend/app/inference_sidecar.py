@@ -0,0 +1,97 @@
+"""
+Inference sidecar: a single process that owns the CLIP model and serves every
+uvicorn worker over a Unix socket, so model memory does not grow with the
+number of API workers and web workers never run torch themselves.
+
+    python -m app.inference_sidecar --socket /tmp/project-av-clip.sock
+
+Then start the API with INFERENCE_MODE=sidecar (and the same INFERENCE_SOCKET_PATH).
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+
+from PIL import Image
+
+from app.clip_model import ModelNotReadyError
+from app.config import INFERENCE_SOCKET_PATH
+from app.predictor import LocalPredictor, read_message, write_message
+
+logger = logging.getLogger("uvicorn.error")
+
+
+async def _handle_request(predictor: LocalPredictor, header: dict, payload: bytes) -> dict:
+    op = header.get("op")
+    if op == "status":
+        status = await predictor.status()
+        return {"ready": status["ready"], "model": status["model"]}
+    if op == "metrics":
+        return {"metrics": await predictor.metrics()}
+    if op == "predict":
+        if not (await predictor.status())["ready"]:
+            return {"error": "CLIP model is still loading", "status": 503}
+        image = Image.frombytes(header["mode"], tuple(header["size"]), payload)
+        return {"candidates": await predictor.predict(image)}
+    return {"error": f"Unknown op '{op}'", "status": 400}
+
+
+async def _handle_connection(predictor: LocalPredictor, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            try:
+                header, payload = await read_message(reader)
+            except asyncio.IncompleteReadError:
+                break # Client closed the connection
+            try:
+                response = await _handle_request(predictor, header, payload)
+            except ModelNotReadyError as e:
+                response = {"error": str(e), "status": 503}
+            except Exception as e:
+                logger.error(f"Sidecar request failed: {e}", exc_info=True)
+                response = {"error": str(e), "status": 500}
+            await write_message(writer, response)
+    except Exception as e:
+        logger.error(f"Sidecar connection error: {e}")
+    finally:
+        writer.close()
+
+
+async def serve(socket_path: str):
+    predictor = LocalPredictor()
+    await predictor.start()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path) # Stale socket from a previous run
+    server = await asyncio.start_unix_server(
+        lambda reader, writer: _handle_connection(predictor, reader, writer),
+        path=socket_path
+    )
+    os.chmod(socket_path, 0o660)
+    logger.info(f"✅ Inference sidecar listening on {socket_path}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with server:
+        await stop.wait()
+
+    await predictor.stop()
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    logger.info("Inference sidecar shut down.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve CLIP predictions to API workers over a Unix socket.")
+    parser.add_argument("--socket", default=INFERENCE_SOCKET_PATH)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(args.socket))
+
+
+if __name__ == "__main__":
+    main()
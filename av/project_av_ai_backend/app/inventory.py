@@ -0,0 +1,223 @@
+import logging
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.db import products_collection, stock_holds_collection
+from app.config import STOCK_HOLD_TTL_SECONDS
+
+logger = logging.getLogger("uvicorn.error")
+
+# Per-line outcomes reported by Inventory.reserve()
+RESERVED = "reserved"
+INSUFFICIENT_STOCK = "insufficient_stock"
+NOT_FOUND = "not_found"
+ROLLED_BACK = "rolled_back" # Had the stock, but not kept because another line failed
+
+# Server error code for a failed $convert/$toInt; _take_line() raises it on purpose for a short line
+_CONVERSION_FAILURE = 241
+
+# Hold states stored in stock_holds.status
+HELD = "held"
+COMMITTED = "committed"
+RELEASED = "released"
+EXPIRED = "expired"
+
+
+def merge_lines(items) -> dict:
+    """
+    {ObjectId: quantity} from (product_id, quantity) pairs, summing repeated
+    products. Raises ValueError for a bad id or a quantity below 1.
+    """
+    lines = {}
+    for product_id, quantity in items:
+        if isinstance(product_id, str):
+            if not ObjectId.is_valid(product_id):
+                raise ValueError(f"Invalid product id: {product_id}")
+            product_id = ObjectId(product_id)
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+            raise ValueError(f"Invalid quantity {quantity!r} for product {product_id}")
+        lines[product_id] = lines.get(product_id, 0) + quantity
+    return lines
+
+
+class Inventory:
+    """
+    Oversell-safe stock reservations.
+
+    Stock is only taken with a conditional decrement guarded on
+    count >= quantity, so concurrent checkouts can never drive a count
+    negative. reserve() takes a whole cart in one ordered bulk write. A line
+    without enough stock fails its update, which stops the bulk write there,
+    and the lines before it are put back, so a cart is reserved all or
+    nothing in a constant number of round trips.
+
+    A hold is a reservation with an expiry, kept in stock_holds. It covers
+    the walk to the shop. The stock is taken when the hold is created, and
+    then either claimed by checkout, released by the customer, or returned by
+    expire_holds() once expires_at passes. Every state change is a
+    conditional update on status, so a hold is claimed, released or expired
+    exactly once even with several workers sweeping.
+    """
+
+    def __init__(self, products, holds, hold_ttl_seconds: float = 900):
+        self.products = products
+        self.holds = holds
+        self.hold_ttl = hold_ttl_seconds
+
+    @staticmethod
+    def _take_line(product_id, quantity: int) -> UpdateOne:
+        """
+        Decrements count by quantity only if count >= quantity. Otherwise the update
+        errors on purpose, converting a non-numeric string: an ordered bulk write stops
+        at the first error and reports its index, so reserve() knows exactly which
+        lines were taken. The string depends on the document so it can't be
+        evaluated (and fail) ahead of the $cond.
+        """
+        count = {"$ifNull": ["$count", 0]}
+        return UpdateOne({"_id": product_id}, [{"$set": {"count": {"$cond": [
+            {"$gte": [count, quantity]},
+            {"$subtract": [count, quantity]},
+            {"$toInt": {"$concat": ["insufficient stock: ", {"$toString": count}]}}
+        ]}}}])
+
+    async def put_back(self, lines: dict):
+        """Returns previously taken stock, one bulk write for all lines."""
+        if lines:
+            await self.products.bulk_write([
+                UpdateOne({"_id": product_id}, {"$inc": {"count": quantity}})
+                for product_id, quantity in lines.items()
+            ], ordered=False)
+
+    async def reserve(self, lines: dict):
+        """
+        Takes every line or none. Returns (ok, results) with one result per
+        line: product_id, quantity, status and, when the cart fails, the
+        count found.
+        """
+        if not lines:
+            return True, []
+        items = list(lines.items())
+        short = None
+        try:
+            result = await self.products.bulk_write(
+                [self._take_line(product_id, quantity) for product_id, quantity in items], ordered=True
+            )
+            if result.matched_count == len(items):
+                return True, [{"product_id": str(product_id), "quantity": quantity, "status": RESERVED,
+                               "available": None} for product_id, quantity in items]
+            attempted = len(items) # Every line ran; some products don't exist
+        except BulkWriteError as e:
+            if not e.details.get("writeErrors"):
+                raise
+            error = e.details["writeErrors"][0]
+            attempted = error["index"]
+            # Lines before the failing one were taken; a missing product's put-back matches nothing
+            await self.put_back(dict(items[:attempted]))
+            if error.get("code") != _CONVERSION_FAILURE:
+                raise
+            short = attempted
+        else:
+            await self.put_back(lines)
+
+        found = await self.products.find({"_id": {"$in": list(lines)}}, {"count": 1}).to_list(None)
+        counts = {product["_id"]: product.get("count") for product in found}
+        results = []
+        for i, (product_id, quantity) in enumerate(items):
+            available = counts.get(product_id)
+            if product_id not in counts:
+                status = NOT_FOUND
+            elif i == short or (i > attempted and (available or 0) < quantity):
+                status = INSUFFICIENT_STOCK
+            else:
+                status = ROLLED_BACK
+            results.append({"product_id": str(product_id), "quantity": quantity, "status": status,
+                            "available": available if status == INSUFFICIENT_STOCK else None})
+        return False, results
+
+    async def create_hold(self, user_id: str, lines: dict, ttl_seconds: float = None):
+        """Reserves lines for ttl_seconds. Returns (hold document or None, per-line results)."""
+        ok, results = await self.reserve(lines)
+        if not ok:
+            return None, results
+        now = datetime.utcnow()
+        hold = {
+            "_id": ObjectId(),
+            "user_id": user_id,
+            "items": [{"product_id": product_id, "quantity": quantity} for product_id, quantity in lines.items()],
+            "status": HELD,
+            "created_at": now,
+            "expires_at": now + timedelta(seconds=ttl_seconds or self.hold_ttl)
+        }
+        try:
+            await self.holds.insert_one(hold)
+        except Exception:
+            await self.put_back(lines)
+            raise
+        return hold, results
+
+    async def _transition(self, query: dict, status: str):
+        return await self.holds.find_one_and_update(
+            {**query, "status": HELD},
+            {"$set": {"status": status, f"{status}_at": datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    @staticmethod
+    def _lines(hold: dict) -> dict:
+        return {item["product_id"]: item["quantity"] for item in hold.get("items", [])}
+
+    async def release_hold(self, hold_id: ObjectId, user_id: str = None):
+        """The customer gave up: returns the stock and its lines, or None if the hold is no longer held."""
+        query = {"_id": hold_id}
+        if user_id is not None:
+            query["user_id"] = user_id
+        hold = await self._transition(query, RELEASED)
+        if hold is None:
+            return None
+        lines = self._lines(hold)
+        await self.put_back(lines)
+        return lines
+
+    async def claim_hold(self, hold_id: ObjectId, user_id: str):
+        """Checkout takes over an unexpired hold; returns its lines, or None if it can't be claimed."""
+        hold = await self._transition({"_id": hold_id, "user_id": user_id, "expires_at": {"$gt": datetime.utcnow()}},
+                                      COMMITTED)
+        return self._lines(hold) if hold else None
+
+    async def unclaim_hold(self, hold_id: ObjectId):
+        """Undoes claim_hold() when the checkout that claimed it fails; the stock is still taken."""
+        await self.holds.update_one(
+            {"_id": hold_id, "status": COMMITTED},
+            {"$set": {"status": HELD}, "$unset": {"committed_at": ""}}
+        )
+
+    async def expire_holds(self, limit: int = 500) -> dict:
+        """
+        Returns the stock of holds past expires_at, and {product_id: quantity}
+        of what went back. Safe to run from every worker at once.
+        """
+        expired = 0
+        returned = {}
+        due = await self.holds.find(
+            {"status": HELD, "expires_at": {"$lte": datetime.utcnow()}}, {"_id": 1}
+        ).limit(limit).to_list(None)
+        for candidate in due:
+            try:
+                hold = await self._transition({"_id": candidate["_id"]}, EXPIRED)
+                if hold is not None: # Another worker (or a checkout) may have got there first
+                    lines = self._lines(hold)
+                    await self.put_back(lines)
+                    for product_id, quantity in lines.items():
+                        returned[product_id] = returned.get(product_id, 0) + quantity
+                    expired += 1
+            except Exception as e:
+                logger.warning(f"Expiring stock hold {candidate['_id']} failed: {e}")
+        if expired:
+            logger.info(f"Returned stock from {expired} expired holds")
+        return returned
+
+
+inventory = Inventory(products_collection, stock_holds_collection, STOCK_HOLD_TTL_SECONDS)
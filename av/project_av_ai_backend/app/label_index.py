@@ -0,0 +1,256 @@
+import threading
+
+import numpy as np
+
+
+def _log_sum_exp(logits: np.ndarray) -> np.ndarray:
+    """log(sum(exp(logits))) along the last axis, without overflow."""
+    top = logits.max(axis=-1, keepdims=True)
+    return (top + np.log(np.exp(logits - top).sum(axis=-1, keepdims=True))).squeeze(-1)
+
+
+def _softmax_top_k(scores: np.ndarray, rows: np.ndarray, labels: list, k: int, logit_scale: float,
+                   log_normaliser: float = None) -> list:
+    """
+    The k most probable scored rows as label/probability dicts. Probabilities are
+    exp(logit - log_normaliser); by default the softmax is taken over the scored rows.
+    """
+    if scores.size == 0:
+        return []
+    logits = scores * logit_scale
+    if log_normaliser is None:
+        log_normaliser = _log_sum_exp(logits)
+    probs = np.exp(logits - log_normaliser)
+    k = min(k, probs.size)
+    top = np.argpartition(-probs, k - 1)[:k]
+    top = top[np.argsort(-probs[top])]
+    return [{"label": labels[rows[i]], "probability": float(probs[i])} for i in top]
+
+
+class BruteForceLabelIndex:
+    """
+    Exact index: every query is scored against every label with one matrix multiply.
+    Labels can be added or removed in place; removed rows are tombstoned and
+    compacted away once they make up half of the storage.
+    """
+
+    def __init__(self, labels: list, embeddings: np.ndarray):
+        self.dim = embeddings.shape[1]
+        self._lock = threading.RLock()
+        self._vectors = np.empty((0, self.dim), dtype=np.float32)
+        self._labels = []
+        self._alive = np.empty(0, dtype=bool)
+        self._rows = {}  # label -> row
+        self._size = 0
+        self.add(labels, embeddings)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, label):
+        return label in self._rows
+
+    def labels(self) -> list:
+        with self._lock:
+            return list(self._rows)
+
+    def add(self, labels: list, embeddings: np.ndarray):
+        """Adds labels, replacing the vector of any label that is already indexed."""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        # A label repeated within the batch keeps its last vector; it must not be both added and updated
+        batch = dict(zip(labels, embeddings))
+        with self._lock:
+            new_rows = []
+            for label, vector in batch.items():
+                row = self._rows.get(label)
+                if row is None:
+                    row = self._append(label, vector)
+                    new_rows.append(row)
+                else:
+                    self._vectors[row] = vector
+                    self._on_update(row)
+            self._on_add(new_rows)
+
+    def remove(self, labels: list) -> int:
+        with self._lock:
+            removed = 0
+            for label in labels:
+                row = self._rows.pop(label, None)
+                if row is not None:
+                    self._alive[row] = False
+                    self._on_remove(row)
+                    removed += 1
+            if self._size and len(self._rows) < self._size // 2:
+                self._compact()
+            return removed
+
+    def search(self, queries: np.ndarray, k: int, logit_scale: float = 1.0) -> list:
+        """
+        Returns, per query, the k most probable labels. Probabilities are the softmax of
+        logit_scale * cosine similarity over every alive label.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        with self._lock:
+            rows = np.flatnonzero(self._alive[:self._size])
+            scores = queries @ self._vectors[rows].T
+            return [_softmax_top_k(row_scores, rows, self._labels, k, logit_scale) for row_scores in scores]
+
+    def _append(self, label, vector) -> int:
+        if self._size == self._vectors.shape[0]:
+            capacity = max(1024, self._size * 2)
+            vectors = np.empty((capacity, self.dim), dtype=np.float32)
+            vectors[:self._size] = self._vectors[:self._size]
+            alive = np.zeros(capacity, dtype=bool)
+            alive[:self._size] = self._alive[:self._size]
+            self._vectors, self._alive = vectors, alive
+        row = self._size
+        self._vectors[row] = vector
+        self._alive[row] = True
+        self._labels.append(label)
+        self._rows[label] = row
+        self._size += 1
+        return row
+
+    def _compact(self):
+        keep = np.flatnonzero(self._alive[:self._size])
+        labels = [self._labels[row] for row in keep]
+        vectors = self._vectors[keep].copy()
+        self._vectors = np.empty((0, self.dim), dtype=np.float32)
+        self._labels, self._alive, self._rows, self._size = [], np.empty(0, dtype=bool), {}, 0
+        self._on_reset()
+        for label, vector in zip(labels, vectors):
+            self._append(label, vector)
+        self._on_add(list(range(self._size)))
+
+    # Hooks for subclasses that keep extra structure over the rows
+    def _on_add(self, rows: list):
+        pass
+
+    def _on_update(self, row: int):
+        pass
+
+    def _on_remove(self, row: int):
+        pass
+
+    def _on_reset(self):
+        pass
+
+
+class IVFLabelIndex(BruteForceLabelIndex):
+    """
+    Approximate inverted-file index for large catalogues. Labels are bucketed under
+    the nearest of n_lists spherical k-means centroids; a query only scores the
+    labels in its n_probe nearest buckets. Adding a label assigns it to a bucket
+    without retraining, so the centroids are trained once on the initial catalogue.
+
+    Probabilities are normalised over the whole catalogue, as in BruteForceLabelIndex,
+    so a confidence cutoff means roughly the same for both indexes. The probed labels
+    contribute their exact logits; every other bucket is estimated as its size times
+    exp(logit of its centroid). The estimate is approximate, but it needs no more
+    than the centroid scores the probe already computed.
+    """
+
+    def __init__(self, labels: list, embeddings: np.ndarray, n_lists: int = None, n_probe: int = 8,
+                 train_iterations: int = 10, max_training_points: int = 50000, seed: int = 0):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if n_lists is None:
+            n_lists = int(np.clip(np.sqrt(len(embeddings)), 1, 4096))
+        self.n_probe = max(1, n_probe)
+        self._centroids = self._train(embeddings, n_lists, train_iterations, max_training_points, seed)
+        self._assignment = np.empty(0, dtype=np.int32)
+        self._lists = [[] for _ in range(len(self._centroids))]
+        self._list_arrays = {}
+        self._list_sizes = np.zeros(len(self._centroids), dtype=np.int64) # Alive rows per bucket
+        super().__init__(labels, embeddings)
+
+    @staticmethod
+    def _train(embeddings, n_lists, iterations, max_points, seed) -> np.ndarray:
+        rng = np.random.default_rng(seed)
+        sample = embeddings
+        if len(sample) > max_points:
+            sample = sample[rng.choice(len(sample), max_points, replace=False)]
+        n_lists = max(1, min(n_lists, len(sample)))
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = sample[assignment == c]
+                if len(members):
+                    centroids[c] = members.sum(axis=0)
+            centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-12
+        return centroids.astype(np.float32)
+
+    def search(self, queries: np.ndarray, k: int, logit_scale: float = 1.0) -> list:
+        queries = np.asarray(queries, dtype=np.float32)
+        n_probe = min(self.n_probe, len(self._centroids))
+        results = []
+        with self._lock:
+            centroid_scores = queries @ self._centroids.T
+            probes = np.argpartition(-centroid_scores, n_probe - 1, axis=1)[:, :n_probe]
+            for query, lists, centroid_logits in zip(queries, probes, centroid_scores * logit_scale):
+                rows = np.concatenate([self._list_rows(c) for c in lists])
+                scores = self._vectors[rows] @ query
+                if scores.size == 0:
+                    results.append([])
+                    continue
+                # Unprobed buckets stand in for their labels: log(size) + centroid logit each
+                unprobed = self._list_sizes > 0
+                unprobed[lists] = False
+                log_normaliser = _log_sum_exp(np.concatenate([
+                    scores * logit_scale,
+                    np.log(self._list_sizes[unprobed]) + centroid_logits[unprobed]
+                ]))
+                results.append(_softmax_top_k(scores, rows, self._labels, k, logit_scale, log_normaliser))
+        return results
+
+    def _list_rows(self, c: int) -> np.ndarray:
+        rows = self._list_arrays.get(c)
+        if rows is None:
+            rows = np.fromiter((r for r in self._lists[c] if self._alive[r]), dtype=np.int64)
+            self._list_arrays[c] = rows
+        return rows
+
+    def _assign(self, rows: list):
+        if not rows:
+            return
+        rows = np.asarray(rows)
+        if len(self._assignment) < self._vectors.shape[0]:
+            assignment = np.zeros(self._vectors.shape[0], dtype=np.int32)
+            assignment[:len(self._assignment)] = self._assignment
+            self._assignment = assignment
+        for start in range(0, len(rows), 65536):
+            chunk = rows[start:start + 65536]
+            self._assignment[chunk] = np.argmax(self._vectors[chunk] @ self._centroids.T, axis=1)
+        for row in rows:
+            c = int(self._assignment[row])
+            self._lists[c].append(int(row))
+            self._list_sizes[c] += 1
+            self._list_arrays.pop(c, None)
+
+    def _on_add(self, rows: list):
+        self._assign(rows)
+
+    def _on_update(self, row: int):
+        c = int(self._assignment[row])
+        self._lists[c].remove(row)
+        self._list_sizes[c] -= 1
+        self._list_arrays.pop(c, None)
+        self._assign([row])
+
+    def _on_remove(self, row: int):
+        c = int(self._assignment[row])
+        self._list_sizes[c] -= 1
+        self._list_arrays.pop(c, None)
+
+    def _on_reset(self):
+        self._assignment = np.empty(0, dtype=np.int32)
+        self._lists = [[] for _ in range(len(self._centroids))]
+        self._list_arrays = {}
+        self._list_sizes = np.zeros(len(self._centroids), dtype=np.int64)
+
+
+def build_label_index(labels: list, embeddings: np.ndarray, ann_threshold: int = 20000, n_probe: int = 8):
+    """Exact brute force for small catalogues, IVF once the catalogue reaches ann_threshold labels."""
+    if len(labels) >= ann_threshold:
+        return IVFLabelIndex(labels, embeddings, n_probe=n_probe)
+    return BruteForceLabelIndex(labels, embeddings)
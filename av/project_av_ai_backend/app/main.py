@@ -10,7 +10,6 @@ from pydantic import BaseModel
 from dateutil.relativedelta import relativedelta  # Add this at top
 from .routes.auth import create_access_token 
 from typing import List
-from pymongo import MongoClient
 from pymongo import ReturnDocument
 import os
 from fastapi.responses import JSONResponse
@@ -26,9 +25,13 @@ import cloudinary.uploader
 from fastapi import Form, File, UploadFile
 from pydantic import BaseModel
 from datetime import datetime, timedelta
-from app.routes.shops import haversine
+from app.routes.shops import haversine, serialize_doc
 from datetime import datetime, timedelta, timezone
-from app.db import orders_collection
+from app.db import (
+    client, db, products_collection, cart_collection, shops_collection, rewards_collection, users_collection,
+    payments_collection, product_views_collection, product_sales_collection, orders_collection,
+    connect_db, close_db, pool_metrics, shop_products_lookup
+)
 from PIL import ImageDraw, ImageFont
 
 from fastapi.responses import HTMLResponse
@@ -71,13 +74,44 @@ import aiofiles.os
 import uuid
 import os
 from io import BytesIO
-from .clip_model import predict_product_name
+from .clip_model import best_label, ModelNotReadyError
+from app.predictor import create_predictor
+from app.upload_worker import ImageUploadWorker
+from app.temp_files import TempFileStore
+from app.search import search_fields
+from app.feed_cache import feed_cache, invalidate_for_owner, invalidate_for_product, SHOP_LAT_FIELD, SHOP_LNG_FIELD
+from app import price_index
+from app.inventory import inventory, merge_lines
+from app.checkout import checkout_writer
+from app.event_buffer import event_buffer, EventBufferFull
+from app.utils.image_io import read_upload_limited, decode_for_inference
+from app.config import (
+    PREDICTION_MAX_TOP_K,
+    MODEL_READY_TIMEOUT_SECONDS,
+    MAX_UPLOAD_BYTES,
+    IMAGE_DECODE_MIN_SIDE,
+    UPLOAD_CONCURRENCY,
+    UPLOAD_MAX_QUEUE_SIZE,
+    UPLOAD_MAX_ATTEMPTS,
+    UPLOAD_RETRY_BASE_SECONDS,
+    UPLOAD_RETRY_MAX_SECONDS,
+    UPLOAD_RESUME_INTERVAL_SECONDS,
+    TEMP_UPLOAD_TTL_SECONDS,
+    TEMP_UPLOAD_CLAIMED_TTL_SECONDS,
+    TEMP_UPLOAD_MAX_BYTES,
+    TEMP_UPLOAD_SWEEP_INTERVAL_SECONDS,
+    CHECKOUT_TRANSACTIONS,
+    STOCK_HOLD_MAX_TTL_SECONDS,
+    STOCK_HOLD_SWEEP_INTERVAL_SECONDS
+)
+import asyncio
 
 from html import escape
 from bson import ObjectId  # Added for MongoDB ObjectId handling
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from app.notifications import ( # Import your new notification functions
     send_owner_morning_reminder,
     send_owner_evening_stats,
@@ -108,6 +142,28 @@ def simple_test_job():
 
 TEMP_UPLOAD_DIR = "temp_uploads"
 
+# Shared by all /upload-and-predict/ requests so concurrent uploads are classified together.
+# INFERENCE_MODE=sidecar hands images to app/inference_sidecar.py instead of loading CLIP here.
+product_predictor = create_predictor()
+
+# Photos from /upload-and-predict/ wait here for /add-product/; unclaimed ones expire
+temp_files = TempFileStore(
+    TEMP_UPLOAD_DIR,
+    ttl_seconds=TEMP_UPLOAD_TTL_SECONDS,
+    claimed_ttl_seconds=TEMP_UPLOAD_CLAIMED_TTL_SECONDS,
+    max_bytes=TEMP_UPLOAD_MAX_BYTES
+)
+
+# Uploads product images from temp_files to Cloudinary for /add-product/
+image_upload_worker = ImageUploadWorker(
+    temp_files,
+    concurrency=UPLOAD_CONCURRENCY,
+    max_queue_size=UPLOAD_MAX_QUEUE_SIZE,
+    max_attempts=UPLOAD_MAX_ATTEMPTS,
+    retry_base_seconds=UPLOAD_RETRY_BASE_SECONDS,
+    retry_max_seconds=UPLOAD_RETRY_MAX_SECONDS
+)
+
 VALID_CATEGORIES = [
     "Kirana",
     "Snacks",
@@ -119,10 +175,6 @@ VALID_CATEGORIES = [
     "Others"
 ]
 
-class SaleData(BaseModel):
-    product_id: str
-    shop_id: str
-    quantity: int
 # ADD THIS HELPER FUNCTION
 def safe_object_id(id_str: str):
     try:
@@ -151,6 +203,19 @@ ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 
 app = FastAPI(debug=True)
 
+# Image uploads are rejected from the Content-Length header before the multipart body is parsed.
+# Registered before CORSMiddleware so the 413 still carries CORS headers.
+UPLOAD_LIMITED_PATHS = {"/upload-and-predict/"}
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    if request.method == "POST" and request.url.path in UPLOAD_LIMITED_PATHS:
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES:
+            return JSONResponse(status_code=413, content={"error": "File too large"})
+    return await call_next(request)
+
 # ======== ADDED CORS MIDDLEWARE ========
 app.add_middleware(
     CORSMiddleware,
@@ -165,9 +230,9 @@ app.include_router(auth_router, prefix="/auth")
 app.include_router(referral.router, prefix="/referral")
 
 # ✅ ADDED: New function to update onboarding status
-def update_user_onboarding_status(owner_id):
+async def update_user_onboarding_status(owner_id):
     try:
-        users_collection.update_one(
+        await users_collection.update_one(
             {"uid": owner_id},
             {"$set": {"onboardingDone": True}}
         )
@@ -252,27 +317,13 @@ def sanitize_input(text: str) -> str:
 
 
 @app.on_event("startup")
-def startup_db_client():
+async def startup_db_client():
     MONGO_URI = os.getenv("MONGO_URI")
     if not MONGO_URI:
         raise ValueError("MONGO_URI environment variable not set")
-    
-    global client, db, products_collection, cart_collection, shops_collection, rewards_collection, users_collection, payments_collection
-    
-    client = MongoClient(MONGO_URI)
-    db = client["project_av"]
-    products_collection = db["products"]
-    cart_collection = db["cart"]
-    shops_collection = db["shops"]
-    rewards_collection = db["rewards"]
-    users_collection = db["users"]
-    payments_collection = db["payments"]
-    
-    # Add new collections
-    global product_views_collection, product_sales_collection
-    product_views_collection = db["product_views"]
-    product_sales_collection = db["product_sales"]
-    
+
+    # The shared client from app.db: ping, warm the pool and create indexes before serving traffic
+    await connect_db()
     print("✅ Connected to MongoDB with payments collection")  # Updated message
     if not os.path.exists(TEMP_UPLOAD_DIR):
         os.makedirs(TEMP_UPLOAD_DIR)
@@ -292,6 +343,13 @@ def startup_db_client():
     # Add more customer jobs here (afternoon, night etc.)
     scheduler.add_job(send_subscription_reminders, CronTrigger(hour=9, minute=0))
 
+    # Picks up image uploads that overflowed the queue or were left by another worker process
+    scheduler.add_job(image_upload_worker.resume_pending, IntervalTrigger(seconds=UPLOAD_RESUME_INTERVAL_SECONDS))
+    # Deletes expired/abandoned temp uploads and enforces the disk cap (runs on the scheduler's thread pool)
+    scheduler.add_job(temp_files.sweep, IntervalTrigger(seconds=TEMP_UPLOAD_SWEEP_INTERVAL_SECONDS), next_run_time=datetime.now(timezone.utc))
+    # Give back the stock of holds nobody checked out (app/inventory.py)
+    scheduler.add_job(expire_stock_holds, IntervalTrigger(seconds=STOCK_HOLD_SWEEP_INTERVAL_SECONDS), next_run_time=datetime.now(timezone.utc))
+
     scheduler.start()
     print(f"✅ Notification scheduler started with {len(scheduler.get_jobs())} jobs.")
     # --- END SCHEDULER SETUP ---
@@ -302,34 +360,103 @@ def startup_db_client():
             api_key=os.getenv("CLOUDINARY_API_KEY"),
             api_secret=os.getenv("CLOUDINARY_API_SECRET"),
         )
+        # Points uploads at another API host, e.g. scripts/fake_cloudinary.py in local testing
+        if os.getenv("CLOUDINARY_UPLOAD_PREFIX"):
+            cloudinary.config(upload_prefix=os.getenv("CLOUDINARY_UPLOAD_PREFIX"))
         print("✅ Configured Cloudinary")
     except Exception as e:
         print(f"❌ Cloudinary configuration failed: {e}")
 
 # MongoDB connection check for health endpoint
-def check_mongodb_connection():
+async def check_mongodb_connection():
     try:
         # Try to list databases to check connection
-        client.list_database_names()
+        await client.list_database_names()
         return True
     except pymongo.errors.ConnectionFailure:
         return False
     except Exception:
         return False
 
+@app.on_event("startup")
+async def start_product_predictor():
+    await product_predictor.start()
+
+@app.on_event("startup")
+async def start_image_upload_worker():
+    await image_upload_worker.start()
+
+@app.on_event("startup")
+async def start_event_buffer():
+    await event_buffer.start()
+
 @app.on_event("shutdown")
 async def shutdown_scheduler():
     if scheduler.running:
         scheduler.shutdown(wait=False)
         logger.info("Notification scheduler shut down.")        
 
+@app.on_event("shutdown")
+async def stop_product_predictor():
+    await product_predictor.stop()
+
+@app.on_event("shutdown")
+async def stop_image_upload_worker():
+    await image_upload_worker.stop()
+
+@app.on_event("shutdown")
+async def drain_event_buffer():
+    await event_buffer.stop()
+
+# Registered last so the upload worker, event buffer and scheduler are stopped before the pool goes away
+@app.on_event("shutdown")
+async def close_db_client():
+    close_db()
+    logger.info("MongoDB client closed.")
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
-    if check_mongodb_connection():
+    if await check_mongodb_connection():
         return JSONResponse(content={"status": "ok", "database": "connected"})
     return JSONResponse(content={"status": "error", "database": "disconnected"}, status_code=500)
 
+@app.get("/ready")
+async def readiness_check():
+    """Reports whether the product classifier has finished loading (unlike /health, which checks MongoDB)."""
+    status = await product_predictor.status()
+    if status["ready"]:
+        return {"status": "ready", "inference": status}
+    return JSONResponse(content={"status": "not_ready", "inference": status}, status_code=503)
+
+@app.get("/inference/metrics")
+async def inference_metrics():
+    """Queue depth and batch-size statistics for the product classifier."""
+    try:
+        return await product_predictor.metrics()
+    except ModelNotReadyError as e:
+        return JSONResponse(status_code=503, content={"error": str(e)})
+
+@app.get("/uploads/metrics")
+async def upload_metrics():
+    """Queue depth, retries and outcomes of background product image uploads, and temp disk usage."""
+    return {**image_upload_worker.metrics(), "temp_files": temp_files.metrics()}
+
+@app.get("/events/metrics")
+async def event_metrics():
+    """Pending, written and dropped telemetry events in the write-behind buffer."""
+    return event_buffer.metrics()
+
+@app.get("/db/metrics")
+async def db_metrics():
+    """Connection pool usage of this worker's shared MongoDB client."""
+    return pool_metrics()
+
+@app.get("/feeds/metrics")
+async def feed_metrics():
+    """Hit rate and invalidations of this worker's home feed cache."""
+    return feed_cache.metrics()
+
 # ======== UPDATED TOKEN VERIFICATION ENDPOINT ========
 @app.get("/verify-token")
 async def verify_token(authorization: str = Header(None)):
@@ -342,7 +469,7 @@ async def verify_token(authorization: str = Header(None)):
         user_id = payload.get("sub")
         
         # Fetch user from database
-        user = users_collection.find_one({"_id": ObjectId(user_id)})
+        user = await users_collection.find_one({"_id": ObjectId(user_id)})
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
@@ -371,7 +498,7 @@ async def register_fcm_token(request: FcmTokenRequest):
         # Use $addToSet to add the token only if it's not already in the list
         # Use upsert=True to create the user document if it doesn't exist (e.g., first login)
         # though ideally user creation happens at signup/login.
-        result = users_collection.update_one(
+        result = await users_collection.update_one(
             {"_id": user_obj_id},
             {"$addToSet": {"fcm_tokens": request.token}},
             upsert=False # Set to True ONLY if you want to create user here
@@ -392,101 +519,56 @@ async def register_fcm_token(request: FcmTokenRequest):
         raise HTTPException(status_code=500, detail="Could not register FCM token.")
 
 @app.post("/upload-and-predict/")
-async def upload_and_predict(file: UploadFile = File(...)):
+async def upload_and_predict(file: UploadFile = File(...), top_k: int = Query(None, ge=1, le=PREDICTION_MAX_TOP_K)):
     """
     Uploads an image, saves it temporarily, and runs prediction.
     Returns the predicted name and a temporary ID for the saved file.
+    With ?top_k=N the N best labels and their probabilities are returned as well.
     """
     try:
         if file.content_type not in ["image/jpeg", "image/png"]:
             raise HTTPException(status_code=400, detail="Invalid file type")
         
-        contents = await file.read()
-        if len(contents) > 5 * 1024 * 1024: # 5MB limit
-            raise HTTPException(status_code=400, detail="File too large")
-        
-        # 1. Run prediction from memory
-        img = Image.open(BytesIO(contents))
-        predicted_name = predict_product_name(img)
+        # Read in chunks, stopping as soon as the size limit is crossed
+        contents = await read_upload_limited(file, MAX_UPLOAD_BYTES)
+
+        # 0. Give a cold model a bounded amount of time to finish loading
+        try:
+            if not await product_predictor.wait_until_ready(MODEL_READY_TIMEOUT_SECONDS):
+                raise ModelNotReadyError("CLIP model is still loading")
+
+            # 1. Decode at reduced resolution and run prediction (batched with other uploads, off the event loop)
+            img = await asyncio.to_thread(decode_for_inference, contents, IMAGE_DECODE_MIN_SIDE)
+            candidates = await product_predictor.predict(img)
+        except ModelNotReadyError:
+            return JSONResponse(
+                status_code=503,
+                content={"error": "Product recognition is warming up. Please try again shortly.", "inference": await product_predictor.status()},
+                headers={"Retry-After": "5"}
+            )
+        predicted_name = best_label(candidates)
         
-        # 2. Save file temporarily with a unique name
+        # 2. Save file temporarily with a unique name (expires unless /add-product/ claims it)
         # Get file extension (e.g., .jpg)
-        file_extension = os.path.splitext(file.filename)[1] 
-        temp_image_id = f"{uuid.uuid4()}{file_extension}"
-        temp_file_path = os.path.join(TEMP_UPLOAD_DIR, temp_image_id)
-        
-        async with aiofiles.open(temp_file_path, "wb") as out_file:
-            await out_file.write(contents)
+        file_extension = os.path.splitext(file.filename or "")[1].lower()
+        if file_extension not in (".jpg", ".jpeg", ".png"):
+            file_extension = ".png" if file.content_type == "image/png" else ".jpg"
+        temp_image_id = await asyncio.to_thread(temp_files.save, contents, file_extension)
         
         # 3. Return both results to the app
-        return {"predicted_name": predicted_name, "temp_image_id": temp_image_id}
+        response = {"predicted_name": predicted_name, "temp_image_id": temp_image_id}
+        if top_k:
+            response["candidates"] = candidates[:top_k]
+        return response
     
+    except HTTPException as e:
+        return JSONResponse(status_code=e.status_code, content={"error": e.detail})
     except Exception as e:
         logger.error(f"Error in /upload-and-predict: {traceback.format_exc()}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-# HELPER FUNCTION FOR BACKGROUND IMAGE UPLOAD
-# HELPER FUNCTION FOR BACKGROUND IMAGE UPLOAD
-async def upload_image_and_update_db(temp_image_id: str, product_id: ObjectId): 
-    """
-    This function runs in the background. 
-    It uploads the image to Cloudinary (FORCING PNG to keep transparency) and updates MongoDB.
-    """
-    temp_file_path = os.path.join(TEMP_UPLOAD_DIR, temp_image_id)
-    try:
-        if not os.path.exists(temp_file_path):
-            logger.error(f"BG Upload Failed: Temp file {temp_file_path} not found for product {product_id}.")
-            products_collection.update_one({"_id": product_id},{"$set": {"status": "upload_failed"}})
-            return
-
-        # 1. Upload the image file
-        # CRITICAL CHANGE: format="png" ensures transparency is kept.
-        # transformation={"quality": "auto"} helps size but keeps PNG structure.
-        upload_result = cloudinary.uploader.upload(
-            temp_file_path,
-            folder="project_av_products",
-            format="png", 
-            transformation=[
-                {'quality': "auto"}
-            ]
-        )
-        
-        # 2. Get the secure URL directly
-        image_url = upload_result.get("secure_url")
-        
-        if not image_url:
-            logger.error(f"BG Upload Failed: Image upload failed for product {product_id}, secure_url not found.")
-            products_collection.update_one({"_id": product_id},{"$set": {"status": "upload_failed"}})
-            return
-        
-        # 3. Update the product record in MongoDB
-        products_collection.update_one(
-            {"_id": product_id},
-            {"$set": {
-                "imageUrl": image_url,
-                "status": "visible"
-            }}
-        )
-        logger.info(f"BG Upload Success: Successfully processed image for product {product_id}")
-    
-    except Exception as e:
-        logger.error(f"BG Upload Failed: Image upload failed for product {product_id}: {traceback.format_exc()}")
-        products_collection.update_one(
-            {"_id": product_id},
-            {"$set": {"status": "upload_failed"}}
-        )
-    
-    finally:
-        if os.path.exists(temp_file_path):
-            try:
-                os.remove(temp_file_path)
-                logger.info(f"BG Cleanup: Removed temp file {temp_file_path}")
-            except Exception as e:
-                logger.error(f"BG Cleanup Failed: Could not remove {temp_file_path}: {e}")
-
 @app.post("/add-product/")
 async def add_product(
-    background_tasks: BackgroundTasks,
     product_name: str = Form(...),
     price: str = Form(...),
     unit: str = Form(...),
@@ -524,6 +606,14 @@ async def add_product(
              logger.error(f"Count validation failed for value: '{count}'")
              raise HTTPException(status_code=400, detail=f"Invalid stock count: '{count}'. Must be an integer.")
 
+        # Claim the photo from /upload-and-predict/ so the temp sweeper keeps it until it is uploaded
+        try:
+            image_available = await asyncio.to_thread(temp_files.claim, temp_image_id)
+        except ValueError:
+            image_available = False
+        if not image_available:
+            raise HTTPException(status_code=400, detail="Product image not found or expired. Please upload the photo again.")
+
         # --- 3. SAVE TEXT DATA TO DB FIRST ---
         product_dict = {
             "product_name": sanitize_input(product_name),
@@ -538,23 +628,26 @@ async def add_product(
             "created_at": datetime.utcnow(),
             "last_updated": datetime.utcnow() 
         }
+        product_dict.update(search_fields(product_dict["product_name"], category))
         
-        shop = shops_collection.find_one({"owner_id": owner_id})
+        shop = await shops_collection.find_one({"owner_id": owner_id})
         if shop:
-            product_dict["shop_id"] = str(shop["_id"])
+            product_dict["shop_id"] = shop["_id"]
         
-        result = products_collection.insert_one(product_dict)
+        result = await products_collection.insert_one(product_dict)
         product_id = result.inserted_id
         product_id_str = str(product_id)
         
-        # --- 4. ADD THE UPLOAD TO BACKGROUND TASKS ---
-        background_tasks.add_task(upload_image_and_update_db, temp_image_id, product_id)
+        # --- 4. QUEUE THE IMAGE UPLOAD (persisted on the product, retried on failure) ---
+        await image_upload_worker.enqueue(product_id, temp_image_id)
+        await price_index.refresh_for_product(product_id)
+        await invalidate_for_owner(owner_id)
         
         # --- 5. RETURN SUCCESS IMMEDIATELY ---
         return {
             "message": "Product added successfully",
             "product_id": product_id_str,
-            "product": {**product_dict, "_id": product_id_str, "created_at": product_dict["created_at"].isoformat()}
+            "product": {**serialize_doc({**product_dict, "_id": product_id}), "created_at": product_dict["created_at"].isoformat()}
         }
     except HTTPException as he:
         raise he
@@ -566,7 +659,7 @@ async def add_product(
 async def get_products(owner_id: str = Query(...), section: str = Query(None), category: str = Query(None)):
     try:
         # 1. Clean up expired promotions first (Real-time check)
-        products_collection.update_many(
+        expired_result = await products_collection.update_many(
             {
                 "owner_id": owner_id, 
                 "isOnSale": True, 
@@ -581,6 +674,9 @@ async def get_products(owner_id: str = Query(...), section: str = Query(None), c
                 }
             }
         )
+        if expired_result.modified_count:
+            await price_index.refresh_for_owner(owner_id)
+            await invalidate_for_owner(owner_id)
         
         # 2. Build query based on section rules
         query = {"owner_id": owner_id}
@@ -601,12 +697,11 @@ async def get_products(owner_id: str = Query(...), section: str = Query(None), c
         if category and category != "All":
             query["category"] = category
             
-        products = list(products_collection.find(query))
+        products = await products_collection.find(query).to_list(None)
         
-        # Convert MongoDB ObjectId to string
+        # Convert MongoDB ObjectIds to strings
         for product in products:
-            if '_id' in product:
-                product['_id'] = str(product['_id'])
+            serialize_doc(product)
                 
         return {"products": products}
     except Exception as e:
@@ -624,7 +719,11 @@ class CartItem(BaseModel):
 
 # REPLACE THE EXISTING /checkout-cart/ ENDPOINT IN main.py WITH THIS UPDATED BLOCK
 @app.post("/checkout-cart/")
-async def checkout_cart(cart_items: List[dict], background_tasks: BackgroundTasks): # <-- Added background_tasks here
+async def checkout_cart(cart_items: List[dict], background_tasks: BackgroundTasks, hold_id: str = Query(None)): # <-- Added background_tasks here
+    # Checked before the try below, whose catch-all would turn a bad id into a 500
+    if hold_id and not ObjectId.is_valid(hold_id):
+        return JSONResponse(status_code=400, content={"error": "Invalid stock hold id."})
+    hold_obj_id = ObjectId(hold_id) if hold_id else None
     try:
         if not cart_items:
             return JSONResponse(
@@ -633,13 +732,10 @@ async def checkout_cart(cart_items: List[dict], background_tasks: BackgroundTask
             )
 
         user_identifier = cart_items[0]['user_id']
-        user = None
-
+        user_query = {"uid": user_identifier}
         if ObjectId.is_valid(user_identifier):
-            user = users_collection.find_one({"_id": ObjectId(user_identifier)})
-        
-        if not user:
-            user = users_collection.find_one({"uid": user_identifier})
+            user_query = {"$or": [{"_id": ObjectId(user_identifier)}, user_query]}
+        user = await users_collection.find_one(user_query, {"_id": 1})
 
         if not user:
             return JSONResponse(
@@ -651,19 +747,26 @@ async def checkout_cart(cart_items: List[dict], background_tasks: BackgroundTask
         
         total_items = sum(item.get("quantity", 1) for item in cart_items)
         reward_amount = 3 * total_items
+        now = datetime.utcnow()
         
         order_doc = {
             "user_id": str(user_db_id),
             "items": [item["product_name"] for item in cart_items],
             "total_amount": sum(item["price"] * item["quantity"] for item in cart_items),
             "coins_earned": reward_amount,
-            "timestamp": datetime.utcnow()
+            "timestamp": now
+        }
+        reward_doc = {
+            "user_id": str(user_db_id),
+            "coins": reward_amount,
+            "type": "checkout",
+            "created_at": now
         }
-        
-        orders_collection.insert_one(order_doc)
 
         # --- NEW: Group items by shop_id for notifications ---
         items_by_shop = {}
+        # One stock line per product, however many cart lines it appears on
+        stock_lines = []
 
         for item in cart_items:
             shop_id = item.get("shop_id")
@@ -676,29 +779,59 @@ async def checkout_cart(cart_items: List[dict], background_tasks: BackgroundTask
                 qty = item.get("quantity", 1)
                 items_by_shop[shop_id].append(f"{qty}x {prod_name}")
 
-            product_id = safe_object_id(item.get("id"))
-            quantity = item.get("quantity", 1)
-            products_collection.update_one(
-                {"_id": product_id},
-                {"$inc": {"count": -quantity}}
+            if item.get("id"):
+                stock_lines.append((item["id"], item.get("quantity", 1)))
+        try:
+            decrements = merge_lines(stock_lines)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+
+        # Stock is taken before anything is written, guarded on count >= quantity so concurrent
+        # checkouts can't oversell. A hold from POST /stock-holds covers its lines already.
+        held = {}
+        if hold_obj_id:
+            held = await inventory.claim_hold(hold_obj_id, user_identifier)
+            if held is None:
+                return JSONResponse(status_code=409, content={"error": "Stock hold has expired or was already used."})
+        remaining = {product_id: quantity - held.get(product_id, 0) for product_id, quantity in decrements.items()
+                     if quantity > held.get(product_id, 0)}
+        reserved, stock_results = await inventory.reserve(remaining)
+        if not reserved:
+            if hold_obj_id:
+                await inventory.unclaim_hold(hold_obj_id)
+            return JSONResponse(
+                status_code=409,
+                content={"error": "Some items are out of stock.", "items": stock_results}
             )
-        
-        cart_collection.insert_many(cart_items)
-        
-        users_collection.update_one(
-            {"_id": user_db_id},
-            {"$inc": {"coins": reward_amount}}
-        )
-        
-        updated_user = users_collection.find_one({"_id": user_db_id})
-        updated_coins = updated_user.get("coins", 0)
-        
-        rewards_collection.insert_one({
-            "user_id": str(user_db_id),
-            "coins": reward_amount,
-            "type": "checkout",
-            "created_at": datetime.utcnow()
-        })
+
+        # A constant number of round trips however large the cart: the order, cart lines,
+        # reward record and coin balance (see app/checkout.py)
+        async def write_checkout(session=None):
+            return await checkout_writer.write(order_doc, cart_items, reward_doc, user_db_id, reward_amount, session)
+
+        try:
+            if CHECKOUT_TRANSACTIONS:
+                # with_transaction retries the whole callback on transient errors and commits once
+                async with await client.start_session() as session:
+                    updated_user = await session.with_transaction(write_checkout)
+            else:
+                # Without a transaction a failed write undoes the ones before it
+                updated_user = await write_checkout()
+        except Exception:
+            await inventory.put_back(remaining)
+            if hold_obj_id:
+                await inventory.unclaim_hold(hold_obj_id)
+            raise
+        updated_coins = (updated_user or {}).get("coins", 0)
+
+        # Held more than the cart ended up buying: the rest goes back on the shelf
+        surplus = {product_id: quantity - decrements.get(product_id, 0) for product_id, quantity in held.items()
+                   if quantity > decrements.get(product_id, 0)}
+        if surplus:
+            await inventory.put_back(surplus)
+
+        # Stock counts changed: refresh the price index off the request path
+        background_tasks.add_task(price_index.refresh_products, {"_id": {"$in": list(decrements.keys() | held.keys())}})
         
         # --- NEW: Trigger push notifications to respective owners in background ---
         for shop_id_str, product_names in items_by_shop.items():
@@ -718,6 +851,65 @@ async def checkout_cart(cart_items: List[dict], background_tasks: BackgroundTask
             content={"error": f"Checkout failed: {str(e)}"}
         )
         
+async def expire_stock_holds():
+    returned = await inventory.expire_holds()
+    if returned:
+        await price_index.refresh_products({"_id": {"$in": list(returned)}})
+
+class StockHoldItem(BaseModel):
+    product_id: str
+    quantity: int = 1
+
+class StockHoldRequest(BaseModel):
+    user_id: str
+    items: List[StockHoldItem]
+    ttl_seconds: float = None
+
+@app.post("/stock-holds")
+async def create_stock_hold(request: StockHoldRequest, background_tasks: BackgroundTasks):
+    """
+    Sets stock aside while the customer walks to the shop. All items are held
+    or none; pass the returned hold_id to /checkout-cart/ before it expires.
+    """
+    try:
+        try:
+            lines = merge_lines((item.product_id, item.quantity) for item in request.items)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+        if not lines:
+            return JSONResponse(status_code=400, content={"error": "No items to hold."})
+        ttl_seconds = min(request.ttl_seconds, STOCK_HOLD_MAX_TTL_SECONDS) if request.ttl_seconds else None
+
+        hold, results = await inventory.create_hold(request.user_id, lines, ttl_seconds)
+        if hold is None:
+            return JSONResponse(
+                status_code=409,
+                content={"error": "Some items are out of stock.", "items": results}
+            )
+        background_tasks.add_task(price_index.refresh_products, {"_id": {"$in": list(lines)}})
+        return {
+            "hold_id": str(hold["_id"]),
+            "expires_at": hold["expires_at"].isoformat(),
+            "items": results
+        }
+    except Exception as e:
+        logger.error(f"Stock hold failed: {e}")
+        return JSONResponse(status_code=500, content={"error": f"Stock hold failed: {str(e)}"})
+
+@app.delete("/stock-holds/{hold_id}")
+async def release_stock_hold(hold_id: str, background_tasks: BackgroundTasks, user_id: str = Query(...)):
+    try:
+        released = await inventory.release_hold(safe_object_id(hold_id), user_id)
+        if released is None:
+            return JSONResponse(status_code=404, content={"error": "No active stock hold with that id."})
+        background_tasks.add_task(price_index.refresh_products, {"_id": {"$in": list(released)}})
+        return {"message": "Stock hold released", "hold_id": hold_id}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Releasing stock hold {hold_id} failed: {e}")
+        return JSONResponse(status_code=500, content={"error": f"Releasing stock hold failed: {str(e)}"})
+
 class AddToCartRequest(BaseModel):
     product_id: str
     user_id: str
@@ -757,7 +949,7 @@ async def bulk_update_section(request: SectionBulkUpdateRequest):
             raise HTTPException(status_code=400, detail="Invalid section")
 
         # --- NEW: 10-Hour Cooldown Validation ---
-        shop = shops_collection.find_one({"owner_id": request.owner_id})
+        shop = await shops_collection.find_one({"owner_id": request.owner_id})
         if not shop:
             raise HTTPException(status_code=404, detail="Shop not found")
 
@@ -793,10 +985,13 @@ async def bulk_update_section(request: SectionBulkUpdateRequest):
             raise HTTPException(status_code=400, detail="Invalid action. Use 'increment' or 'set'.")
             
         # 1. Execute atomic bulk update on products
-        products_result = products_collection.update_many(query, update_operation)
+        products_result = await products_collection.update_many(query, update_operation)
+        if products_result.modified_count:
+            await price_index.refresh_for_owner(request.owner_id)
+            await invalidate_for_owner(request.owner_id)
         
         # 2. Log the button press timestamp for the UI color logic
-        shops_collection.update_one(
+        await shops_collection.update_one(
             {"owner_id": request.owner_id},
             {"$set": {timestamp_field: now}}
         )
@@ -817,7 +1012,7 @@ async def bulk_update_section(request: SectionBulkUpdateRequest):
 @app.get("/owner/shop-section-timestamps")
 async def get_shop_section_timestamps(owner_id: str = Query(...)):
     try:
-        shop = shops_collection.find_one({"owner_id": owner_id})
+        shop = await shops_collection.find_one({"owner_id": owner_id})
         if not shop:
             return JSONResponse(status_code=404, content={"error": "Shop not found"})
             
@@ -839,7 +1034,7 @@ async def add_item_to_cart(request: AddToCartRequest):
 
         # This is an "atomic" operation. It finds a product with a count > 0
         # and decrements the count in a single, uninterruptible step.
-        updated_product = products_collection.find_one_and_update(
+        updated_product = await products_collection.find_one_and_update(
             {"_id": product_obj_id, "count": {"$gt": 0}},
             {"$inc": {"count": -1}},
             return_document=ReturnDocument.AFTER # Return the document AFTER the update
@@ -852,19 +1047,21 @@ async def add_item_to_cart(request: AddToCartRequest):
         # The rest of the logic for analytics can happen here
         # For example, recording the sale event (we will use this instead of the old endpoint)
         shop_id_obj = safe_object_id(updated_product.get("shop_id"))
-        product_sales_collection.insert_one({
-            "product_id": product_obj_id,
-            "shop_id": shop_id_obj,
-            "quantity": 1,
-            "timestamp": datetime.utcnow()
-        })
-        products_collection.update_one(
-            {"_id": product_obj_id},
-            {"$inc": {"sale_count": 1}}
-        )
+        try:
+            # Written behind the request by the event buffer; the stock decrement above is what matters
+            await event_buffer.insert(product_sales_collection, {
+                "product_id": product_obj_id,
+                "shop_id": shop_id_obj,
+                "quantity": 1,
+                "price": price_index.effective_price(updated_product),
+                "timestamp": datetime.utcnow()
+            })
+            await event_buffer.increment(products_collection, product_obj_id, {"sale_count": 1})
+        except (EventBufferFull, ValueError) as e:
+            logger.warning(f"Sale event for product {product_obj_id} dropped: {e}")
 
         # Return the fully updated product so the frontend can update its state
-        updated_product['_id'] = str(updated_product['_id']) # Serialize ID
+        serialize_doc(updated_product) # Serialize IDs
         return {"success": True, "product": updated_product}
 
     except Exception as e:
@@ -909,7 +1106,7 @@ async def get_cart(user_id: str = Query(...)):
                 "shop_lng": "$shop_details.longitude"
             }}
         ]
-        items = list(cart_collection.aggregate(pipeline))
+        items = await cart_collection.aggregate(pipeline).to_list(None)
         return {"cart": items}
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
@@ -953,7 +1150,7 @@ async def add_shop(shop: ShopCreate, authorization: str = Header(None)):
                 content={"error": str(e)}
             )
          # Check if shop already exists
-        existing_shop = shops_collection.find_one({"owner_id": user_id})
+        existing_shop = await shops_collection.find_one({"owner_id": user_id})
         if existing_shop:
             return JSONResponse(
                 status_code=400,
@@ -963,7 +1160,7 @@ async def add_shop(shop: ShopCreate, authorization: str = Header(None)):
         # New nested try block for shop creation process
         try:
             # Update user status in database
-            users_collection.update_one(
+            await users_collection.update_one(
                 {"_id": ObjectId(user_id)},
                 {"$set": {"onboarding_done": True}}
             )
@@ -988,10 +1185,12 @@ async def add_shop(shop: ShopCreate, authorization: str = Header(None)):
             logger.info(f"Shop created at: {lat},{lng}")
             
             # Insert and return
-            result = shops_collection.insert_one(shop_dict)
+            result = await shops_collection.insert_one(shop_dict)
+            # Products listed before the shop existed can now be placed in the price index
+            await price_index.refresh_for_owner(user_id)
             
             # Generate new token with updated claims
-            new_token = create_access_token({
+            new_token = await create_access_token({
                 **payload,
                 "onboarding_done": True
             })
@@ -1028,7 +1227,7 @@ def validate_and_normalize_coords(lat: float, lng: float):
 @app.get("/get-shop-coordinates/{shop_id}")
 async def get_shop_coordinates(shop_id: str):
     try:
-        shop = shops_collection.find_one({"_id": ObjectId(shop_id)})
+        shop = await shops_collection.find_one({"_id": ObjectId(shop_id)})
         if not shop:
             return JSONResponse(
                 status_code=404,
@@ -1047,7 +1246,7 @@ async def get_shop_coordinates(shop_id: str):
 async def check_onboarding(uid: str = Query(...)):
     try:
         # FIX: Return consistent boolean format
-        shop_exists = shops_collection.find_one({"owner_id": uid})
+        shop_exists = await shops_collection.find_one({"owner_id": uid})
         return {"onboardingDone": bool(shop_exists)}
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
@@ -1066,7 +1265,10 @@ async def delete_product(product_id: str):
             )
         
         obj_id = ObjectId(product_id)
-        result = products_collection.delete_one({"_id": obj_id})
+        await invalidate_for_product(obj_id) # Before the delete, while the product's shop can still be found
+        price_groups = await price_index.group_keys({"_id": obj_id})
+        result = await products_collection.delete_one({"_id": obj_id})
+        await price_index.refresh_groups(price_groups)
         
         if result.deleted_count == 1:
             return {"message": "Product deleted successfully"}
@@ -1088,7 +1290,7 @@ async def delete_product(product_id: str):
 @app.get("/check-shop-exists")
 async def check_shop_exists(owner_id: str = Query(...)):
     try:
-        shop = shops_collection.find_one({"owner_id": owner_id})
+        shop = await shops_collection.find_one({"owner_id": owner_id})
         return {"exists": bool(shop)}
     except Exception as e:
         print(f"Shop check error: {str(e)}")
@@ -1130,12 +1332,24 @@ async def update_product(product_id: str, updated_data: dict):
         if not update_payload:
             return JSONResponse(status_code=400, content={"error": "No update data provided"})
 
-        result = products_collection.update_one(
+        # Keep the search keys in step with the name and category
+        if "product_name" in update_payload or "category" in update_payload:
+            current = await products_collection.find_one({"_id": obj_id}, {"product_name": 1, "category": 1})
+            if current is None:
+                return JSONResponse(status_code=404, content={"error": "Product not found"})
+            update_payload.update(search_fields(
+                update_payload.get("product_name", current.get("product_name")),
+                update_payload.get("category", current.get("category"))
+            ))
+
+        result = await products_collection.update_one(
             {"_id": obj_id},
             {"$set": update_payload}
         )
 
         if result.modified_count == 1 or result.matched_count == 1:
+            await price_index.refresh_for_product(obj_id)
+            await invalidate_for_product(obj_id)
             return {"message": "Product updated successfully"}
         else:
             return JSONResponse(status_code=404, content={"error": "Product not found"})
@@ -1242,131 +1456,65 @@ async def get_deals_products(
         if category and category != "All":
             match_stage["products.category"] = category
 
-        pipeline = [
-            {
-                "$geoNear": {
-                    "near": {"type": "Point", "coordinates": [user_lng, user_lat]},
-                    "distanceField": "distance_in_meters",
-                    "maxDistance": 5000, 
-                    "spherical": True
-                }
-            },
-            {
-                "$lookup": {
-                    "from": "products",
-                    "let": { "shop_id_str": { "$toString": "$_id" } },
-                    "pipeline": [
-                        { "$match": { "$expr": { "$eq": [ "$shop_id", "$$shop_id_str" ] } } }
-                    ],
-                    "as": "products"
-                }
-            },
-            {"$unwind": "$products"},
-            {"$match": match_stage}, # 3. Apply Filter
-            {"$skip": skip},
-            {"$limit": limit},
-            {
-                "$project": {
-                    "_id": {"$toString": "$products._id"},
-                    "product_name": "$products.product_name",
-                    "price": "$products.price",
-                    "unit": "$products.unit",
-                    "category": "$products.category", # 4. Return Category
-                    "imageUrl": "$products.imageUrl",
-                    "shop_id": {"$toString": "$_id"},
-                    "shop_name": "$name",
-                    "distance": {"$divide": ["$distance_in_meters", 1000]},
-                    "isOnSale": "$products.isOnSale",
-                    "salePrice": "$products.salePrice",
-                    "saleDescription": "$products.saleDescription",
-                    # FIX: Explicitly format date to match Frontend's SimpleDateFormat 'yyyy-MM-ddTHH:mm:ss.SSSZ'
-                    "saleEndDate": {
-                        "$dateToString": {
-                            "format": "%Y-%m-%dT%H:%M:%S.%LZ",
-                            "date": "$products.saleEndDate"
+        # Ranked once per ~1 km tile and served from the feed cache (see app/feed_cache.py)
+        async def compute(lat, lng, min_km, max_km, count):
+            pipeline = [
+                {
+                    "$geoNear": {
+                        "near": {"type": "Point", "coordinates": [lng, lat]},
+                        "distanceField": "distance_in_meters",
+                        "minDistance": min_km * 1000,
+                        "maxDistance": max_km * 1000,
+                        "spherical": True
+                    }
+                },
+                *shop_products_lookup("products"),
+                {"$unwind": "$products"},
+                {"$match": match_stage}, # 3. Apply Filter
+                {"$limit": count},
+                {
+                    "$project": {
+                        "_id": {"$toString": "$products._id"},
+                        "product_name": "$products.product_name",
+                        "price": "$products.price",
+                        "unit": "$products.unit",
+                        "category": "$products.category", # 4. Return Category
+                        "imageUrl": "$products.imageUrl",
+                        "shop_id": {"$toString": "$_id"},
+                        "shop_name": "$name",
+                        "distance": {"$divide": ["$distance_in_meters", 1000]},
+                        SHOP_LAT_FIELD: {"$arrayElemAt": ["$location.coordinates", 1]},
+                        SHOP_LNG_FIELD: {"$arrayElemAt": ["$location.coordinates", 0]},
+                        "isOnSale": "$products.isOnSale",
+                        "salePrice": "$products.salePrice",
+                        "saleDescription": "$products.saleDescription",
+                        # FIX: Explicitly format date to match Frontend's SimpleDateFormat 'yyyy-MM-ddTHH:mm:ss.SSSZ'
+                        "saleEndDate": {
+                            "$dateToString": {
+                                "format": "%Y-%m-%dT%H:%M:%S.%LZ",
+                                "date": "$products.saleEndDate"
+                            }
                         }
                     }
                 }
-            }
-        ]
-        deals = list(shops_collection.aggregate(pipeline))
+            ]
+            return await shops_collection.aggregate(pipeline).to_list(None)
+
+        deals = await feed_cache.get_page(
+            "deals", user_lat, user_lng, category, skip, limit, compute, max_km=5, order_by_distance=True
+        )
         return {"products": deals}
     except Exception as error:
         print(f"Deals products error: {error}")
         return {"products": []}
 
         
-@app.get("/get-shops")
-async def get_shops(
-    product_name: str = Query(...),
-    user_lat: float = Query(...),
-    user_lng: float = Query(...),
-    in_stock: bool = Query(True)
-):
-    try:
-        # Step 1: Find all products that match the search query.
-        product_query = {"product_name": {"$regex": product_name, "$options": "i"}}
-        if in_stock:
-            product_query["inStock"] = True
-        
-        matching_products = list(products_collection.find(product_query))
-        if not matching_products:
-            return {"shops": []}
-            
-        # Get the unique shop ObjectIDs from the found products.
-        shop_ids_obj = list({ObjectId(p["shop_id"]) for p in matching_products if "shop_id" in p and ObjectId.is_valid(p["shop_id"])})
-
-        # Step 2: Use a $geoNear pipeline on the shops collection.
-        # This finds ALL shops containing the product and sorts them by distance with NO LIMIT.
-        pipeline = [
-            {
-                "$geoNear": {
-                    "near": {"type": "Point", "coordinates": [user_lng, user_lat]},
-                    "distanceField": "distance_in_meters",
-                    "spherical": True,
-                    # This query ensures we only look at shops that are known to have the product.
-                    "query": {"_id": {"$in": shop_ids_obj}}
-                }
-            }
-        ]
-        
-        sorted_shops = list(shops_collection.aggregate(pipeline))
-        
-        # Step 3: Format the response with the correctly sorted shops.
-        shop_list = []
-        for shop in sorted_shops:
-            shop_id_str = str(shop["_id"])
-            
-            # Filter the products from our initial search to only those belonging to this specific shop.
-            shop_products = [p for p in matching_products if p.get("shop_id") == shop_id_str]
-            
-            shop_list.append({
-                "_id": shop_id_str, # Updated to _id so frontend serialization doesn't break
-                "name": shop["name"],
-                "rating": shop.get("rating"),
-                "store": shop.get("store"),
-                "distance": shop.get("distance_in_meters", 0) / 1000, # Add distance to the response
-                "products": [{
-                    "id": str(p["_id"]),
-                    "name": p["product_name"],
-                    "price": p["price"],
-                    "unit": p["unit"],
-                    "inStock": p.get("inStock", True)
-                } for p in shop_products],
-                "preview_images": [p.get("imageUrl") for p in shop_products if p.get("imageUrl")] # <-- NEW: Included for UI
-            })
-            
-        return {"shops": shop_list}
-    except Exception as e:
-        print(f"Error in get_shops: {str(e)}")
-        return {"shops": []}
-        
 # Update get-user-coins endpoint
 @app.get("/get-user-coins")
 async def get_user_coins(user_id: str = Query(...)):
     try:
         # Calculate coins from rewards collection
-        rewards = list(rewards_collection.find({"user_id": user_id}))
+        rewards = await rewards_collection.find({"user_id": user_id}).to_list(None)
         total_coins = sum(r["coins"] for r in rewards)
         return {"total_coins": total_coins}
     except Exception as e:
@@ -1385,12 +1533,12 @@ async def add_reward(reward: Reward):
         coins = 3 if reward.type == "checkout" else reward.coins
         
         # Update user's coin balance
-        users_collection.update_one(
+        await users_collection.update_one(
             {"_id": ObjectId(reward.user_id)},
             {"$inc": {"coins": coins}}
         )
             
-        rewards_collection.insert_one({
+        await rewards_collection.insert_one({
             "user_id": reward.user_id,
             "coins": coins,
             "type": reward.type,
@@ -1406,13 +1554,13 @@ async def add_reward(reward: Reward):
 @app.get("/get-next-payment-date")
 async def get_next_payment_date(user_id: str = Query(...)):
     try:
-        user = users_collection.find_one({"uid": user_id})
+        user = await users_collection.find_one({"uid": user_id})
         if not user:
             # Create new user with initial subscription date
             next_date = datetime.utcnow() + relativedelta(months=1)
             next_date_str = next_date.isoformat()
             
-            users_collection.insert_one({
+            await users_collection.insert_one({
                 "uid": user_id,
                 "next_payment_date": next_date_str,
                 "subscription_active": True,
@@ -1454,7 +1602,7 @@ async def create_user_endpoint(user: dict):
         }
         
         # Insert into MongoDB
-        users_collection.insert_one(user_data)
+        await users_collection.insert_one(user_data)
         
         return {"success": True}
     except Exception as e:
@@ -1494,7 +1642,7 @@ async def update_user_profile(request: UserProfileUpdateRequest):
             # Otherwise, assume it's a UID (like an email) and query by the 'uid' field.
             query = {"uid": user_identifier}
         
-        result = users_collection.update_one(
+        result = await users_collection.update_one(
             query,
             {"$set": update_payload}
         )
@@ -1521,11 +1669,11 @@ class ShopLocationUpdateRequest(BaseModel):
 async def update_shop_location(request: ShopLocationUpdateRequest):
     try:
         owner_obj_id = safe_object_id(request.owner_id)
-        owner = users_collection.find_one({"_id": owner_obj_id})
+        owner = await users_collection.find_one({"_id": owner_obj_id})
         if not owner or owner.get("role") != "owner":
             raise HTTPException(status_code=403, detail="User is not a valid owner.")
 
-        shop = shops_collection.find_one({"owner_id": request.owner_id})
+        shop = await shops_collection.find_one({"owner_id": request.owner_id})
         if not shop:
             raise HTTPException(status_code=404, detail="Shop not found for this owner.")
 
@@ -1537,10 +1685,17 @@ async def update_shop_location(request: ShopLocationUpdateRequest):
                 "coordinates": [request.longitude, request.latitude]
             }
         }
-        shops_collection.update_one(
+        await shops_collection.update_one(
             {"_id": shop["_id"]},
             {"$set": update_payload}
         )
+        # The shop's products leave the feeds around the old location and join those around the new one
+        coordinates = shop.get("location", {}).get("coordinates")
+        if coordinates:
+            feed_cache.invalidate_near(coordinates[1], coordinates[0])
+        feed_cache.invalidate_near(request.latitude, request.longitude)
+        # Moves the shop's offers to the price index cell of its new location
+        await price_index.refresh_for_owner(request.owner_id)
 
         return {"success": True, "message": "Shop location updated successfully."}
     except Exception as e:
@@ -1558,11 +1713,11 @@ async def get_user(user_id: str = Query(...)):
         
         # Try finding user
         if ObjectId.is_valid(user_id):
-            user = users_collection.find_one({"_id": ObjectId(user_id)})
+            user = await users_collection.find_one({"_id": ObjectId(user_id)})
         if not user:
-            user = users_collection.find_one({"email": user_id})
+            user = await users_collection.find_one({"email": user_id})
         if not user:
-            user = users_collection.find_one({"uid": user_id})
+            user = await users_collection.find_one({"uid": user_id})
             
         if user:
             # --- CRITICAL FIX: Calculate Active Coins Dynamically ---
@@ -1579,7 +1734,7 @@ async def get_user(user_id: str = Query(...)):
                     {"timestamp": {"$gte": cutoff_date}}
                 ]
             }
-            recent_transactions = list(rewards_collection.find(query))
+            recent_transactions = await rewards_collection.find(query).to_list(None)
             active_coins = sum(t.get("coins", 0) for t in recent_transactions)
             # -------------------------------------------------------
 
@@ -1633,7 +1788,7 @@ async def verify_razorpay_payment(payment_data: dict):
         razorpay_client.utility.verify_payment_signature(params)
         
         # Store payment details in transactions collection
-        payments_collection.insert_one({
+        await payments_collection.insert_one({
             "user_id": payment_data["user_id"],
             "payment_id": payment_data["payment_id"],
             "order_id": payment_data["order_id"],
@@ -1707,7 +1862,7 @@ async def renew_with_referral(request: RenewalRequest):
     SUBSCRIPTION_COST = 99
     try:
         user_obj_id = safe_object_id(request.user_id)
-        user = users_collection.find_one({"_id": user_obj_id})
+        user = await users_collection.find_one({"_id": user_obj_id})
 
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
@@ -1723,7 +1878,7 @@ async def renew_with_referral(request: RenewalRequest):
         new_earnings = referral_earnings - SUBSCRIPTION_COST
         next_payment_date = datetime.utcnow() + relativedelta(months=1)
 
-        users_collection.update_one(
+        await users_collection.update_one(
             {"_id": user_obj_id},
             {
                 "$set": {
@@ -1737,10 +1892,10 @@ async def renew_with_referral(request: RenewalRequest):
         )
         
         # Re-fetch user to get all current data for the new token
-        updated_user = users_collection.find_one({"_id": user_obj_id})
+        updated_user = await users_collection.find_one({"_id": user_obj_id})
         
         # Issue a new token with all the latest claims to keep the client in sync
-        access_token = create_access_token(
+        access_token = await create_access_token(
             data={
                 "sub": str(updated_user["_id"]),
                 "role": updated_user.get("role"),
@@ -1772,7 +1927,7 @@ async def update_subscription(data: dict):
 
         next_payment = datetime.utcnow() + relativedelta(months=1)
         
-        result = users_collection.update_one(
+        result = await users_collection.update_one(
             {"_id": user_obj_id},
             {"$set": {
                 "subscription_active": True,
@@ -1788,10 +1943,10 @@ async def update_subscription(data: dict):
 
         # ===== ADD THIS BLOCK TO ISSUE AND RETURN A NEW TOKEN =====
         # Re-fetch the user to get all current data for the new token
-        updated_user = users_collection.find_one({"_id": user_obj_id})
+        updated_user = await users_collection.find_one({"_id": user_obj_id})
         
         # Issue a new token with all the latest claims
-        access_token = create_access_token(
+        access_token = await create_access_token(
             data={
                 "sub": str(updated_user["_id"]),
                 "role": updated_user.get("role"),
@@ -1813,7 +1968,7 @@ async def update_subscription(data: dict):
 @app.post("/record-coin-transaction")
 async def record_coin_transaction(transaction: dict):
     try:
-        rewards_collection.insert_one({
+        await rewards_collection.insert_one({
             "user_id": transaction["user_id"],
             "coins": transaction["coins"],
             "type": transaction["type"],
@@ -1864,13 +2019,13 @@ async def verify_coin_purchase(request: VerifyCoinPurchaseRequest):
 
         # 2. Add coins to the user's account
         user_obj_id = safe_object_id(request.user_id)
-        users_collection.update_one(
+        await users_collection.update_one(
             {"_id": user_obj_id},
             {"$inc": {"coins": request.coins_to_add}}
         )
 
         # 3. Log the transaction in the rewards collection for history
-        rewards_collection.insert_one({
+        await rewards_collection.insert_one({
             "user_id": request.user_id,
             "coins": request.coins_to_add,
             "type": "purchase",
@@ -1878,7 +2033,7 @@ async def verify_coin_purchase(request: VerifyCoinPurchaseRequest):
         })
         
         # 4. Log the payment transaction for financial records
-        payments_collection.insert_one({
+        await payments_collection.insert_one({
             "user_id": request.user_id,
             "payment_id": request.razorpay_payment_id,
             "order_id": request.razorpay_order_id,
@@ -1906,7 +2061,7 @@ async def redeem_subscription(data: dict):
             
         # --- FIX 1: Correct user lookup by _id, not uid ---
         user_obj_id = safe_object_id(user_id)
-        user = users_collection.find_one({"_id": user_obj_id})
+        user = await users_collection.find_one({"_id": user_obj_id})
         
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
@@ -1921,13 +2076,13 @@ async def redeem_subscription(data: dict):
             
         # The rest of the logic is correct:
         # 1. DEDUCT coins from the main total balance.
-        users_collection.update_one(
+        await users_collection.update_one(
              {"_id": user_obj_id},
             {"$inc": {"coins": -coins_to_use}}
         )
         
         # 2. Record the spending transaction in the 'rewards' log.
-        rewards_collection.insert_one({
+        await rewards_collection.insert_one({
             "user_id": user_id,
             "coins": -coins_to_use,
             "type": "subscription",
@@ -1950,7 +2105,7 @@ async def redeem_subscription(data: dict):
 @app.get("/get-user-subscription-phase")
 async def get_user_subscription_phase(user_id: str = Query(...)):
     try:
-        user = users_collection.find_one({"uid": user_id})
+        user = await users_collection.find_one({"uid": user_id})
         if not user:
             return {"phase": 1, "months_since_start": 0}
         
@@ -1979,11 +2134,11 @@ async def check_subscription_status(user_id: str = Query(...)):
         # --- START OF ID MISMATCH FIX ---
         user = None
         # First, try to find the user by their email or uid
-        user = users_collection.find_one({"uid": user_id})
+        user = await users_collection.find_one({"uid": user_id})
         if not user:
             # If that fails, try to find them by their MongoDB _id
             if ObjectId.is_valid(user_id):
-                user = users_collection.find_one({"_id": ObjectId(user_id)})
+                user = await users_collection.find_one({"_id": ObjectId(user_id)})
 
         if not user:
             # If user is still not found, they are not subscribed.
@@ -2036,7 +2191,7 @@ async def owner_check_subscription(owner_id: str = Query(...)):
     try:
         # Use safe_object_id for robust ID handling
         owner_obj_id = safe_object_id(owner_id)
-        owner = users_collection.find_one({"_id": owner_obj_id})
+        owner = await users_collection.find_one({"_id": owner_obj_id})
 
         if not owner or owner.get("role") != "owner":
             # Return 'not_found' if user is not a valid owner
@@ -2072,11 +2227,11 @@ async def get_subscription_details(user_id: str = Query(...)):
         # --- START OF ID MISMATCH FIX ---
         user = None
         # First, try to find the user by their email or uid
-        user = users_collection.find_one({"uid": user_id})
+        user = await users_collection.find_one({"uid": user_id})
         if not user:
             # If that fails, try to find them by their MongoDB _id
             if ObjectId.is_valid(user_id):
-                 user = users_collection.find_one({"_id": ObjectId(user_id)})
+                 user = await users_collection.find_one({"_id": ObjectId(user_id)})
         # --- END OF ID MISMATCH FIX ---
         
         if not user:
@@ -2114,9 +2269,9 @@ async def get_user_coins(user_id: str):
     try:
         user = None
         if ObjectId.is_valid(user_id):
-            user = users_collection.find_one({"_id": ObjectId(user_id)})
+            user = await users_collection.find_one({"_id": ObjectId(user_id)})
         if not user:
-            user = users_collection.find_one({"uid": user_id})
+            user = await users_collection.find_one({"uid": user_id})
 
         if not user:
             logging.error(f"DEBUG: User lookup FAILED for user_id: {user_id}")
@@ -2138,7 +2293,7 @@ async def get_user_coins(user_id: str):
             ]
         }
         
-        recent_transactions = list(rewards_collection.find(query))
+        recent_transactions = await rewards_collection.find(query).to_list(None)
         active_coins = sum(t.get("coins", 0) for t in recent_transactions)
         
         return {
@@ -2152,13 +2307,15 @@ async def get_user_coins(user_id: str):
 @app.post("/bulk-stock-update/")
 async def bulk_stock_update(owner_id: str = Query(...), in_stock: bool = Query(...)):
     try:
-        result = products_collection.update_many(
+        result = await products_collection.update_many(
             {"owner_id": owner_id},
             {"$set": {
                 "inStock": in_stock,
                 "last_updated": datetime.utcnow() # NEW: Update timestamp
             }}
         )
+        await price_index.refresh_for_owner(owner_id)
+        await invalidate_for_owner(owner_id)
         return {"message": f"Updated {result.modified_count} products"}
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
@@ -2171,7 +2328,7 @@ class AvailabilityRequest(BaseModel):
 async def ask_availability(request: AvailabilityRequest):
     try:
         product_obj_id = safe_object_id(request.product_id)
-        product = products_collection.find_one({"_id": product_obj_id})
+        product = await products_collection.find_one({"_id": product_obj_id})
         
         if not product:
             raise HTTPException(status_code=404, detail="Product not found")
@@ -2199,7 +2356,7 @@ async def respond_availability(response: AvailabilityResponse):
         
         if response.status.lower() == "yes":
             # Owner confirmed stock -> Update count, InStock, and Timestamp
-            products_collection.update_one(
+            await products_collection.update_one(
                 {"_id": product_obj_id},
                 {"$set": {
                     "inStock": True,
@@ -2207,11 +2364,13 @@ async def respond_availability(response: AvailabilityResponse):
                     "last_updated": datetime.utcnow() # Reset Freshness
                 }}
             )
+            await price_index.refresh_for_product(product_obj_id)
+            await invalidate_for_product(product_obj_id)
             return {"success": True, "message": "Stock updated to available"}
             
         elif response.status.lower() == "no":
             # Owner confirmed NO stock -> Just update timestamp (verified empty)
-            products_collection.update_one(
+            await products_collection.update_one(
                 {"_id": product_obj_id},
                 {"$set": {
                     "inStock": False,
@@ -2219,6 +2378,8 @@ async def respond_availability(response: AvailabilityResponse):
                     "last_updated": datetime.utcnow()
                 }}
             )
+            await price_index.refresh_for_product(product_obj_id)
+            await invalidate_for_product(product_obj_id)
             return {"success": True, "message": "Stock verified as empty"}
             
     except Exception as e:
@@ -2250,7 +2411,7 @@ async def razorpay_webhook(request: Request):
             payment_id = payload["payload"]["payment"]["entity"]["id"]
             
             # Store transaction in database
-            payments_collection.insert_one({
+            await payments_collection.insert_one({
                 "payment_id": payment_id,
                 "order_id": payload["payload"]["payment"]["entity"]["order_id"],
                 "signature": signature,
@@ -2269,7 +2430,7 @@ async def razorpay_webhook(request: Request):
 @app.post("/update-user")
 async def update_user(data: dict):
     try:
-        users_collection.update_one(
+        await users_collection.update_one(
             {"uid": data["uid"]},
             {"$set": {"hasEnteredReferral": data["hasEnteredReferral"]}}
         )
@@ -2284,7 +2445,7 @@ async def update_user(data: dict):
 @app.post("/update-referral-status")
 async def update_referral_status(data: dict):
     try:
-        users_collection.update_one(
+        await users_collection.update_one(
             {"uid": data["uid"]},
             {"$set": {"hasEnteredReferral": data["status"]}}
         )
@@ -2323,26 +2484,34 @@ async def process_referral(data: dict):
 @app.post("/record-view/{product_id}")
 async def record_view(product_id: str, shop_id: str):
     try:
-        product_views_collection.insert_one({
+        await event_buffer.insert(product_views_collection, {
             "product_id": product_id,
             "shop_id": shop_id,
             "timestamp": datetime.utcnow(),
             "type": "view"
         })
         return {"success": True}
+    except EventBufferFull as e:
+        return JSONResponse(status_code=503, content={"error": str(e)})
+    except ValueError as e: # Failed the event schema (app/schemas/events.py)
+        return JSONResponse(status_code=400, content={"error": str(e)})
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 @app.post("/record-sale/{product_id}")
 async def record_sale(product_id: str, shop_id: str, quantity: int = 1):
     try:
-        product_sales_collection.insert_one({
+        await event_buffer.insert(product_sales_collection, {
             "product_id": product_id,
             "shop_id": shop_id,
             "quantity": quantity,
             "timestamp": datetime.utcnow()
         })
         return {"success": True}
+    except EventBufferFull as e:
+        return JSONResponse(status_code=503, content={"error": str(e)})
+    except ValueError as e: # Failed the event schema (app/schemas/events.py)
+        return JSONResponse(status_code=400, content={"error": str(e)})
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 # ======== END OF NEW ENDPOINTS ========
@@ -2374,7 +2543,7 @@ async def universal_exception_handler(request: Request, exc: Exception):
 async def update_referral_status(data: dict):
     try:
         # Use consistent 'uid' field
-        users_collection.update_one(
+        await users_collection.update_one(
             {"uid": data["uid"]},  # CHANGED from _id to uid
             {"$set": {"hasEnteredReferral": data["status"]}}
         )
@@ -2389,10 +2558,10 @@ async def update_referral_status(data: dict):
 def generate_referral_code():
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
 
-def get_user_by_id(user_id):
+async def get_user_by_id(user_id):
     try:
         # FIX: Query by uid instead of _id
-        user = users_collection.find_one({"uid": user_id})  # CHANGED
+        user = await users_collection.find_one({"uid": user_id})  # CHANGED
         if user:
             return user
         return None
@@ -2414,14 +2583,14 @@ async def skip_referral(request: Request):
     
     try:
         # FIX: Directly use UID without conversion
-        users_collection.update_one(
+        await users_collection.update_one(
             {"uid": user_id},
             {"$set": {"hasEnteredReferral": True}}
         )
         
         # Generate new token
-        user = get_user_by_id(user_id)
-        new_token = create_access_token({
+        user = await get_user_by_id(user_id)
+        new_token = await create_access_token({
             "sub": str(user["_id"]),
             "role": user["role"],
             "hasEnteredReferral": True
@@ -2448,49 +2617,23 @@ async def http_exception_handler(request, exc):
             "Access-Control-Allow-Headers": "Content-Type"
         }
     )          
-@app.post("/record-shop-view/{shop_id}")
-async def record_shop_view(shop_id: str):
-    try:
-        # Record shop view with timestamp
-        db.shop_views.insert_one({
-            "shop_id": ObjectId(shop_id),
-            "timestamp": datetime.utcnow()
-        })
-        return {"success": True}
-    except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
-
 @app.post("/record-sale")
 async def record_sale(data: dict):
     try:
         # Record product sale with quantity
-        db.product_sales.insert_one({
+        await event_buffer.insert(product_sales_collection, {
             "product_id": data["product_id"],
             "shop_id": data["shop_id"],
             "quantity": data["quantity"],
             "timestamp": datetime.utcnow()
         })
         return {"success": True}
+    except EventBufferFull as e:
+        return JSONResponse(status_code=503, content={"error": str(e)})
+    except ValueError as e: # Failed the event schema (app/schemas/events.py)
+        return JSONResponse(status_code=400, content={"error": str(e)})
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
-@app.post("/record-product-sale")
-async def record_product_sale(sale_data: SaleData):
-    try:
-        # Convert string IDs to ObjectIds
-        product_id = ObjectId(sale_data.product_id)
-        shop_id = ObjectId(sale_data.shop_id)
-
-        # Update product sale count
-        products_collection.update_one(
-            {"_id": product_id},
-            {"$inc": {"sale_count": sale_data.quantity}}
-        )
-
-        # Return success immediately
-        return {"success": True}
-    except Exception as e:
-        print(f"Sale recording error: {str(e)}")
-        return {"success": False}
 
 
 # ======== ADDED USER LOCATION ENDPOINT BEFORE CATCH-ALL ========
@@ -2502,12 +2645,12 @@ async def update_user_location(data: dict):
             raise HTTPException(status_code=400, detail="Missing user ID")
             
         # FIX: Only update location for shop owners
-        user = users_collection.find_one({"uid": user_id})
+        user = await users_collection.find_one({"uid": user_id})
         if not user or user.get("role") != "owner":
             return {"success": True}  # Skip for customers
         
         # Update only for owners
-        users_collection.update_one(
+        await users_collection.update_one(
             {"uid": user_id},
             {"$set": {
                 "latitude": data["latitude"],
@@ -2548,14 +2691,16 @@ async def update_promotion(product_id: str, promo_data: PromotionData):
             "last_updated": datetime.utcnow()
         }
 
-        result = products_collection.update_one(
+        result = await products_collection.update_one(
             {"_id": obj_id},
             {"$set": update_payload}
         )
 
         if result.matched_count == 0:
             return JSONResponse(status_code=404, content={"error": "Product not found"})
-            
+
+        await price_index.refresh_for_product(obj_id)
+        await invalidate_for_product(obj_id)
         return {"message": "Promotion updated successfully"}
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
@@ -2574,7 +2719,7 @@ async def remove_promotion(product_id: str):
             "saleEndDate": ""
         }
 
-        result = products_collection.update_one(
+        result = await products_collection.update_one(
             {"_id": obj_id},
             {"$unset": unset_payload}
         )
@@ -2582,6 +2727,8 @@ async def remove_promotion(product_id: str):
         if result.matched_count == 0:
             return JSONResponse(status_code=404, content={"error": "Product not found"})
 
+        await price_index.refresh_for_product(obj_id)
+        await invalidate_for_product(obj_id)
         return {"message": "Promotion removed successfully"}
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
@@ -0,0 +1,135 @@
+"""
+Converts shop_id/product_id in product_views and product_sales from strings
+to ObjectIds, matching what app/schemas/events.py now enforces on ingestion.
+
+    python -m app.migrations.analytics_ids [--dry-run] [--batch-size 1000] [--pause-ms 0] [--restart]
+
+Online and resumable. Documents are walked in _id order, a batch at a time.
+Each update only applies if the ids still hold the strings it read, and the
+last _id done is checkpointed in the migrations collection after every
+batch. An interrupted run carries on from its checkpoint; --restart ignores
+it. --pause-ms sleeps between batches to leave room for live traffic.
+
+Values that are not valid ObjectIds are counted, sampled in the checkpoint
+and left alone. After the run, rebuild the rollups
+(python -m app.migrations.shop_daily_metrics) if any views or sales were
+missing from them.
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from app.db import product_views_collection, product_sales_collection, migrations_collection, ensure_indexes
+
+MIGRATION = "analytics_ids"
+ID_FIELDS = ("shop_id", "product_id")
+_INVALID_SAMPLE = 20
+
+
+def _string_ids(after=None) -> dict:
+    """Documents with a string id, past the checkpointed _id."""
+    query = {"$or": [{field: {"$type": "string"}} for field in ID_FIELDS]}
+    return query if after is None else {"$and": [query, {"_id": {"$gt": after}}]}
+
+
+def _conversion(document: dict):
+    """(filter, $set) that types the document's string ids, and the fields left as invalid strings."""
+    match = {"_id": document["_id"]}
+    converted = {}
+    invalid = []
+    for field in ID_FIELDS:
+        value = document.get(field)
+        if not isinstance(value, str):
+            continue
+        if ObjectId.is_valid(value):
+            match[field] = value
+            converted[field] = ObjectId(value)
+        else:
+            invalid.append(field)
+    return match, converted, invalid
+
+
+async def migrate_collection(collection, dry_run: bool = False, batch_size: int = 1000, pause_ms: int = 0,
+                             restart: bool = False):
+    checkpoint_id = f"{MIGRATION}:{collection.name}"
+    checkpoint = None if restart or dry_run else await migrations_collection.find_one({"_id": checkpoint_id})
+    if checkpoint and checkpoint.get("done"):
+        print(f"✅ {collection.name}: already migrated on {checkpoint['updated_at']:%Y-%m-%d %H:%M} (--restart to re-run)")
+        return
+    state = {
+        "converted": 0, "invalid": 0, "invalid_sample": [], "last_id": None,
+        "started_at": datetime.utcnow(), **(checkpoint or {})
+    }
+    state.pop("_id", None)
+    if checkpoint:
+        print(f"... {collection.name}: resuming after {state['last_id']} ({state['converted']} converted so far)")
+
+    remaining = await collection.count_documents(_string_ids(state["last_id"]))
+    seen = 0
+    started = time.monotonic()
+    while True:
+        documents = await collection.find(_string_ids(state["last_id"]), {field: 1 for field in ID_FIELDS}) \
+            .sort("_id", 1).limit(batch_size).to_list(None)
+        if not documents:
+            break
+
+        updates = []
+        for document in documents:
+            match, converted, invalid = _conversion(document)
+            if converted:
+                updates.append(UpdateOne(match, {"$set": converted}))
+            if invalid:
+                state["invalid"] += 1
+                if len(state["invalid_sample"]) < _INVALID_SAMPLE:
+                    state["invalid_sample"].append(str(document["_id"]))
+        if updates and not dry_run:
+            state["converted"] += (await collection.bulk_write(updates, ordered=False)).modified_count
+        elif dry_run:
+            state["converted"] += len(updates)
+        state["last_id"] = documents[-1]["_id"]
+        seen += len(documents)
+
+        if not dry_run:
+            await _checkpoint(checkpoint_id, state, done=False)
+        rate = seen / max(time.monotonic() - started, 1e-6)
+        print(f"... {collection.name}: {seen} of ~{remaining} checked, {state['converted']} converted, "
+              f"{state['invalid']} invalid ({rate:.0f} docs/s)")
+        if pause_ms:
+            await asyncio.sleep(pause_ms / 1000)
+
+    if not dry_run:
+        await _checkpoint(checkpoint_id, state, done=True)
+    if state["invalid"]:
+        print(f"❌ {collection.name}: {state['invalid']} documents have ids that are not ObjectIds, e.g. "
+              f"{', '.join(state['invalid_sample'])}")
+    print(f"✅ {collection.name}: {'would convert' if dry_run else 'converted'} {state['converted']} documents")
+
+
+async def _checkpoint(checkpoint_id: str, state: dict, done: bool):
+    await migrations_collection.update_one(
+        {"_id": checkpoint_id},
+        {"$set": {**state, "done": done, "updated_at": datetime.utcnow()}},
+        upsert=True
+    )
+
+
+async def migrate_analytics_ids(dry_run: bool = False, batch_size: int = 1000, pause_ms: int = 0,
+                                restart: bool = False):
+    if not dry_run:
+        await ensure_indexes()
+    for collection in (product_views_collection, product_sales_collection):
+        await migrate_collection(collection, dry_run, batch_size, pause_ms, restart)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="Count what would change without writing")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--pause-ms", type=int, default=0, help="Sleep between batches")
+    parser.add_argument("--restart", action="store_true", help="Ignore saved checkpoints and start from the beginning")
+    args = parser.parse_args()
+    asyncio.run(migrate_analytics_ids(args.dry_run, args.batch_size, args.pause_ms, args.restart))
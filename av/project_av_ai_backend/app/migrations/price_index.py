@@ -0,0 +1,57 @@
+"""
+Builds product_price_index from scratch: sets name_key/price_cell on every
+product, rebuilds every (name, cell) document and drops documents no product
+maps to any more.
+
+    python -m app.migrations.price_index [--batch-size 1000]
+
+Run it once before deploying the price index (best-price reads only from
+it), and again after changing PRICE_INDEX_GEOHASH_PRECISION. Safe to re-run
+and to run while the API is serving; writes during the run refresh their own
+documents as usual.
+"""
+import argparse
+import asyncio
+
+from app.db import products_collection, product_price_index_collection, ensure_indexes
+from app.price_index import index_id, rekey, rebuild_groups
+
+
+async def build_price_index(batch_size: int = 1000):
+    await ensure_indexes()
+    cursor = products_collection.find(
+        {}, {"product_name": 1, "owner_id": 1, "name_key": 1, "price_cell": 1}
+    ).batch_size(batch_size)
+    groups = set()
+    batch = []
+    seen = 0
+    async for product in cursor:
+        batch.append(product)
+        if len(batch) == batch_size:
+            groups.update(await rekey(batch))
+            seen += len(batch)
+            batch = []
+            print(f"... {seen} products keyed")
+    if batch:
+        groups.update(await rekey(batch))
+        seen += len(batch)
+
+    # rekey() also returns the groups products left; rebuilding those deletes them if now empty
+    groups = sorted(group for group in groups if group[0] and group[1])
+    for start in range(0, len(groups), batch_size):
+        await rebuild_groups(groups[start:start + batch_size])
+        print(f"... {min(start + batch_size, len(groups))} of {len(groups)} documents rebuilt")
+
+    live = {index_id(key, cell) for key, cell in groups}
+    stale = [document["_id"] async for document in product_price_index_collection.find({}, {"_id": 1})
+             if document["_id"] not in live]
+    if stale:
+        await product_price_index_collection.delete_many({"_id": {"$in": stale}})
+    print(f"✅ Indexed {seen} products into {len(groups)} documents; removed {len(stale)} stale documents")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(build_price_index(args.batch_size))
@@ -0,0 +1,61 @@
+"""
+Converts products.shop_id from the shop's _id as a string to the ObjectId.
+
+    python -m app.migrations.product_shop_ids [--dry-run] [--batch-size 1000]
+
+Safe to re-run and to run while the API is serving: each update only applies
+if shop_id still holds the string it read. Values that are not valid
+ObjectIds are reported and left alone. Once it reports nothing left to
+convert on every environment, set PRODUCT_SHOP_ID_DUAL_READ=false.
+"""
+import argparse
+import asyncio
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from app.db import products_collection, ensure_indexes
+
+
+async def migrate_product_shop_ids(dry_run: bool = False, batch_size: int = 1000):
+    cursor = products_collection.find({"shop_id": {"$type": "string"}}, {"shop_id": 1}).batch_size(batch_size)
+    batch = []
+    converted = 0
+    invalid = []
+    async for product in cursor:
+        shop_id = product["shop_id"]
+        if not ObjectId.is_valid(shop_id):
+            invalid.append(str(product["_id"]))
+            continue
+        batch.append(UpdateOne(
+            {"_id": product["_id"], "shop_id": shop_id},
+            {"$set": {"shop_id": ObjectId(shop_id)}}
+        ))
+        if len(batch) == batch_size:
+            converted += await _apply(batch, dry_run)
+            batch = []
+            print(f"... {converted} products converted")
+    if batch:
+        converted += await _apply(batch, dry_run)
+
+    if not dry_run:
+        await ensure_indexes()
+    if invalid:
+        print(f"❌ {len(invalid)} products have a shop_id that is not an ObjectId: {', '.join(invalid[:20])}")
+    remaining = await products_collection.count_documents({"shop_id": {"$type": "string"}})
+    print(f"✅ {'Would convert' if dry_run else 'Converted'} {converted} products; {remaining} still have a string shop_id")
+
+
+async def _apply(batch, dry_run):
+    if dry_run:
+        return len(batch)
+    result = await products_collection.bulk_write(batch, ordered=False)
+    return result.modified_count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="Count what would change without writing")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(migrate_product_shop_ids(args.dry_run, args.batch_size))
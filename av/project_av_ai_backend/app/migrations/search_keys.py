@@ -0,0 +1,45 @@
+"""
+Backfills search_key/search_grams on products written before app/search.py.
+
+    python -m app.migrations.search_keys [--all] [--batch-size 1000]
+
+Safe to re-run: by default only products without search_grams are touched.
+--all recomputes every product, e.g. after the folding rules change.
+"""
+import argparse
+import asyncio
+
+from pymongo import UpdateOne
+
+from app.db import products_collection, ensure_indexes
+from app.search import search_fields
+
+
+async def backfill_search_keys(recompute_all: bool = False, batch_size: int = 1000):
+    query = {} if recompute_all else {"search_grams": {"$exists": False}}
+    cursor = products_collection.find(query, {"product_name": 1, "category": 1}).batch_size(batch_size)
+    batch = []
+    updated = 0
+    async for product in cursor:
+        batch.append(UpdateOne(
+            {"_id": product["_id"]},
+            {"$set": search_fields(product.get("product_name"), product.get("category"))}
+        ))
+        if len(batch) == batch_size:
+            result = await products_collection.bulk_write(batch, ordered=False)
+            updated += result.modified_count
+            batch = []
+            print(f"... {updated} products updated")
+    if batch:
+        result = await products_collection.bulk_write(batch, ordered=False)
+        updated += result.modified_count
+    await ensure_indexes()
+    print(f"✅ Search keys backfilled on {updated} products")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--all", action="store_true", help="Recompute keys on every product")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(backfill_search_keys(args.all, args.batch_size))
@@ -0,0 +1,109 @@
+"""
+Rebuilds shop_daily_metrics from the raw product_views/product_sales events,
+one UTC day at a time.
+
+    python -m app.migrations.shop_daily_metrics [--days 90] [--shop-id <id>]
+    python -m app.migrations.shop_daily_metrics --all
+
+Run it once before deploying the rollups (the dashboards read only from
+them) and whenever a day needs repairing. Each day is grouped server side
+with one aggregation per collection and its documents replaced, so re-running
+is safe. Sales events without a price are valued at the product's current
+price. Events flushed for a day while it is being rebuilt can be counted
+twice or not at all; rebuild today's documents at a quiet time.
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import ReplaceOne
+
+from app.db import product_views_collection, product_sales_collection, shop_daily_metrics_collection, ensure_indexes
+from app.shop_metrics import day_key, metrics_id, current_prices, totals, document
+
+_DAY_FORMAT = "%Y-%m-%d"
+
+
+def _group(match: dict, fields: dict) -> list:
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": {"shop_id": {"$toString": "$shop_id"}, "product_id": {"$toString": "$product_id"}},
+            **fields
+        }}
+    ]
+
+
+async def rebuild_day(day: str, shop_id: str = None) -> int:
+    """Replaces one day's documents (optionally one shop's); returns how many it wrote."""
+    start = datetime.strptime(day, _DAY_FORMAT)
+    match = {"timestamp": {"$gte": start, "$lt": start + timedelta(days=1)}}
+    if shop_id:
+        match["shop_id"] = {"$in": [shop_id, ObjectId(shop_id)]} # Events carry either form until normalised
+    views = await product_views_collection.aggregate(_group(match, {"views": {"$sum": 1}})).to_list(None)
+    sales = await product_sales_collection.aggregate(_group(match, {
+        "quantity": {"$sum": "$quantity"},
+        "revenue": {"$sum": {"$cond": [{"$isNumber": "$price"}, {"$multiply": ["$price", "$quantity"]}, 0]}},
+        "unpriced": {"$sum": {"$cond": [{"$isNumber": "$price"}, 0, "$quantity"]}}
+    })).to_list(None)
+
+    rows = []
+    for group in views + sales:
+        if not ObjectId.is_valid(group["_id"].get("shop_id") or ""):
+            continue
+        product_id = group["_id"].get("product_id")
+        rows.append({**group, "shop_id": group["_id"]["shop_id"], "day": day,
+                     "product_id": product_id if product_id and ObjectId.is_valid(product_id) else None})
+
+    now = datetime.utcnow()
+    documents = [document(shop, day, total, now) for (shop, _), total in totals(rows, await current_prices(rows)).items()]
+    if documents:
+        await shop_daily_metrics_collection.bulk_write(
+            [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in documents], ordered=False
+        )
+    # Shops with no events left that day keep no document
+    if shop_id:
+        if not documents:
+            await shop_daily_metrics_collection.delete_one({"_id": metrics_id(shop_id, day)})
+    else:
+        await shop_daily_metrics_collection.delete_many({"date": day, "_id": {"$nin": [doc["_id"] for doc in documents]}})
+    return len(documents)
+
+
+async def first_event_day() -> str:
+    firsts = []
+    for collection in (product_views_collection, product_sales_collection):
+        event = await collection.find_one({}, {"timestamp": 1}, sort=[("timestamp", 1)])
+        if event and isinstance(event.get("timestamp"), datetime):
+            firsts.append(event["timestamp"])
+    return day_key(min(firsts)) if firsts else None
+
+
+async def rebuild(days: int = None, shop_id: str = None):
+    await ensure_indexes()
+    today = datetime.utcnow()
+    if days is None:
+        first = await first_event_day()
+        if first is None:
+            print("✅ No events to roll up")
+            return
+        days = (today - datetime.strptime(first, _DAY_FORMAT)).days + 1
+    written = 0
+    for offset in range(days - 1, -1, -1):
+        day = day_key(today - timedelta(days=offset))
+        written += await rebuild_day(day, shop_id)
+        print(f"... {day}: {days - offset} of {days} days, {written} documents written")
+    print(f"✅ Rebuilt {days} days of shop_daily_metrics ({written} documents)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    scope = parser.add_mutually_exclusive_group()
+    scope.add_argument("--days", type=int, default=90, help="Rebuild the last N days, today included")
+    scope.add_argument("--all", action="store_true", help="Rebuild every day since the first event")
+    parser.add_argument("--shop-id", help="Rebuild only this shop's documents")
+    args = parser.parse_args()
+    if args.shop_id and not ObjectId.is_valid(args.shop_id):
+        parser.error(f"Invalid shop id: {args.shop_id}")
+    asyncio.run(rebuild(None if args.all else args.days, args.shop_id))
@@ -1,8 +1,9 @@
 import firebase_admin
 from firebase_admin import credentials, messaging
-from app.db import users_collection, shops_collection, products_collection, product_views_collection
+from app.db import users_collection, shops_collection, products_collection
+from app import shop_metrics
 from bson import ObjectId
-from datetime import datetime, timedelta, time
+from datetime import datetime, timedelta
 import logging
 import random
 from math import radians, cos, sin, asin, sqrt
@@ -40,7 +41,7 @@ def haversine(lat1, lon1, lat2, lon2):
     r = 6371 # Earth radius in km
     return c * r
 
-def get_nearby_user_tokens(shop_lat, shop_lng, radius_km=DEFAULT_NOTIFICATION_RADIUS_KM):
+async def get_nearby_user_tokens(shop_lat, shop_lng, radius_km=DEFAULT_NOTIFICATION_RADIUS_KM):
     """Finds FCM tokens of users within a radius of a shop."""
     try:
         # Assuming users have 'latitude', 'longitude', and 'fcm_tokens' (list) fields
@@ -54,7 +55,7 @@ def get_nearby_user_tokens(shop_lat, shop_lng, radius_km=DEFAULT_NOTIFICATION_RA
         })
 
         all_tokens = []
-        for user in nearby_users:
+        async for user in nearby_users:
             if isinstance(user.get("fcm_tokens"), list):
                 all_tokens.extend(user["fcm_tokens"])
         
@@ -129,7 +130,7 @@ async def send_fcm_notification(tokens: list, title: str, body: str, data: dict
                 try:
                     # Use MongoDB's $pull operator to remove specific tokens from the fcm_tokens array
                     # in any user document that contains them.
-                    result = users_collection.update_many(
+                    result = await users_collection.update_many(
                         {"fcm_tokens": {"$in": tokens_to_remove}},
                         {"$pull": {"fcm_tokens": {"$in": tokens_to_remove}}}
                     )
@@ -148,7 +149,7 @@ async def send_owner_morning_reminder():
         owners = users_collection.find({"role": "owner", "fcm_tokens": {"$exists": True, "$ne": []}})
         tokens = []
         owner_names = {} # Store names to personalize if available
-        for owner in owners:
+        async for owner in owners:
              if isinstance(owner.get("fcm_tokens"), list):
                  owner_id_str = str(owner["_id"])
                  tokens.extend(owner["fcm_tokens"])
@@ -186,26 +187,24 @@ async def send_owner_morning_reminder():
 async def send_owner_evening_stats():
     """Sends personalized evening view stats with more varied messages."""
     try:
-        today_start = datetime.combine(datetime.utcnow().date(), time.min)
-        yesterday_start = today_start - timedelta(days=1)
+        yesterday, today = shop_metrics.day_range(2)
+
+        owners = await users_collection.find({"role": "owner", "fcm_tokens": {"$exists": True, "$ne": []}}).to_list(None)
 
-        owners = list(users_collection.find({"role": "owner", "fcm_tokens": {"$exists": True, "$ne": []}}))
+        # Every owner's shop, then today's and yesterday's rollups for all of them: two queries in total
+        shops = await shops_collection.find(
+            {"owner_id": {"$in": [str(owner["_id"]) for owner in owners]}}, {"owner_id": 1}
+        ).to_list(None)
+        shop_ids = {shop["owner_id"]: str(shop["_id"]) for shop in shops}
+        rollups = await shop_metrics.daily(set(shop_ids.values()), [yesterday, today])
 
         for owner in owners:
             owner_id_str = str(owner["_id"]) # Use MongoDB ObjectId string
-            shop = shops_collection.find_one({"owner_id": owner_id_str}) # Query shop by owner's string _id
-            if not shop: continue
-
-            shop_id_obj = shop["_id"] # Use Shop's ObjectId for views query
+            shop_id = shop_ids.get(owner_id_str) # Shops are keyed by the owner's string _id
+            if not shop_id: continue
 
-            today_views_count = product_views_collection.count_documents({
-                "shop_id": shop_id_obj,
-                "timestamp": {"$gte": today_start}
-            })
-            yesterday_views_count = product_views_collection.count_documents({
-                 "shop_id": shop_id_obj,
-                 "timestamp": {"$gte": yesterday_start, "$lt": today_start}
-            })
+            today_views_count = rollups.get((shop_id, today), {}).get("views", 0)
+            yesterday_views_count = rollups.get((shop_id, yesterday), {}).get("views", 0)
 
             tokens = owner.get("fcm_tokens", [])
             # Basic check if tokens list exists and is not empty
@@ -253,7 +252,7 @@ async def send_owner_evening_stats():
 async def send_owner_night_stock_reminder():
     """Reminds owners to check stock, mentioning specific low-stock items."""
     try:
-        owners = list(users_collection.find({"role": "owner", "fcm_tokens": {"$exists": True, "$ne": []}}))
+        owners = await users_collection.find({"role": "owner", "fcm_tokens": {"$exists": True, "$ne": []}}).to_list(None)
 
         for owner in owners:
             owner_id_str = str(owner["_id"]) # Use MongoDB ObjectId string for querying products
@@ -262,10 +261,10 @@ async def send_owner_night_stock_reminder():
 
             # --- Find Low Stock Items ---
             low_stock_limit = 5
-            low_stock_products = list(products_collection.find(
+            low_stock_products = await products_collection.find(
                 {"owner_id": owner_id_str, "count": {"$lte": low_stock_limit}},
                 {"product_name": 1, "_id": 0} # Only fetch the name
-            ).limit(3)) # Limit to mentioning 3 items
+            ).limit(3).to_list(None) # Limit to mentioning 3 items
 
             low_stock_names = [p.get("product_name") for p in low_stock_products if p.get("product_name")]
             # --- End Find Low Stock ---
@@ -314,21 +313,16 @@ async def send_customer_morning_essentials():
             # Group by shop_id to get a list of product names per shop
             {
                 "$group": {
-                    "_id": "$shop_id", # Group by shop_id (which is a string)
+                    # shop_id is an ObjectId, or its string form on products not yet migrated
+                    "_id": {"$toObjectId": "$shop_id"},
                     "productNames": {"$addToSet": "$product_name"} # Get unique product names
                 }
             },
-            # Convert string shop_id back to ObjectId for shop lookup
-            {
-                "$addFields": {
-                    "shopObjectId": {"$toObjectId": "$_id"}
-                }
-            },
             # Lookup shop details using the ObjectId
             {
                 "$lookup": {
                     "from": "shops",
-                    "localField": "shopObjectId",
+                    "localField": "_id",
                     "foreignField": "_id",
                     "as": "shopInfo"
                 }
@@ -339,7 +333,7 @@ async def send_customer_morning_essentials():
             {
                 "$project": {
                     "_id": 0, # Exclude MongoDB _id
-                    "shop_id": "$_id", # Keep original string shop_id
+                    "shop_id": {"$toString": "$_id"}, # FCM data payloads must be strings
                     "shopName": "$shopInfo.name",
                     "latitude": "$shopInfo.latitude",
                     "longitude": "$shopInfo.longitude",
@@ -348,7 +342,7 @@ async def send_customer_morning_essentials():
             }
         ]
 
-        shops_with_essentials = list(products_collection.aggregate(pipeline))
+        shops_with_essentials = await products_collection.aggregate(pipeline).to_list(None)
 
         if not shops_with_essentials:
             logger.info("No shops found with fresh morning essentials today for dynamic notification.")
@@ -370,7 +364,7 @@ async def send_customer_morning_essentials():
                 continue
 
             total_shops_processed += 1
-            nearby_tokens = get_nearby_user_tokens(shop_lat, shop_lng)
+            nearby_tokens = await get_nearby_user_tokens(shop_lat, shop_lng)
 
             if nearby_tokens:
                 # --- Step 3: Construct Dynamic Message ---
@@ -399,7 +393,7 @@ async def send_customer_deals_reminder():
     """Notifies nearby customers about active deals."""
     try:
         now = datetime.utcnow()
-        shops_with_deals = products_collection.distinct("shop_id", {
+        shops_with_deals = await products_collection.distinct("shop_id", {
             "isOnSale": True,
             "saleEndDate": {"$gte": now},
             "inStock": True,
@@ -411,7 +405,7 @@ async def send_customer_deals_reminder():
             return
 
         shop_object_ids = [ObjectId(sid) for sid in shops_with_deals if ObjectId.is_valid(sid)]
-        shops = list(shops_collection.find({"_id": {"$in": shop_object_ids}}))
+        shops = await shops_collection.find({"_id": {"$in": shop_object_ids}}).to_list(None)
         sent_count = 0
 
         for shop in shops:
@@ -419,7 +413,7 @@ async def send_customer_deals_reminder():
             shop_lng = shop.get("longitude")
             if not shop_lat or not shop_lng: continue
 
-            nearby_tokens = get_nearby_user_tokens(shop_lat, shop_lng)
+            nearby_tokens = await get_nearby_user_tokens(shop_lat, shop_lng)
             if nearby_tokens:
                 title = "🔥 Hot Deals Alert!"
                 body = f"Don't miss out! Special offers available now at {shop.get('name', 'a nearby store')}. Check the app!"
@@ -461,7 +455,7 @@ async def send_subscription_reminders():
                 "fcm_tokens": {"$exists": True, "$ne": []}
             }
 
-            users = list(users_collection.find(query))
+            users = await users_collection.find(query).to_list(None)
 
             for user in users:
                 tokens = user.get("fcm_tokens", [])
@@ -490,10 +484,10 @@ async def send_owner_availability_request(owner_id: str, product_name: str, prod
     Includes custom sound payload.
     """
     try:
-        owner = users_collection.find_one({"_id": ObjectId(owner_id)}) # Assuming owner_id is passed as ID string or we fix lookup
+        owner = await users_collection.find_one({"_id": ObjectId(owner_id)}) # Assuming owner_id is passed as ID string or we fix lookup
         if not owner:
             # Fallback: try looking up by uid if _id failed (legacy support)
-            owner = users_collection.find_one({"uid": owner_id})
+            owner = await users_collection.find_one({"uid": owner_id})
             
         if not owner:
             logger.warning(f"Owner not found for availability request: {owner_id}")
@@ -536,7 +530,7 @@ async def send_owner_fomo_alert(owner_id: str, product_name: str):
         
         # Check 'fomo_cooldowns' in shops_collection
         
-        shop = shops_collection.find_one({"owner_id": owner_id})
+        shop = await shops_collection.find_one({"owner_id": owner_id})
         if not shop: return
         
         # safely get nested dict
@@ -549,11 +543,11 @@ async def send_owner_fomo_alert(owner_id: str, product_name: str):
                 return
 
         # 2. Send Notification
-        owner = users_collection.find_one({"uid": owner_id}) # owner_id in shops is usually uid
+        owner = await users_collection.find_one({"uid": owner_id}) # owner_id in shops is usually uid
         if not owner: 
              # Fallback to _id if uid lookup fails (unlikely given schema, but safe)
              if ObjectId.is_valid(owner_id):
-                 owner = users_collection.find_one({"_id": ObjectId(owner_id)})
+                 owner = await users_collection.find_one({"_id": ObjectId(owner_id)})
         
         if not owner: return
         
@@ -568,7 +562,7 @@ async def send_owner_fomo_alert(owner_id: str, product_name: str):
         )
 
         # 3. Update Cooldown
-        shops_collection.update_one(
+        await shops_collection.update_one(
             {"owner_id": owner_id},
             {"$set": {f"fomo_cooldowns.{product_name}": datetime.utcnow()}}
         )
@@ -585,14 +579,14 @@ async def send_owner_new_order_alert(shop_id_str: str, product_names: list):
     """
     try:
         from bson import ObjectId
-        shop = shops_collection.find_one({"_id": ObjectId(shop_id_str)})
+        shop = await shops_collection.find_one({"_id": ObjectId(shop_id_str)})
         if not shop:
             return
         
         owner_id = shop.get("owner_id")
-        owner = users_collection.find_one({"uid": owner_id})
+        owner = await users_collection.find_one({"uid": owner_id})
         if not owner and ObjectId.is_valid(owner_id):
-            owner = users_collection.find_one({"_id": ObjectId(owner_id)})
+            owner = await users_collection.find_one({"_id": ObjectId(owner_id)})
             
         if not owner:
             return
@@ -0,0 +1,146 @@
+import time
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+HASH_BITS = 64
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """
+    Difference hash of an image: one bit per horizontally adjacent pixel pair of a
+    (hash_size + 1) x hash_size grayscale thumbnail. Re-encodes, resizes and small
+    exposure changes of the same photo land within a few bits of each other.
+    """
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.BOX)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class PredictionCache:
+    """
+    LRU + TTL cache of prediction results keyed by a 64-bit perceptual hash.
+
+    A lookup also matches any cached hash within max_distance bits. The hash is
+    split into max_distance + 1 bands; two hashes that differ in at most
+    max_distance bits must agree on at least one whole band (pigeonhole), so
+    only entries sharing a band with the query are compared.
+
+    Every get/put carries the label-set version the result was computed
+    against; a new version empties the cache. Not thread-safe: use it from the
+    event loop only.
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl_seconds: float = 6 * 3600, max_distance: int = 4):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl_seconds
+        self.max_distance = max(0, min(max_distance, HASH_BITS - 1))
+        n_bands = self.max_distance + 1
+        widths = [HASH_BITS // n_bands + (1 if i < HASH_BITS % n_bands else 0) for i in range(n_bands)]
+        self._band_layout = []
+        shift = 0
+        for width in widths:
+            self._band_layout.append((shift, (1 << width) - 1))
+            shift += width
+        self._entries = OrderedDict() # hash -> (expires_at, value)
+        self._bands = [{} for _ in widths] # band value -> set of hashes
+        self._version = None
+        self._stats = {
+            "hits": 0,
+            "near_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    def _band_keys(self, key: int):
+        return [(key >> shift) & mask for shift, mask in self._band_layout]
+
+    def _discard(self, key: int):
+        self._entries.pop(key, None)
+        for band, value in zip(self._bands, self._band_keys(key)):
+            bucket = band.get(value)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del band[value]
+
+    def _check_version(self, version):
+        if version != self._version:
+            if self._entries:
+                self._stats["invalidations"] += 1
+            self.clear()
+            self._version = version
+
+    def clear(self):
+        self._entries.clear()
+        for band in self._bands:
+            band.clear()
+
+    def get(self, key: int, version):
+        """Returns the value cached for the nearest hash within max_distance, or None."""
+        self._check_version(version)
+        now = time.monotonic()
+        exact = self._entries.get(key)
+        if exact is not None and exact[0] <= now:
+            # A stale exact entry must not hide a fresh near-duplicate
+            self._discard(key)
+            self._stats["expirations"] += 1
+            exact = None
+        if exact is not None:
+            neighbours = [key]
+        else:
+            neighbours = set()
+            for band, value in zip(self._bands, self._band_keys(key)):
+                neighbours.update(band.get(value, ()))
+
+        best, best_distance = None, None
+        for candidate in neighbours:
+            distance = hamming(key, candidate)
+            if distance > self.max_distance or (best is not None and distance >= best_distance):
+                continue
+            if self._entries[candidate][0] <= now:
+                self._discard(candidate)
+                self._stats["expirations"] += 1
+                continue
+            best, best_distance = candidate, distance
+
+        if best is None:
+            self._stats["misses"] += 1
+            return None
+        self._entries.move_to_end(best)
+        self._stats["hits"] += 1
+        if best_distance:
+            self._stats["near_hits"] += 1
+        return self._entries[best][1]
+
+    def put(self, key: int, value, version):
+        # A result computed against a label set that has since changed is not stored
+        if version != self._version:
+            return
+        self._discard(key)
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        for band, band_value in zip(self._bands, self._band_keys(key)):
+            band.setdefault(band_value, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._discard(oldest)
+            self._stats["evictions"] += 1
+
+    def metrics(self) -> dict:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "max_distance": self.max_distance,
+            **self._stats,
+            "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import struct
+import time
+
+from app import clip_model
+from app.clip_model import ModelNotReadyError, predict_candidate_batch
+from app.inference_queue import InferenceBatcher
+from app.prediction_cache import PredictionCache, dhash
+from app.config import (
+    INFERENCE_MODE,
+    INFERENCE_SOCKET_PATH,
+    INFERENCE_SIDECAR_TIMEOUT_SECONDS,
+    INFERENCE_MAX_BATCH_SIZE,
+    INFERENCE_MAX_WAIT_MS,
+    INFERENCE_MAX_QUEUE_SIZE,
+    PREDICTION_CACHE_SIZE,
+    PREDICTION_CACHE_TTL_SECONDS,
+    PREDICTION_CACHE_MAX_DISTANCE
+)
+
+logger = logging.getLogger("uvicorn.error")
+
+# --- Wire format shared with app/inference_sidecar.py ---
+# Every message is a 4-byte big-endian header size, a JSON header, then header["length"] payload bytes.
+_HEADER_SIZE = struct.Struct(">I")
+MAX_HEADER_BYTES = 64 * 1024
+MAX_PAYLOAD_BYTES = 64 * 1024 * 1024
+
+
+async def write_message(writer: asyncio.StreamWriter, header: dict, payload: bytes = b""):
+    data = json.dumps({**header, "length": len(payload)}).encode()
+    writer.write(_HEADER_SIZE.pack(len(data)) + data)
+    if payload:
+        writer.write(payload)
+    await writer.drain()
+
+
+async def read_message(reader: asyncio.StreamReader):
+    (size,) = _HEADER_SIZE.unpack(await reader.readexactly(_HEADER_SIZE.size))
+    if size > MAX_HEADER_BYTES:
+        raise ValueError(f"Message header too large ({size} bytes)")
+    header = json.loads(await reader.readexactly(size))
+    length = header.get("length", 0)
+    if length > MAX_PAYLOAD_BYTES:
+        raise ValueError(f"Message payload too large ({length} bytes)")
+    payload = await reader.readexactly(length) if length else b""
+    return header, payload
+
+
+class LocalPredictor:
+    """Runs the CLIP model inside this process, batching concurrent requests."""
+
+    mode = "inprocess"
+
+    def __init__(self):
+        # Every image is scored to PREDICTION_MAX_TOP_K so any ?top_k is served from the same logits
+        self.batcher = InferenceBatcher(
+            predict_candidate_batch,
+            max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+            max_wait_ms=INFERENCE_MAX_WAIT_MS,
+            max_queue_size=INFERENCE_MAX_QUEUE_SIZE
+        )
+        # Repeat photos of the same packaged item are answered without a forward pass
+        self.cache = None
+        if PREDICTION_CACHE_SIZE > 0:
+            self.cache = PredictionCache(
+                max_entries=PREDICTION_CACHE_SIZE,
+                ttl_seconds=PREDICTION_CACHE_TTL_SECONDS,
+                max_distance=PREDICTION_CACHE_MAX_DISTANCE
+            )
+
+    async def start(self):
+        # The model loads on a background thread; non-ML routes serve immediately
+        clip_model.start_background_load()
+        await self.batcher.start()
+
+    async def stop(self):
+        await self.batcher.stop()
+
+    async def wait_until_ready(self, timeout: float) -> bool:
+        if clip_model.is_ready():
+            return True
+        return await asyncio.to_thread(clip_model.wait_until_ready, timeout)
+
+    async def status(self) -> dict:
+        return {"mode": self.mode, "ready": clip_model.is_ready(), "model": clip_model.load_status()}
+
+    async def metrics(self) -> dict:
+        metrics = self.batcher.metrics()
+        if self.cache is not None:
+            metrics["prediction_cache"] = self.cache.metrics()
+        return metrics
+
+    async def predict(self, image) -> list:
+        if self.cache is None:
+            return await self.batcher.submit(image)
+        key = await asyncio.to_thread(dhash, image)
+        version = clip_model.label_set_version()
+        candidates = self.cache.get(key, version)
+        if candidates is None:
+            candidates = await self.batcher.submit(image)
+            self.cache.put(key, candidates, version)
+        return candidates
+
+
+def _rgb_pixels(image):
+    rgb = image.convert("RGB")
+    return rgb.size, rgb.tobytes()
+
+
+class SidecarPredictor:
+    """
+    Sends images to the inference sidecar over a Unix socket, so this process never
+    loads torch. Decoded RGB pixels are shipped rather than the upload bytes, so
+    the sidecar does no decoding of its own.
+    """
+
+    mode = "sidecar"
+
+    def __init__(self, socket_path: str, timeout: float = 30):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def _request(self, header: dict, payload: bytes = b"") -> dict:
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(self.socket_path), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise ModelNotReadyError(f"Inference sidecar unreachable at {self.socket_path}: {e}")
+        try:
+            await write_message(writer, header, payload)
+            response, _ = await asyncio.wait_for(read_message(reader), self.timeout)
+        finally:
+            writer.close()
+        if "error" in response:
+            if response.get("status") == 503:
+                raise ModelNotReadyError(response["error"])
+            raise RuntimeError(f"Inference sidecar error: {response['error']}")
+        return response
+
+    async def wait_until_ready(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while True:
+            if (await self.status()).get("ready"):
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.25)
+
+    async def status(self) -> dict:
+        try:
+            response = await self._request({"op": "status"})
+        except ModelNotReadyError as e:
+            return {"mode": self.mode, "ready": False, "error": str(e)}
+        return {"mode": self.mode, "ready": response["ready"], "model": response["model"]}
+
+    async def metrics(self) -> dict:
+        return (await self._request({"op": "metrics"}))["metrics"]
+
+    async def predict(self, image) -> list:
+        size, pixels = await asyncio.to_thread(_rgb_pixels, image)
+        response = await self._request({"op": "predict", "mode": "RGB", "size": list(size)}, pixels)
+        return response["candidates"]
+
+
+def create_predictor():
+    if INFERENCE_MODE == "sidecar":
+        return SidecarPredictor(INFERENCE_SOCKET_PATH, timeout=INFERENCE_SIDECAR_TIMEOUT_SECONDS)
+    if INFERENCE_MODE != "inprocess":
+        raise ValueError(f"Unknown INFERENCE_MODE '{INFERENCE_MODE}'. Must be 'inprocess' or 'sidecar'.")
+    return LocalPredictor()
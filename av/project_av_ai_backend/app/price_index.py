@@ -0,0 +1,259 @@
+"""
+product_price_index: what the same product costs across nearby shops.
+
+One document per normalised product name (name_key) and geohash cell
+(PRICE_INDEX_GEOHASH_PRECISION) of the shops listing it:
+
+  _id                 "<name_key>|<cell>"
+  name_key, cell, product_name (the first listing's), categories
+  offers              one per product: product_id, shop_id, lat, lng,
+                      category, price, effective_price (salePrice while a
+                      promotion runs), isOnSale, saleEndDate, inStock, count,
+                      sale_count
+  min_price, max_price, median_price
+                      effective prices of the available offers (in stock,
+                      count > 0)
+  cheapest_shop_ids   up to PRICE_INDEX_CHEAPEST_SHOPS, cheapest first
+  offer_count, available_count, updated_at
+
+Products carry name_key and price_cell (their shop's cell), so a document is
+rebuilt from one indexed find of its products whenever one of them changes.
+Writers call refresh_products() after a change to price, promotion, stock,
+name or shop location. Around a delete they call group_keys() before and
+refresh_groups() after, and record_sales() when sale_count grows. Readers
+fetch the documents for the cells around a point instead of joining shops to
+products by exact product_name.
+
+Rebuilds are last-writer-wins: two racing rebuilds of one document can leave
+it a write behind until its next change. python -m app.migrations.price_index
+rebuilds everything.
+"""
+import logging
+from datetime import datetime
+from statistics import median
+
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
+
+from app.db import products_collection, shops_collection, product_price_index_collection
+from app.search import normalize
+from app.utils.distance import extract_shop_coordinates
+from app.utils.geohash import geohash, cells_covering
+from app.config import PRICE_INDEX_GEOHASH_PRECISION, PRICE_INDEX_CHEAPEST_SHOPS
+
+logger = logging.getLogger("uvicorn.error")
+
+_PRODUCT_FIELDS = {
+    "product_name": 1, "owner_id": 1, "category": 1, "price": 1, "salePrice": 1, "isOnSale": 1,
+    "saleEndDate": 1, "inStock": 1, "count": 1, "sale_count": 1, "name_key": 1, "price_cell": 1
+}
+_REBUILD_CHUNK = 500
+
+
+def name_key(product_name) -> str:
+    return normalize(product_name)
+
+
+def index_id(key: str, cell: str) -> str:
+    return f"{key}|{cell}"
+
+
+def effective_price(product: dict, now: datetime = None):
+    """salePrice while a promotion is running, otherwise price."""
+    if product.get("isOnSale") and product.get("salePrice") is not None:
+        ends = product.get("saleEndDate")
+        if ends is None or ends >= (now or datetime.utcnow()):
+            return product["salePrice"]
+    return product.get("price")
+
+
+def summarise(key: str, cell: str, products: list, shops: dict, now: datetime = None) -> dict:
+    """
+    The index document for one (name_key, cell), or None when no product
+    in it has a located shop. shops maps owner_id -> (shop_id, lat, lng).
+    """
+    now = now or datetime.utcnow()
+    offers = []
+    for product in products:
+        shop = shops.get(product.get("owner_id"))
+        if shop is None:
+            continue
+        offers.append({
+            "product_id": product["_id"],
+            "shop_id": shop[0],
+            "lat": shop[1],
+            "lng": shop[2],
+            "category": product.get("category"),
+            "price": product.get("price"),
+            "effective_price": effective_price(product, now),
+            "isOnSale": bool(product.get("isOnSale")),
+            "saleEndDate": product.get("saleEndDate"),
+            "inStock": bool(product.get("inStock")),
+            "count": product.get("count") or 0,
+            "sale_count": product.get("sale_count") or 0
+        })
+    if not offers:
+        return None
+
+    available = sorted(
+        (offer for offer in offers
+         if offer["inStock"] and offer["count"] > 0 and isinstance(offer["effective_price"], (int, float))),
+        key=lambda offer: offer["effective_price"]
+    )
+    prices = [offer["effective_price"] for offer in available]
+    cheapest_shop_ids = []
+    for offer in available:
+        if offer["shop_id"] not in cheapest_shop_ids:
+            cheapest_shop_ids.append(offer["shop_id"])
+        if len(cheapest_shop_ids) == PRICE_INDEX_CHEAPEST_SHOPS:
+            break
+    return {
+        "_id": index_id(key, cell),
+        "name_key": key,
+        "cell": cell,
+        "product_name": products[0].get("product_name"),
+        "categories": sorted({offer["category"] for offer in offers if offer["category"]}),
+        "offers": offers,
+        "min_price": prices[0] if prices else None,
+        "max_price": prices[-1] if prices else None,
+        "median_price": median(prices) if prices else None,
+        "cheapest_shop_ids": cheapest_shop_ids,
+        "offer_count": len(offers),
+        "available_count": len(available),
+        "updated_at": now
+    }
+
+
+async def _shops_by_owner(owner_ids) -> dict:
+    owner_ids = [owner_id for owner_id in owner_ids if owner_id]
+    if not owner_ids:
+        return {}
+    shops = await shops_collection.find(
+        {"owner_id": {"$in": owner_ids}}, {"owner_id": 1, "latitude": 1, "longitude": 1, "location": 1}
+    ).to_list(None)
+    located = {}
+    for shop in shops:
+        lat, lng = extract_shop_coordinates(shop)
+        if lat is not None and lng is not None:
+            located[shop["owner_id"]] = (str(shop["_id"]), lat, lng)
+    return located
+
+
+async def rebuild_groups(keys):
+    """Recomputes the documents for (name_key, cell) pairs from products; drops emptied ones."""
+    keys = sorted({(key, cell) for key, cell in keys if key and cell})
+    for start in range(0, len(keys), _REBUILD_CHUNK):
+        chunk = keys[start:start + _REBUILD_CHUNK]
+        products = await products_collection.find(
+            {"$or": [{"name_key": key, "price_cell": cell} for key, cell in chunk]}, _PRODUCT_FIELDS
+        ).to_list(None)
+        shops = await _shops_by_owner({product.get("owner_id") for product in products})
+        grouped = {group: [] for group in chunk}
+        for product in products:
+            grouped.setdefault((product["name_key"], product["price_cell"]), []).append(product)
+        operations = []
+        for (key, cell), group in grouped.items():
+            document = summarise(key, cell, group, shops)
+            if document is None:
+                operations.append(DeleteOne({"_id": index_id(key, cell)}))
+            else:
+                operations.append(ReplaceOne({"_id": document["_id"]}, document, upsert=True))
+        await product_price_index_collection.bulk_write(operations, ordered=False)
+
+
+async def rekey(products) -> set:
+    """
+    Sets name_key/price_cell on products (documents with _id, product_name,
+    owner_id and their current keys) and returns every (name_key, cell)
+    they left or joined.
+    """
+    shops = await _shops_by_owner({product.get("owner_id") for product in products})
+    touched = set()
+    updates = []
+    for product in products:
+        old = (product.get("name_key"), product.get("price_cell"))
+        shop = shops.get(product.get("owner_id"))
+        cell = geohash(shop[1], shop[2], PRICE_INDEX_GEOHASH_PRECISION)[0] if shop else None
+        new = (name_key(product.get("product_name")) or None, cell)
+        touched.update((old, new))
+        if new != old:
+            updates.append(UpdateOne({"_id": product["_id"]}, {"$set": {"name_key": new[0], "price_cell": new[1]}}))
+    if updates:
+        await products_collection.bulk_write(updates, ordered=False)
+    return touched
+
+
+async def refresh_products(query: dict):
+    """Re-keys the products matching query and rebuilds what they touch. Never raises into the write path."""
+    try:
+        products = await products_collection.find(
+            query, {"product_name": 1, "owner_id": 1, "name_key": 1, "price_cell": 1}
+        ).to_list(None)
+        if products:
+            await rebuild_groups(await rekey(products))
+    except Exception as e:
+        # The next change to the same products (or the migration) repairs the index
+        logger.warning(f"Price index refresh failed for {query}: {e}")
+
+
+async def refresh_for_product(product_id):
+    await refresh_products({"_id": product_id})
+
+
+async def refresh_for_owner(owner_id: str):
+    await refresh_products({"owner_id": owner_id})
+
+
+async def group_keys(query: dict) -> set:
+    """(name_key, cell) of the products matching query; call before deleting them."""
+    try:
+        products = await products_collection.find(query, {"name_key": 1, "price_cell": 1}).to_list(None)
+    except Exception as e:
+        logger.warning(f"Price index lookup failed for {query}: {e}")
+        return set()
+    return {(product.get("name_key"), product.get("price_cell")) for product in products}
+
+
+async def refresh_groups(keys):
+    try:
+        await rebuild_groups(keys)
+    except Exception as e:
+        logger.warning(f"Price index rebuild failed: {e}")
+
+
+async def record_sales(quantities: dict):
+    """Bumps the offers' sale_count in place for {product_id: quantity}: one find, one bulk write."""
+    try:
+        products = await products_collection.find(
+            {"_id": {"$in": list(quantities)}}, {"name_key": 1, "price_cell": 1}
+        ).to_list(None)
+        updates = [
+            UpdateOne(
+                {"_id": index_id(product["name_key"], product["price_cell"]), "offers.product_id": product["_id"]},
+                {"$inc": {"offers.$.sale_count": quantities[product["_id"]]}}
+            )
+            for product in products if product.get("name_key") and product.get("price_cell")
+        ]
+        if updates:
+            await product_price_index_collection.bulk_write(updates, ordered=False)
+    except Exception as e:
+        logger.warning(f"Price index sale update failed for {len(quantities)} products: {e}")
+
+
+async def groups_near(lat: float, lng: float, radius_km: float, category: str = None) -> list:
+    """Every index document in the cells covering radius_km around a point, optionally for one category."""
+    query = {"cell": {"$in": cells_covering(lat, lng, radius_km, PRICE_INDEX_GEOHASH_PRECISION)}}
+    if category and category != "All":
+        query["categories"] = category
+    return await product_price_index_collection.find(query).to_list(None)
+
+
+async def groups_for(name_keys, points, radius_km: float) -> list:
+    """The documents for name_keys in the cells covering radius_km around any of the (lat, lng) points."""
+    cells = set()
+    for lat, lng in points:
+        cells.update(cells_covering(lat, lng, radius_km, PRICE_INDEX_GEOHASH_PRECISION))
+    if not cells or not name_keys:
+        return []
+    return await product_price_index_collection.find(
+        {"name_key": {"$in": list(name_keys)}, "cell": {"$in": sorted(cells)}}, {"name_key": 1, "offers": 1}
+    ).to_list(None)
@@ -0,0 +1,142 @@
+"""
+Nearest-competitor prices for a page of products (/products/best-price).
+
+A product's competitor price is the price of the same product (by normalised
+name, app/price_index.name_key) at the nearest other shop within
+COMPETITOR_RADIUS_KM of the product's shop. Its discountPercentage is how much
+cheaper its current price (salePrice while on sale) is than that, in whole
+percent, or 0.
+
+Candidates come from product_price_index: one indexed read of the page's
+names in the cells around the page's shops. Distances are then one vectorised
+matrix per name, in memory. This replaces two queries per product (a
+find_one for the shop, then $geoNear + $lookup on exact product_name).
+"""
+import logging
+from datetime import datetime
+
+import numpy as np
+from bson import ObjectId
+
+from app.db import shops_collection
+from app.price_index import name_key, groups_for
+from app.utils.distance import extract_shop_coordinates, haversine_matrix
+
+logger = logging.getLogger("uvicorn.error")
+
+COMPETITOR_RADIUS_KM = 5
+
+
+def current_price(product: dict):
+    return product.get("salePrice") if product.get("isOnSale") else product.get("price")
+
+
+def discount_percentage(price, competitor_price) -> int:
+    """Whole percent by which price undercuts competitor_price; 0 if it doesn't or either is missing."""
+    try:
+        if price is None or competitor_price is None or competitor_price <= price:
+            return 0
+        return int((competitor_price - price) / competitor_price * 100)
+    except TypeError:
+        return 0
+
+
+def nearest_competitor_prices(products, shop_coordinates, offers, radius_km: float = COMPETITOR_RADIUS_KM) -> list:
+    """
+    Competitor price (or None) for each product.
+
+    shop_coordinates maps a product's shop_id to (lat, lng); offers are
+    price index offers, each with its name_key, shop_id, lat, lng and price.
+    """
+    prices = [None] * len(products)
+    by_name = {}
+    for offer in offers:
+        by_name.setdefault(offer["name_key"], []).append(offer)
+
+    rows_by_name = {}
+    for i, product in enumerate(products):
+        key = name_key(product.get("product_name"))
+        if key in by_name and str(product.get("shop_id")) in shop_coordinates:
+            rows_by_name.setdefault(key, []).append(i)
+
+    for key, rows in rows_by_name.items():
+        candidates = by_name[key]
+        shop_ids = np.array([str(offer["shop_id"]) for offer in candidates])
+        origins = [shop_coordinates[str(products[i]["shop_id"])] for i in rows]
+        distances = haversine_matrix([lat for lat, _ in origins], [lng for _, lng in origins],
+                                     [offer["lat"] for offer in candidates], [offer["lng"] for offer in candidates])
+        for row, i in enumerate(rows):
+            eligible = (distances[row] <= radius_km) & (shop_ids != str(products[i]["shop_id"]))
+            if eligible.any():
+                nearest = np.flatnonzero(eligible)[np.argmin(distances[row][eligible])]
+                prices[i] = candidates[nearest]["price"]
+    return prices
+
+
+def best_price_offers(groups, lat: float, lng: float, min_km: float, max_km: float, category: str = None,
+                      now: datetime = None) -> list:
+    """
+    The /products/best-price ranking over price index documents: for each
+    product name, the best-selling in-stock offer within [min_km, max_km]
+    that is not on a running promotion (cheapest first among equal sales).
+    Returns (offer, distance_km) pairs, nearest first.
+    """
+    now = now or datetime.utcnow()
+    candidates = []
+    for group in groups:
+        for offer in group["offers"]:
+            if not offer.get("inStock") or (category and category != "All" and offer.get("category") != category):
+                continue
+            sale_ends = offer.get("saleEndDate")
+            if offer.get("isOnSale") and (sale_ends is None or sale_ends >= now):
+                continue
+            candidates.append((group["name_key"], offer))
+    if not candidates:
+        return []
+
+    distances = haversine_matrix([lat], [lng], [offer["lat"] for _, offer in candidates],
+                                 [offer["lng"] for _, offer in candidates])[0]
+    best = {}
+    for (key, offer), distance in zip(candidates, distances):
+        if distance < min_km or distance > max_km:
+            continue
+        price = offer.get("price")
+        rank = (-(offer.get("sale_count") or 0), price if isinstance(price, (int, float)) else float("inf"))
+        if key not in best or rank < best[key][0]:
+            best[key] = (rank, offer, float(distance))
+    return sorted(((offer, distance) for _, offer, distance in best.values()), key=lambda pair: pair[1])
+
+
+async def competitor_discounts(products: list, shop_coordinates: dict = None,
+                               radius_km: float = COMPETITOR_RADIUS_KM) -> list:
+    """
+    discountPercentage for each product (0 when there is no cheaper-than-
+    competitor price). Pass shop_coordinates (shop_id -> (lat, lng)) when the
+    caller already has them to skip the shops query.
+    """
+    discounts = [0] * len(products)
+    names = {name_key(product.get("product_name")) for product in products} - {""}
+    if not names:
+        return discounts
+    try:
+        if shop_coordinates is None:
+            shop_coordinates = {}
+            shop_ids = {str(product.get("shop_id")) for product in products}
+            shops = await shops_collection.find(
+                {"_id": {"$in": [ObjectId(shop_id) for shop_id in shop_ids if ObjectId.is_valid(shop_id)]}},
+                {"latitude": 1, "longitude": 1, "location": 1}
+            ).to_list(None)
+            for shop in shops:
+                lat, lng = extract_shop_coordinates(shop)
+                if lat is not None and lng is not None:
+                    shop_coordinates[str(shop["_id"])] = (lat, lng)
+        if not shop_coordinates:
+            return discounts
+
+        groups = await groups_for(names, set(shop_coordinates.values()), radius_km)
+        offers = [{**offer, "name_key": group["name_key"]} for group in groups for offer in group["offers"]]
+        prices = nearest_competitor_prices(products, shop_coordinates, offers, radius_km)
+    except Exception as e:
+        logger.warning(f"Competitor price computation failed: {e}")
+        return discounts
+    return [discount_percentage(current_price(product), price) for product, price in zip(products, prices)]
@@ -27,7 +27,7 @@ logger = logging.getLogger("uvicorn.error")
 router = APIRouter()
 
 # UPDATED token creation with all claims as requested
-def create_access_token(data: dict):
+async def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
 
@@ -36,7 +36,7 @@ def create_access_token(data: dict):
     subscription_active = False 
     
     if user_id:
-        user = users_collection.find_one({"_id": ObjectId(user_id)})
+        user = await users_collection.find_one({"_id": ObjectId(user_id)})
         if user:
             renewal_date = user.get("next_payment_date")
             if renewal_date and isinstance(renewal_date, datetime):
@@ -73,7 +73,7 @@ class UserLoginRequest(BaseModel):
 
 @router.post("/signup")
 async def signup(user: User, background_tasks: BackgroundTasks): # <-- Add BackgroundTasks
-    existing_user = users_collection.find_one({"email": user.email})
+    existing_user = await users_collection.find_one({"email": user.email})
     
     if existing_user and existing_user.get("is_verified"):
         raise HTTPException(status_code=400, detail="Email already registered") 
@@ -87,7 +87,7 @@ async def signup(user: User, background_tasks: BackgroundTasks): # <-- Add Backg
     
     if existing_user:
         # User exists but is not verified, update their OTP
-        users_collection.update_one(
+        await users_collection.update_one(
             {"email": user.email},
             {"$set": {
                 "password_hash": get_password_hash(user.password),
@@ -122,7 +122,7 @@ async def signup(user: User, background_tasks: BackgroundTasks): # <-- Add Backg
             "hasEnteredReferral": False,
             "fcm_tokens": []
         }
-        users_collection.insert_one(user_data)
+        await users_collection.insert_one(user_data)
         
     return {"message": "OTP has been sent to your email."}
 
@@ -134,7 +134,7 @@ class OtpVerificationRequest(BaseModel):
 
 @router.post("/verify-otp")
 async def verify_otp(request: OtpVerificationRequest):
-    user = users_collection.find_one({"email": request.email})
+    user = await users_collection.find_one({"email": request.email})
 
     if not user:
         raise HTTPException(status_code=404, detail="User not found.")
@@ -152,7 +152,7 @@ async def verify_otp(request: OtpVerificationRequest):
     next_payment = datetime.utcnow() + timedelta(days=30)
     
     # Verification successful, update the user
-    users_collection.update_one(
+    await users_collection.update_one(
         {"email": request.email},
         {
             # Add next_payment_date to the $set operation
@@ -161,7 +161,7 @@ async def verify_otp(request: OtpVerificationRequest):
         }
     )
     # Log the user in by creating an access token
-    access_token = create_access_token(
+    access_token = await create_access_token(
         data={
             "sub": str(user["_id"]),
             "role": user.get("role", "customer"),
@@ -177,7 +177,7 @@ async def verify_otp(request: OtpVerificationRequest):
 # === MODIFIED LOGIN ENDPOINT ===
 @router.post("/login")
 async def login(credentials: UserLoginRequest):
-    user = users_collection.find_one({"email": credentials.email})
+    user = await users_collection.find_one({"email": credentials.email})
 
     if not user or not verify_password(credentials.password, user.get("password_hash")): 
         raise HTTPException(
@@ -191,7 +191,7 @@ async def login(credentials: UserLoginRequest):
         raise HTTPException(status_code=403, detail="Account not verified. Please check your email for an OTP.")
     # ----------------------
 
-    access_token = create_access_token(
+    access_token = await create_access_token(
         data={
             "sub": str(user["_id"]),
             "role": user.get("role", "customer"),
@@ -212,7 +212,7 @@ async def google_auth(request: GoogleAuthRequest):
         if not user_info:
             raise HTTPException(status_code=400, detail="Invalid Google token")
         
-        user = users_collection.find_one({"email": user_info.email})
+        user = await users_collection.find_one({"email": user_info.email})
         
         if user:
             # FIX: Validate role consistency
@@ -223,7 +223,7 @@ async def google_auth(request: GoogleAuthRequest):
                 )
             
             # FIXED: Include has_entered_referral in token with consistent naming
-            access_token = create_access_token({
+            access_token = await create_access_token({
                 "sub": str(user["_id"]),
                 "role": user["role"],
                 "onboarding_done": user.get("onboarding_done", False),
@@ -252,10 +252,10 @@ async def google_auth(request: GoogleAuthRequest):
             "uid": user_info.email.replace(' ', '_').lower() if user_info.email else str(uuid.uuid4())
         }
         
-        result = users_collection.insert_one(new_user_data)
+        result = await users_collection.insert_one(new_user_data)
         
         # FIXED: Consistent naming and added uid
-        access_token = create_access_token({
+        access_token = await create_access_token({
             "sub": str(result.inserted_id),
             "role": request.role,
             "onboarding_done": False,
@@ -286,7 +286,7 @@ async def verify_token(authorization: str = Header(None)):
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id = payload.get("sub")
         
-        user = users_collection.find_one({"_id": ObjectId(user_id)})
+        user = await users_collection.find_one({"_id": ObjectId(user_id)})
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
@@ -315,12 +315,12 @@ async def refresh_token(request: Request):
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid token payload")
         
-        user = users_collection.find_one({"_id": ObjectId(user_id)})
+        user = await users_collection.find_one({"_id": ObjectId(user_id)})
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
         # Create new token with updated claims
-        new_token = create_access_token(
+        new_token = await create_access_token(
             data={
                 "sub": str(user["_id"]),
                 "role": user.get("role", "customer"),
@@ -357,14 +357,14 @@ async def issue_new_token(data: dict):
             raise HTTPException(status_code=400, detail="Invalid user ID format")
             
         user_obj_id = ObjectId(user_id)
-        user = users_collection.find_one({"_id": user_obj_id})
+        user = await users_collection.find_one({"_id": user_obj_id})
 
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
         # Create a new token with the user's current data from the database.
         # This will include the correct coin balance after the deduction.
-        access_token = create_access_token(
+        access_token = await create_access_token(
             data={
                 "sub": str(user["_id"]),
                 "role": user.get("role", "customer"),
@@ -29,11 +29,11 @@ async def apply_referral(request: ApplyReferralRequest):
         customer_id = request.customer_id
         referral_code = request.referral_code.upper()
 
-        referrer = users_collection.find_one({"referral_code": referral_code})
+        referrer = await users_collection.find_one({"referral_code": referral_code})
         if not referrer:
             raise HTTPException(status_code=404, detail="Invalid referral code")
         
-        customer = users_collection.find_one({"_id": ObjectId(customer_id)})
+        customer = await users_collection.find_one({"_id": ObjectId(customer_id)})
         if not customer:
             raise HTTPException(status_code=404, detail="Customer not found")
         
@@ -45,18 +45,18 @@ async def apply_referral(request: ApplyReferralRequest):
         
         # --- REWARD LOGIC (Unchanged) ---
         if referrer["role"] == "owner":
-            users_collection.update_one(
+            await users_collection.update_one(
                 {"_id": referrer["_id"]},
                 {"$inc": {"referral_earnings": 5, "referral_count": 1}}
             )
         else:
-            users_collection.update_one(
+            await users_collection.update_one(
                 {"_id": referrer["_id"]},
                 {"$inc": {"coins": 25, "referral_count": 1}}
             )
             # --- START OF THE ACTUAL FIX ---
             # ADD A TRANSACTION LOG FOR THE REFERRER
-            rewards_collection.insert_one({
+            await rewards_collection.insert_one({
                 "user_id": str(referrer["_id"]),
                 "coins": 25,
                 "type": "referral_bonus",
@@ -65,7 +65,7 @@ async def apply_referral(request: ApplyReferralRequest):
             # --- END OF THE ACTUAL FIX ---
 
         # Update customer
-        users_collection.update_one(
+        await users_collection.update_one(
             {"_id": ObjectId(customer_id)}, 
             {
                 "$inc": {"coins": 25},
@@ -75,7 +75,7 @@ async def apply_referral(request: ApplyReferralRequest):
         
         # --- START OF THE ACTUAL FIX ---
         # ADD A TRANSACTION LOG FOR THE CUSTOMER
-        rewards_collection.insert_one({
+        await rewards_collection.insert_one({
             "user_id": customer_id, # This is already the string _id
             "coins": 25,
             "type": "referral",
@@ -84,7 +84,7 @@ async def apply_referral(request: ApplyReferralRequest):
         # --- END OF THE ACTUAL FIX ---
 
         # Record transaction (this logs to a different collection, we leave it for now)
-        referral_transactions_collection.insert_one({
+        await referral_transactions_collection.insert_one({
             "referrer_id": str(referrer["_id"]),
             "customer_id": str(customer["_id"]),
             "code": referral_code,
@@ -105,7 +105,7 @@ async def apply_referral(request: ApplyReferralRequest):
         )
         
         # Return response
-        updated_customer = users_collection.find_one({"_id": ObjectId(customer_id)})
+        updated_customer = await users_collection.find_one({"_id": ObjectId(customer_id)})
         print("DEBUG: New token data being created:", token_data)
 
         return {
@@ -128,7 +128,7 @@ async def skip_referral(request: SkipReferralRequest):
     try:
         user_id = request.user_id
         
-        result = users_collection.update_one(
+        result = await users_collection.update_one(
             {"_id": ObjectId(user_id)}, 
             {"$set": {"hasEnteredReferral": True}}
         )
@@ -136,7 +136,7 @@ async def skip_referral(request: SkipReferralRequest):
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="User not found")
         
-        user = users_collection.find_one({"_id": ObjectId(user_id)})
+        user = await users_collection.find_one({"_id": ObjectId(user_id)})
         
         token_data = {
             "sub": user["uid"],
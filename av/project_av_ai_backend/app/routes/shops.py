@@ -5,15 +5,30 @@ from app.db import (
     product_views_collection, 
     product_sales_collection,
     users_collection,
-    orders_collection
+    orders_collection,
+    shop_products_lookup
 )
 from app.schemas.shop import ShopCreate
+from app.search import search_filter, rank_products
+from app.config import (
+    SHOP_SEARCH_RADIUS_KM,
+    SHOP_SEARCH_MAX_RADIUS_KM,
+    SHOP_SEARCH_LIMIT,
+    SHOP_SEARCH_MAX_LIMIT,
+    SHOP_SEARCH_MAX_PRODUCTS_PER_SHOP
+)
+from app.utils.pagination import encode_cursor, decode_cursor
+from app.feed_cache import feed_cache, SHOP_LAT_FIELD, SHOP_LNG_FIELD
+from app.pricing import competitor_discounts, best_price_offers
+from app.price_index import groups_near as price_groups_near
+from app.event_buffer import event_buffer, EventBufferFull
+from app import shop_metrics
+from app.utils.distance import extract_shop_coordinates
 from bson import ObjectId
 from bson.errors import InvalidId  # Added for error handling
 from math import radians, cos, sin, asin, sqrt
 from datetime import datetime, timedelta
 import json
-import pymongo  # Added for DESCENDING sort
 from fastapi.responses import JSONResponse  # Added for JSONResponse
 import re
 
@@ -67,91 +82,13 @@ def haversine(lat1, lon1, lat2, lon2):
     r = 6371 # Earth radius in km
     return c * r
 
-# FIXED: Unified coordinate extraction
-def extract_shop_coordinates(shop):
-    # Priority 1: Direct fields
-    if 'latitude' in shop and 'longitude' in shop:
-        return float(shop['latitude']), float(shop['longitude'])
-    
-    # Priority 2: GeoJSON format (corrected order)
-    if 'location' in shop and 'coordinates' in shop['location']:
-        coords = shop['location']['coordinates']
-        if len(coords) >= 2:
-            return float(coords[1]), float(coords[0])
-    
-    return None, None
-
-def compute_discount(product, user_lat, user_lng):
-    """
-    For a given product, find the nearest shop within 5km that sells the same product
-    and compute discount percentage if the current price is lower.
-    """
-    try:
-        current_shop = shops_collection.find_one({"_id": ObjectId(product["shop_id"])})
-        if not current_shop:
-            return 0
-        cur_lat, cur_lng = extract_shop_coordinates(current_shop)
-        if cur_lat is None or cur_lng is None:
-            return 0
-
-        # Find nearest shop within 5km with the same product
-        pipeline = [
-            {
-                "$geoNear": {
-                    "near": {"type": "Point", "coordinates": [cur_lng, cur_lat]},
-                    "distanceField": "distance",
-                    "maxDistance": 5000,
-                    "spherical": True,
-                    "query": {"_id": {"$ne": ObjectId(product["shop_id"])}}
-                }
-            },
-            {
-                "$lookup": {
-                    "from": "products",
-                    "let": {"shop_id_str": {"$toString": "$_id"}},
-                    "pipeline": [
-                        {"$match": {
-                            "$expr": {
-                                "$and": [
-                                    {"$eq": ["$shop_id", "$$shop_id_str"]},
-                                    {"$eq": ["$product_name", product["product_name"]]}
-                                ]
-                            }
-                        }}
-                    ],
-                    "as": "product_match"
-                }
-            },
-            {"$unwind": "$product_match"},
-            {"$limit": 1}, # <-- NEW: Only compare with the single nearest shop
-            {"$project": {"price": "$product_match.price"}}
-        ]
-        other_products = list(shops_collection.aggregate(pipeline))
-        if not other_products:
-            return 0
-
-        # Get the price from the nearest shop
-        other_shop_price = other_products[0]["price"]
-        current_price = product.get("salePrice") if product.get("isOnSale") else product.get("price")
-        if current_price is None:
-            return 0
-
-        # Calculate discount % only if the other shop is more expensive
-        if other_shop_price > current_price:
-            discount = ((other_shop_price - current_price) / other_shop_price) * 100
-            return int(discount)
-        return 0
-    except Exception as e:
-        print(f"Discount computation error: {e}")
-        return 0
-
 @router.post("/update-owner-location/")
 async def update_owner_location(owner_id: str = Query(...), lat: float = Query(...), lng: float = Query(...)):
     try:
         # NEW: Validate and normalize coordinates
         lat, lng = validate_and_normalize_coords(lat, lng)
         
-        shops_collection.update_one(
+        await shops_collection.update_one(
             {"owner_id": owner_id},
             {"$set": {
                 "owner_location": {
@@ -166,15 +103,18 @@ async def update_owner_location(owner_id: str = Query(...), lat: float = Query(.
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 
-def check_missed_opportunities(product_name: str, user_lat: float, user_lng: float):
+async def check_missed_opportunities(product_name: str, user_lat: float, user_lng: float):
     try:
         # 1. Find products that match the name BUT have 0 stock
-        search_regex = {"$regex": product_name, "$options": "i"}
-        missed_products = list(products_collection.find({
-            "product_name": search_regex,
+        search_query = search_filter(product_name)
+        if search_query is None:
+            return
+        missed_products = await products_collection.find({
+            **search_query,
             "count": 0, # Specifically looking for OUT OF STOCK
             "owner_id": {"$exists": True}
-        }))
+        }).to_list(None)
+        missed_products = rank_products(missed_products, product_name)
 
         if not missed_products:
             return
@@ -183,7 +123,7 @@ def check_missed_opportunities(product_name: str, user_lat: float, user_lng: flo
         from app.notifications import send_owner_fomo_alert # Import here to avoid circular dependency
         
         for product in missed_products:
-            shop = shops_collection.find_one({"owner_id": product["owner_id"]})
+            shop = await shops_collection.find_one({"owner_id": product["owner_id"]})
             if shop:
                 shop_lat, shop_lng = extract_shop_coordinates(shop)
                 if shop_lat and shop_lng:
@@ -191,8 +131,7 @@ def check_missed_opportunities(product_name: str, user_lat: float, user_lng: flo
                     if dist <= 5: # Only notify if user is within 5km
                         # Trigger the notification logic (checks cooldown internally)
                         # We pass the product name explicitly to show "Customer looking for Bread"
-                        import asyncio
-                        asyncio.run(send_owner_fomo_alert(product["owner_id"], product["product_name"]))
+                        await send_owner_fomo_alert(product["owner_id"], product["product_name"])
                         
     except Exception as e:
         print(f"FOMO Check Error: {e}")
@@ -203,69 +142,106 @@ async def get_shops(
     product_name: str = Query(...),
     user_lat: float = Query(...),
     user_lng: float = Query(...),
-    in_stock: bool = Query(True)
+    in_stock: bool = Query(True),
+    radius_km: float = Query(None, gt=0),
+    limit: int = Query(None, ge=1),
+    cursor: str = Query(None)
 ):
+    """
+    Shops near the user stocking a matching product, nearest first, one page
+    at a time. Pass the returned next_cursor to get the following page; it is
+    None on the last page.
+    """
     try:
-        background_tasks.add_task(check_missed_opportunities, product_name, user_lat, user_lng)
-        search_regex = {"$regex": product_name, "$options": "i"}
-        
-        query = {
-            "$or": [
-                {"product_name": search_regex},
-                {"category": search_regex} 
-            ]
-        }
+        radius_km = min(radius_km or SHOP_SEARCH_RADIUS_KM, SHOP_SEARCH_MAX_RADIUS_KM)
+        limit = min(limit or SHOP_SEARCH_LIMIT, SHOP_SEARCH_MAX_LIMIT)
+        after = None
+        if cursor:
+            try:
+                position = decode_cursor(cursor)
+                after = (float(position["d"]), ObjectId(position["id"]))
+            except (ValueError, KeyError, TypeError, InvalidId):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+        else:
+            # Only the first page counts as a new search
+            background_tasks.add_task(check_missed_opportunities, product_name, user_lat, user_lng)
+        # Indexed prefix search over the folded name and category (see app/search.py)
+        product_query = search_filter(product_name)
+        if product_query is None:
+            return {"shops": [], "next_cursor": None}
         if in_stock:
-            query["inStock"] = True
-            query["count"] = {"$gt": 0}
-
-        matching_products = list(products_collection.find(query))
-        
-        if not matching_products:
-            return {"shops": []}
+            product_query["inStock"] = True
+            product_query["count"] = {"$gt": 0}
+
+        # One round trip: nearest shops first, each joined to its matching products.
+        # $geoNear bounds the work to shops inside the radius; the page stops after limit + 1 hits.
+        geo_near = {
+            "near": {"type": "Point", "coordinates": [user_lng, user_lat]},
+            "key": "location",
+            "distanceField": "distance_in_meters",
+            "maxDistance": radius_km * 1000,
+            "spherical": True
+        }
+        pipeline = [{"$geoNear": geo_near}]
+        if after:
+            # Resume after the last shop of the previous page; ties on distance are ordered by _id
+            last_distance, last_id = after
+            geo_near["minDistance"] = last_distance
+            pipeline.append({"$match": {"$or": [
+                {"distance_in_meters": {"$gt": last_distance}},
+                {"distance_in_meters": last_distance, "_id": {"$gt": last_id}}
+            ]}})
+        pipeline += [
+            {"$lookup": {
+                "from": "products",
+                "localField": "owner_id",
+                "foreignField": "owner_id",
+                "pipeline": [
+                    {"$match": product_query},
+                    {"$limit": SHOP_SEARCH_MAX_PRODUCTS_PER_SHOP},
+                    {"$project": {"_id": 0, "product_name": 1, "category": 1, "imageUrl": 1}}
+                ],
+                "as": "matched_products"
+            }},
+            {"$match": {"matched_products.0": {"$exists": True}}},
+            {"$limit": limit + 1},
+            {"$project": {
+                "name": 1,
+                "rating": {"$ifNull": ["$rating", 0]},
+                "latitude": {"$ifNull": ["$latitude", {"$arrayElemAt": ["$location.coordinates", 1]}]},
+                "longitude": {"$ifNull": ["$longitude", {"$arrayElemAt": ["$location.coordinates", 0]}]},
+                "distance_in_meters": 1,
+                "matched_products": 1
+            }}
+        ]
+        shops = await shops_collection.aggregate(pipeline).to_list(None)
+        next_cursor = None
+        if len(shops) > limit:
+            shops = shops[:limit]
+            next_cursor = encode_cursor({"d": shops[-1]["distance_in_meters"], "id": str(shops[-1]["_id"])})
 
-        owner_ids = list(set([p["owner_id"] for p in matching_products]))
-        
-        shops = list(shops_collection.find({
-            "owner_id": {"$in": owner_ids}
-        }))
-        
         shops_with_products = []
-        
         for shop in shops:
-            shop_lat, shop_lng = extract_shop_coordinates(shop)
-            if shop_lat is None or shop_lng is None:
-                continue
-                
-            distance = haversine(user_lat, user_lng, shop_lat, shop_lng)
-            
-            # --- UPDATED: Grab BOTH product names and their images ---
-            shop_products = [
-                p["product_name"] for p in matching_products
-                if p["owner_id"] == shop["owner_id"]
-            ]
-            shop_images = [
-                p.get("imageUrl") for p in matching_products 
-                if p["owner_id"] == shop["owner_id"] and p.get("imageUrl")
-            ]
-                
+            # Best matches first within each shop (a handful of products per shop)
+            shop_products = rank_products(shop["matched_products"], product_name)
             shops_with_products.append({
                 "_id": str(shop["_id"]),
                 "name": shop["name"],
-                "rating": shop.get("rating", 0),
-                "latitude": float(shop_lat),
-                "longitude": float(shop_lng),
-                "products": shop_products,
-                "preview_images": shop_images, # <-- NEW: Included for UI
-                "distance": distance
+                "rating": shop["rating"],
+                "latitude": float(shop["latitude"]),
+                "longitude": float(shop["longitude"]),
+                "products": [p["product_name"] for p in shop_products],
+                "preview_images": [p["imageUrl"] for p in shop_products if p.get("imageUrl")], # <-- NEW: Included for UI
+                "distance": shop["distance_in_meters"] / 1000
             })
-        
-        shops_with_products.sort(key=lambda x: x["distance"])
-        return {"shops": shops_with_products}
+        # Already sorted by distance by $geoNear
+        return {"shops": shops_with_products, "next_cursor": next_cursor}
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in get_shops: {str(e)}")
-        return {"shops": []}
+        return {"shops": [], "next_cursor": None}
         
 @router.get("/get-shop")
 async def get_shop(id: str = Query(...)):
@@ -278,16 +254,7 @@ async def get_shop(id: str = Query(...)):
 
         pipeline = [
             {"$match": {"$or": match_conditions}},
-            {"$lookup": {
-                "from": "products",
-                "let": {"shop_id_str": {"$toString": "$_id"}},
-                "pipeline": [
-                    {"$match": {
-                        "$expr": {"$eq": ["$shop_id", "$$shop_id_str"]},
-                    }}
-                ],
-                "as": "products"
-            }},
+            *shop_products_lookup("products"),
             {"$addFields": {
                 "products": {
                     "$map": {
@@ -321,7 +288,7 @@ async def get_shop(id: str = Query(...)):
             }}
         ]
 
-        result = list(shops_collection.aggregate(pipeline))
+        result = await shops_collection.aggregate(pipeline).to_list(None)
 
         if not result:
             return JSONResponse(status_code=404, content={"error": "Shop not found"})
@@ -341,67 +308,25 @@ async def get_shop(id: str = Query(...)):
 @router.get("/owner/shop-performance")
 async def get_shop_performance(owner_id: str, days: int = 30): # <-- CHANGED: Default is now 30 days
     try:
-        shop = shops_collection.find_one({"owner_id": owner_id})
+        shop = await shops_collection.find_one({"owner_id": owner_id})
         if not shop:
             return {"performance": []}
             
         shop_id = str(shop["_id"])
 
-        # Define the date range based on full calendar days for accuracy
-        end_date = datetime.utcnow().replace(hour=23, minute=59, second=59, microsecond=999999)
-        start_date = (end_date - timedelta(days=days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
-        
-        # Initialize the map with all days in the range
+        # One small shop_daily_metrics document per day instead of grouping the raw events
+        days = max(1, min(days, 366))
+        dates = shop_metrics.day_range(days)
+        rollups = await shop_metrics.daily([shop_id], dates)
         performance_map = {}
-        for i in range(days):
-            date_key = (start_date + timedelta(days=i)).strftime("%Y-%m-%d")
-            performance_map[date_key] = {"date": date_key, "sales": 0, "views": 0}
-            
-        # Get sales data
-        sales_pipeline = [
-            {"$match": {
-                "shop_id": ObjectId(shop_id),
-                "timestamp": {"$gte": start_date, "$lte": end_date}
-            }},
-            {"$group": {
-                "_id": {"$dateToString": { "format": "%Y-%m-%d", "date": "$timestamp" }},
-                "sales": {"$sum": "$quantity"}
-            }},
-            {"$project": {
-                "_id": 0,
-                "date": "$_id",
-                "sales": 1
-            }}
-        ]
-        sales_data = list(product_sales_collection.aggregate(sales_pipeline))
-        
-        # Get views data
-        views_pipeline = [
-            {"$match": {
-                "shop_id": ObjectId(shop_id),
-                "timestamp": {"$gte": start_date, "$lte": end_date},
-                "type": "view"
-            }},
-            {"$group": {
-                "_id": {"$dateToString": { "format": "%Y-%m-%d", "date": "$timestamp" }},
-                "views": {"$sum": 1}
-            }},
-            {"$project": {
-                "_id": 0,
-                "date": "$_id",
-                "views": 1
-            }}
-        ]
-        views_data = list(product_views_collection.aggregate(views_pipeline))
-        
-        # Populate map with the fetched data
-        for item in sales_data:
-            if item["date"] in performance_map:
-                performance_map[item["date"]]["sales"] = item["sales"]
-            
-        for item in views_data:
-            if item["date"] in performance_map:
-                performance_map[item["date"]]["views"] = item["views"]
+        for date_key in dates:
+            rollup = rollups.get((shop_id, date_key), {})
+            performance_map[date_key] = {
+                "date": date_key,
+                "sales": rollup.get("sales", 0),
+                "views": rollup.get("views", 0),
+                "revenue": rollup.get("revenue", 0)
+            }
         
         # Sort the data chronologically
         performance_data = sorted(performance_map.values(), key=lambda x: x["date"])
@@ -413,21 +338,33 @@ async def get_shop_performance(owner_id: str, days: int = 30): # <-- CHANGED: De
 
 # ===== UPDATED TOP PRODUCTS ENDPOINT =====
 @router.get("/owner/top-products")
-async def get_top_products(owner_id: str, limit: int = 3):
+async def get_top_products(owner_id: str, limit: int = 3, days: int = 30):
     try:
-        # Directly query products collection
-        top_products = products_collection.find(
-            {"owner_id": owner_id},
-            sort=[("sale_count", pymongo.DESCENDING)],
-            limit=limit
-        )
-        
+        shop = await shops_collection.find_one({"owner_id": owner_id}, {"_id": 1})
+        if not shop:
+            return {"products": []}
+
+        # Units sold per product over the last `days`, summed from the shop's daily rollups
+        sold = {}
+        rollups = await shop_metrics.daily([str(shop["_id"])], shop_metrics.day_range(max(1, min(days, 366))))
+        for rollup in rollups.values():
+            for product_id, counts in rollup.get("products", {}).items():
+                if counts.get("sales"):
+                    sold[product_id] = sold.get(product_id, 0) + counts["sales"]
+        top = sorted(sold.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+        names = {
+            str(p["_id"]): p.get("product_name")
+            for p in await products_collection.find(
+                {"_id": {"$in": [ObjectId(product_id) for product_id, _ in top]}}, {"product_name": 1}
+            ).to_list(None)
+        }
         return {"products": [
             {
-                "name": p["product_name"],
-                "sold": p.get("sale_count", 0)
+                "name": names[product_id],
+                "sold": units
             } 
-            for p in top_products
+            for product_id, units in top if product_id in names
         ]}
     except Exception as e:
         print(f"Top products error: {str(e)}")
@@ -451,53 +388,51 @@ async def get_extended_deals(
         if category and category != "All":
             match_query["products.category"] = category
 
-        pipeline = [
-            {
-                "$geoNear": {
-                    "near": {"type": "Point", "coordinates": [user_lng, user_lat]},
-                    "distanceField": "distance_in_meters",
-                    "minDistance": 5000, 
-                    "maxDistance": 50000,
-                    "spherical": True
-                }
-            },
-            {
-                "$lookup": {
-                    "from": "products",
-                    "let": { "shop_id_str": { "$toString": "$_id" } },
-                    "pipeline": [
-                        { "$match": { "$expr": { "$eq": [ "$shop_id", "$$shop_id_str" ] } } }
-                    ],
-                    "as": "products"
-                }
-            },
-            {"$unwind": "$products"},
-            {"$match": match_query}, # Applied dynamic match
-            # Sort by Popularity (Sale count) first, then Distance
-            {"$sort": {"products.sale_count": -1, "distance_in_meters": 1}},
-            {"$skip": skip},
-            {"$limit": limit},
-            {
-                "$project": {
-                    "_id": {"$toString": "$products._id"},
-                    "product_name": "$products.product_name",
-                    "price": "$products.price",
-                    "unit": "$products.unit",
-                    "imageUrl": "$products.imageUrl",
-                    "category": "$products.category", # Return category
-                    "shop_id": {"$toString": "$_id"},
-                    "shop_name": "$name",
-                    "distance": {"$divide": ["$distance_in_meters", 1000]},
-                    "isOnSale": "$products.isOnSale",
-                    "salePrice": "$products.salePrice",
-                    "saleDescription": "$products.saleDescription",
-                    # --- NEW: Project real sold count for frontend ---
-                    "sold_count": {"$ifNull": ["$products.sale_count", 0]},
-                    "marketing_tagline": {"$literal": "Worth the distance"}
+        # Ranked once per ~1 km tile and served from the feed cache (see app/feed_cache.py)
+        async def compute(lat, lng, min_km, max_km, count):
+            pipeline = [
+                {
+                    "$geoNear": {
+                        "near": {"type": "Point", "coordinates": [lng, lat]},
+                        "distanceField": "distance_in_meters",
+                        "minDistance": min_km * 1000,
+                        "maxDistance": max_km * 1000,
+                        "spherical": True
+                    }
+                },
+                *shop_products_lookup("products"),
+                {"$unwind": "$products"},
+                {"$match": match_query}, # Applied dynamic match
+                # Sort by Popularity (Sale count) first, then Distance
+                {"$sort": {"products.sale_count": -1, "distance_in_meters": 1}},
+                {"$limit": count},
+                {
+                    "$project": {
+                        "_id": {"$toString": "$products._id"},
+                        "product_name": "$products.product_name",
+                        "price": "$products.price",
+                        "unit": "$products.unit",
+                        "imageUrl": "$products.imageUrl",
+                        "category": "$products.category", # Return category
+                        "shop_id": {"$toString": "$_id"},
+                        "shop_name": "$name",
+                        "distance": {"$divide": ["$distance_in_meters", 1000]},
+                        SHOP_LAT_FIELD: {"$arrayElemAt": ["$location.coordinates", 1]},
+                        SHOP_LNG_FIELD: {"$arrayElemAt": ["$location.coordinates", 0]},
+                        "isOnSale": "$products.isOnSale",
+                        "salePrice": "$products.salePrice",
+                        "saleDescription": "$products.saleDescription",
+                        # --- NEW: Project real sold count for frontend ---
+                        "sold_count": {"$ifNull": ["$products.sale_count", 0]},
+                        "marketing_tagline": {"$literal": "Worth the distance"}
+                    }
                 }
-            }
-        ]
-        deals = list(shops_collection.aggregate(pipeline))
+            ]
+            return await shops_collection.aggregate(pipeline).to_list(None)
+
+        deals = await feed_cache.get_page(
+            "deals-extended", user_lat, user_lng, category, skip, limit, compute, max_km=50, min_km=5
+        )
         return {"products": deals}
     except Exception as error:
         print(f"Extended deals error: {error}")
@@ -525,57 +460,58 @@ async def get_trending_products(
         if category and category != "All":
             match_query["products.category"] = category
 
-        pipeline = [
-            {
-                "$geoNear": {
-                    "near": {"type": "Point", "coordinates": [user_lng, user_lat]},
-                    "distanceField": "distance_in_meters",
-                    "maxDistance": 5000, # 5 kilometers
-                    "spherical": True
-                }
-            },
-            {
-                "$lookup": {
-                    "from": "products",
-                    "let": { "shop_id_str": { "$toString": "$_id" } },
-                    "pipeline": [ { "$match": { "$expr": { "$eq": [ "$shop_id", "$$shop_id_str" ] } } } ],
-                    "as": "products"
-                }
-            },
-            {"$unwind": "$products"},
-            {"$match": match_query}, # Applied dynamic match
-            # Sort by MOST SOLD first, then by distance
-            {"$sort": {"products.sale_count": -1, "distance_in_meters": 1}},
-            {"$skip": skip},
-            {"$limit": limit},
-            {
-                "$project": {
-                    "_id": {"$toString": "$products._id"},
-                    "product_name": "$products.product_name",
-                    "price": "$products.price",
-                    "unit": "$products.unit",
-                    "imageUrl": "$products.imageUrl",
-                    "category": "$products.category", # Return category
-                    "shop_id": {"$toString": "$_id"},
-                    "shop_name": "$name",
-                    "distance": {"$divide": ["$distance_in_meters", 1000]},
-                    # FIX: Force isOnSale to False if the date has passed so it appears as a normal product
-                    "isOnSale": {
-                        "$cond": {
-                            "if": { "$lt": ["$products.saleEndDate", datetime.utcnow()] },
-                            "then": False,
-                            "else": "$products.isOnSale"
-                        }
-                    },
-                    "salePrice": "$products.salePrice",
-                    "saleDescription": "$products.saleDescription",
-                    # --- NEW: Project real sold count for frontend ---
-                    "sold_count": {"$ifNull": ["$products.sale_count", 0]},
-                    "marketing_tagline": {"$literal": "Trending now"}
+        # Ranked once per ~1 km tile and served from the feed cache (see app/feed_cache.py)
+        async def compute(lat, lng, min_km, max_km, count):
+            pipeline = [
+                {
+                    "$geoNear": {
+                        "near": {"type": "Point", "coordinates": [lng, lat]},
+                        "distanceField": "distance_in_meters",
+                        "minDistance": min_km * 1000,
+                        "maxDistance": max_km * 1000,
+                        "spherical": True
+                    }
+                },
+                *shop_products_lookup("products"),
+                {"$unwind": "$products"},
+                {"$match": match_query}, # Applied dynamic match
+                # Sort by MOST SOLD first, then by distance
+                {"$sort": {"products.sale_count": -1, "distance_in_meters": 1}},
+                {"$limit": count},
+                {
+                    "$project": {
+                        "_id": {"$toString": "$products._id"},
+                        "product_name": "$products.product_name",
+                        "price": "$products.price",
+                        "unit": "$products.unit",
+                        "imageUrl": "$products.imageUrl",
+                        "category": "$products.category", # Return category
+                        "shop_id": {"$toString": "$_id"},
+                        "shop_name": "$name",
+                        "distance": {"$divide": ["$distance_in_meters", 1000]},
+                        SHOP_LAT_FIELD: {"$arrayElemAt": ["$location.coordinates", 1]},
+                        SHOP_LNG_FIELD: {"$arrayElemAt": ["$location.coordinates", 0]},
+                        # FIX: Force isOnSale to False if the date has passed so it appears as a normal product
+                        "isOnSale": {
+                            "$cond": {
+                                "if": { "$lt": ["$products.saleEndDate", datetime.utcnow()] },
+                                "then": False,
+                                "else": "$products.isOnSale"
+                            }
+                        },
+                        "salePrice": "$products.salePrice",
+                        "saleDescription": "$products.saleDescription",
+                        # --- NEW: Project real sold count for frontend ---
+                        "sold_count": {"$ifNull": ["$products.sale_count", 0]},
+                        "marketing_tagline": {"$literal": "Trending now"}
+                    }
                 }
-            }
-        ]
-        trending = list(shops_collection.aggregate(pipeline))
+            ]
+            return await shops_collection.aggregate(pipeline).to_list(None)
+
+        trending = await feed_cache.get_page(
+            "trending", user_lat, user_lng, category, skip, limit, compute, max_km=5
+        )
         return {"products": trending}
     except Exception as error:
         print(f"Trending products error: {error}")
@@ -592,83 +528,64 @@ async def get_best_price_products(
     category: str = Query(None)
 ):
     try:
-        match_query = {
-            "products.inStock": True,
-            "$or": [
-                {"products.isOnSale": {"$ne": True}},
-                {"products.saleEndDate": {"$lt": datetime.utcnow()}}
-            ]
-        }
-        if category and category != "All":
-            match_query["products.category"] = category
-
-        pipeline = [
-            {
-                "$geoNear": {
-                    "near": {"type": "Point", "coordinates": [user_lng, user_lat]},
-                    "distanceField": "distance_in_meters",
-                    "maxDistance": 5000,
-                    "spherical": True,
-                }
-            },
-            {
-                "$lookup": {
-                    "from": "products",
-                    "let": { "shop_id_str": { "$toString": "$_id" } },
-                    "pipeline": [ { "$match": { "$expr": { "$eq": [ "$shop_id", "$$shop_id_str" ] } } } ],
-                    "as": "products"
-                }
-            },
-            {"$unwind": "$products"},
-            {"$match": match_query},
-            {"$sort": {"products.sale_count": -1, "products.price": 1}},
-            {"$group": {
-                "_id": "$products.product_name",
-                "best_product": {"$first": "$$ROOT"}
-            }},
-            {"$replaceRoot": {"newRoot": "$best_product"}},
-            {"$sort": {"distance_in_meters": 1}},
-            {"$skip": skip},
-            {"$limit": limit},
-            {
-                "$project": {
-                    "_id": {"$toString": "$products._id"},
-                    "product_name": "$products.product_name",
-                    "price": "$products.price",
-                    "unit": "$products.unit",
-                    "imageUrl": "$products.imageUrl",
-                    "category": "$products.category",
-                    "shop_id": {"$toString": "$_id"},
-                    "shop_name": "$name",
-                    "distance": {"$divide": ["$distance_in_meters", 1000]},
-                    "isOnSale": {
-                        "$cond": {
-                            "if": { "$lt": ["$products.saleEndDate", datetime.utcnow()] },
-                            "then": False,
-                            "else": "$products.isOnSale"
-                        }
-                    },
-                    "salePrice": "$products.salePrice",
-                    "saleDescription": "$products.saleDescription",
-                    "sold_count": {"$ifNull": ["$products.sale_count", 0]}
-                }
-            }
-        ]
-        best_price = list(shops_collection.aggregate(pipeline))
-
-        # Add discountPercentage by calling compute_discount
-        for item in best_price:
-            # Construct a product dict for compute_discount
-            product_for_discount = {
-                "shop_id": item["shop_id"],
-                "product_name": item["product_name"],
-                "price": item["price"],
-                "isOnSale": item.get("isOnSale", False),
-                "salePrice": item.get("salePrice")
-            }
-            discount = compute_discount(product_for_discount, user_lat, user_lng)
-            item["discountPercentage"] = discount if discount > 0 else None
+        # Ranked once per ~1 km tile and served from the feed cache (see app/feed_cache.py)
+        async def compute(lat, lng, min_km, max_km, count):
+            # Candidates come from the price index, not a shop -> products join (see app/price_index.py)
+            groups = await price_groups_near(lat, lng, max_km, category)
+            winners = best_price_offers(groups, lat, lng, min_km, max_km, category)[:count]
+            if not winners:
+                return []
+
+            products = await products_collection.find(
+                {"_id": {"$in": [offer["product_id"] for offer, _ in winners]}},
+                {"product_name": 1, "price": 1, "unit": 1, "imageUrl": 1, "category": 1, "isOnSale": 1,
+                 "saleEndDate": 1, "salePrice": 1, "saleDescription": 1, "sale_count": 1}
+            ).to_list(None)
+            products = {product["_id"]: product for product in products}
+            shop_ids = {offer["shop_id"] for offer, _ in winners}
+            shops = await shops_collection.find(
+                {"_id": {"$in": [ObjectId(shop_id) for shop_id in shop_ids if ObjectId.is_valid(shop_id)]}},
+                {"name": 1}
+            ).to_list(None)
+            shop_names = {str(shop["_id"]): shop.get("name") for shop in shops}
+
+            now = datetime.utcnow()
+            items = []
+            for offer, distance in winners:
+                product = products.get(offer["product_id"])
+                if product is None:
+                    continue # Deleted since the index was built
+                sale_ends = product.get("saleEndDate")
+                items.append({
+                    "_id": str(product["_id"]),
+                    "product_name": product.get("product_name"),
+                    "price": product.get("price"),
+                    "unit": product.get("unit"),
+                    "imageUrl": product.get("imageUrl"),
+                    "category": product.get("category"),
+                    "shop_id": offer["shop_id"],
+                    "shop_name": shop_names.get(offer["shop_id"]),
+                    "distance": distance,
+                    SHOP_LAT_FIELD: offer["lat"],
+                    SHOP_LNG_FIELD: offer["lng"],
+                    "isOnSale": False if sale_ends is None or sale_ends < now else product.get("isOnSale"),
+                    "salePrice": product.get("salePrice"),
+                    "saleDescription": product.get("saleDescription"),
+                    "sold_count": product.get("sale_count") or 0
+                })
+
+            # discountPercentage against the nearest other shop selling the same product; it depends on
+            # the product's shop, not the user, so it is cached with the feed
+            discounts = await competitor_discounts(
+                items, {offer["shop_id"]: (offer["lat"], offer["lng"]) for offer, _ in winners}
+            )
+            for item, discount in zip(items, discounts):
+                item["discountPercentage"] = discount if discount > 0 else None
+            return items
 
+        best_price = await feed_cache.get_page(
+            "best-price", user_lat, user_lng, category, skip, limit, compute, max_km=5, order_by_distance=True
+        )
         return {"products": best_price}
     except Exception as error:
         print(f"Best price error: {error}")
@@ -694,14 +611,16 @@ async def record_shop_view(shop_id: str):
             "timestamp": datetime.utcnow(),
             "type": "view"
         }
-        product_views_collection.insert_one(view_data)
-        
-        # Immediately update shop's view count
-        shops_collection.update_one(
-            {"_id": shop_id_obj}, # <-- Also use the ObjectId here
-            {"$inc": {"view_count": 1}}
-        )
+        # Written behind the request, with views of the same shop summed into one $inc per flush
+        await event_buffer.insert(product_views_collection, view_data)
+        await event_buffer.increment(shops_collection, shop_id_obj, {"view_count": 1})
         return {"success": True}
+    except HTTPException:
+        raise
+    except EventBufferFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e: # Failed the event schema (app/schemas/events.py)
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Error recording shop view: {str(e)}")
         raise HTTPException(
@@ -729,37 +648,29 @@ async def record_product_sale(sale_data: dict):
         product_id = ObjectId(product_id)
         shop_id = ObjectId(shop_id)
 
-        # Create sale document
+        # Create sale document (its _id is set here so the id can be returned before the write)
         sale_doc = {
+            "_id": ObjectId(),
             "product_id": product_id,
             "shop_id": shop_id,
             "quantity": sale_data["quantity"],
             "timestamp": datetime.utcnow()
         }
-        result = product_sales_collection.insert_one(sale_doc)
-        
-        # Update product sale count
-        products_collection.update_one(
-            {"_id": product_id},
-            {"$inc": {"sale_count": sale_data["quantity"]}}
-        )
-        
-        # Update shop analytics
-        shops_collection.update_one(
-            {"_id": shop_id},
-            {"$inc": {"sale_count": sale_data["quantity"]}}
-        )
-        
-        # FIX: Update shop's daily sales count
-        today = datetime.utcnow().strftime("%Y-%m-%d")
-        shops_collection.update_one(
-            {"_id": shop_id},
-            {"$inc": {"daily_sales": sale_data["quantity"]}},
-            upsert=True
-        )
+        # Written behind the request by the event buffer: the sale, the product's sale count (mirrored
+        # into the price index) and the shop's sale and daily sales counts, summed per flush
+        await event_buffer.insert(product_sales_collection, sale_doc)
+        await event_buffer.increment(products_collection, product_id, {"sale_count": sale_data["quantity"]})
+        await event_buffer.increment(shops_collection, shop_id, {
+            "sale_count": sale_data["quantity"],
+            "daily_sales": sale_data["quantity"]
+        })
         
         # FIX: Dispatch event for real-time updates
-        return {"success": True, "sale_id": str(result.inserted_id)}
+        return {"success": True, "sale_id": str(sale_doc["_id"])}
+    except EventBufferFull as e:
+        return JSONResponse(status_code=503, content={"success": False, "error": str(e)})
+    except ValueError as e: # Failed the event schema (app/schemas/events.py)
+        return JSONResponse(status_code=400, content={"success": False, "error": str(e)})
     except Exception as e:
         print(f"Sale recording error: {str(e)}")
         return {"success": False, "error": str(e)}
@@ -768,28 +679,23 @@ async def record_product_sale(sale_data: dict):
 async def get_owner_dashboard_metrics(owner_id: str = Query(...)):
     try:
         # Step 1: Find the shop_id from the owner_id.
-        shop = shops_collection.find_one({"owner_id": owner_id})
+        shop = await shops_collection.find_one({"owner_id": owner_id})
         if not shop:
             return {"todayViews": 0, "lowStockItems": 0, "activePromotions": 0}
         shop_id = str(shop["_id"])
 
-        # Define "today" for the queries
-        today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        
-        # 1. Get Today's Views
-        today_views = product_views_collection.count_documents({
-            "shop_id": shop_id, 
-            "timestamp": {"$gte": today_start}
-        })
+        # 1. Get Today's Views (from today's shop_daily_metrics rollup)
+        today = shop_metrics.day_range(1)
+        today_views = (await shop_metrics.daily([shop_id], today)).get((shop_id, today[0]), {}).get("views", 0)
 
         # 2. Get count of low stock items (FIXED: uses $lte for "less than or equal to")
-        low_stock_items = products_collection.count_documents({
+        low_stock_items = await products_collection.count_documents({
             "owner_id": owner_id,
             "count": {"$lte": 5} # Correctly includes items with a count of 5
         })
         
         # 3. NEW: Get count of active promotions
-        active_promotions = products_collection.count_documents({
+        active_promotions = await products_collection.count_documents({
             "owner_id": owner_id,
             "isOnSale": True,
             "saleEndDate": {"$gte": datetime.utcnow()}
@@ -805,7 +711,7 @@ async def get_owner_dashboard_metrics(owner_id: str = Query(...)):
         return {"todayViews": 0, "lowStockItems": 0, "activePromotions": 0}
 
         # 4. NEW: Get count of low stock items using owner_id
-        low_stock_items = products_collection.count_documents({
+        low_stock_items = await products_collection.count_documents({
             "owner_id": owner_id,
             "count": {"$lt": 5} # Items with less than 5 count
         })
@@ -830,9 +736,8 @@ async def get_inventory_alerts(owner_id: str = Query(...), limit: int = Query(50
         }).sort("count", 1).limit(limit) # Sort by lowest count first
 
         products_list = []
-        for product in alert_products:
-            product['_id'] = str(product['_id'])
-            products_list.append(product)
+        async for product in alert_products:
+            products_list.append(serialize_doc(product))
             
         return {"alerts": products_list}
     except Exception as e:
@@ -843,16 +748,15 @@ async def get_inventory_alerts(owner_id: str = Query(...), limit: int = Query(50
 async def get_active_promotions(owner_id: str = Query(...)):
     try:
         # Find products that are currently on sale and haven't expired
-        promotions = list(products_collection.find({
+        promotions = await products_collection.find({
             "owner_id": owner_id,
             "isOnSale": True,
             "saleEndDate": {"$gte": datetime.utcnow()}
-        }).sort("saleEndDate", 1)) # Sort by ending soonest
+        }).sort("saleEndDate", 1).to_list(None) # Sort by ending soonest
         
         products_list = []
         for product in promotions:
-            product['_id'] = str(product['_id'])
-            products_list.append(product)
+            products_list.append(serialize_doc(product))
             
         return {"promotions": products_list}
     except Exception as e:
@@ -882,22 +786,15 @@ async def get_nearby_shops(
         ]
 
         # Filter condition for category
-        product_match = { "$expr": { "$eq": [ "$shop_id", "$$shop_id_str" ] } }
+        product_match = {}
         if category and category != "All":
             product_match["category"] = category
             # If category is selected, only keep shops that have at least one product in this category
             pipeline.extend([
-                {
-                    "$lookup": {
-                        "from": "products",
-                        "let": { "shop_id_str": { "$toString": "$_id" } },
-                        "pipeline": [
-                            { "$match": product_match },
-                            { "$limit": 1 }
-                        ],
-                        "as": "category_check"
-                    }
-                },
+                *shop_products_lookup("category_check", [
+                    { "$match": product_match },
+                    { "$limit": 1 }
+                ]),
                 { "$match": { "category_check.0": { "$exists": True } } } # Only shops passing the check
             ])
 
@@ -911,17 +808,10 @@ async def get_nearby_shops(
             # <-- NEW: Sort by views AND sales only (most popular)
             { "$sort": { "total_views": -1, "total_sales": -1 } },  
             { "$limit": limit }, 
-            {
-                "$lookup": {
-                    "from": "products",
-                    "let": { "shop_id_str": { "$toString": "$_id" } },
-                    "pipeline": [
-                        { "$match": product_match }, # Applies the category filter to preview products too
-                        { "$limit": 4 }
-                    ],
-                    "as": "preview_products"
-                }
-            },
+            *shop_products_lookup("preview_products", [
+                { "$match": product_match }, # Applies the category filter to preview products too
+                { "$limit": 4 }
+            ]),
             {
                 "$project": {
                     "_id": {"$toString": "$_id"},
@@ -936,7 +826,7 @@ async def get_nearby_shops(
             }
         ])
         
-        shops = list(shops_collection.aggregate(pipeline))
+        shops = await shops_collection.aggregate(pipeline).to_list(None)
         return {"shops": shops}
     except Exception as e:
         print(f"Error fetching nearby shops: {str(e)}")
@@ -961,7 +851,7 @@ async def get_coin_history(
         orders = orders_collection.find(query).sort("timestamp", -1)
         result = []
         
-        for order in orders:
+        async for order in orders:
             # Convert UTC timestamp to IST (+5 hours, 30 minutes)
             ist_time = order["timestamp"] + timedelta(hours=5, minutes=30)
             
@@ -0,0 +1,55 @@
+from datetime import datetime
+from typing import Optional
+
+from bson import ObjectId
+from pydantic import BaseModel, ConfigDict, field_validator
+
+
+def coerce_object_id(value):
+    """An ObjectId from an ObjectId or its 24-character hex string; ValueError otherwise."""
+    if isinstance(value, ObjectId):
+        return value
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    raise ValueError(f"{value!r} is not a valid ObjectId")
+
+
+class AnalyticsEvent(BaseModel):
+    """
+    Base for documents written to the analytics collections. shop_id and
+    product_id are always stored as ObjectIds, whatever form the caller had,
+    so the (shop_id, timestamp) and product_id indexes serve every query.
+    """
+    shop_id: ObjectId
+    product_id: Optional[ObjectId] = None
+    timestamp: datetime
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @field_validator("shop_id", "product_id", mode="before")
+    @classmethod
+    def _object_id(cls, value):
+        return None if value is None else coerce_object_id(value)
+
+    def document(self) -> dict:
+        """The MongoDB document; unset optional fields are left out rather than stored as null."""
+        return self.model_dump(exclude_none=True)
+
+
+class ViewEvent(AnalyticsEvent):
+    """product_views: a product view, or a shop view when product_id is absent."""
+    type: str = "view"
+
+
+class SaleEvent(AnalyticsEvent):
+    """product_sales: units sold, with the unit price when the caller knows it."""
+    product_id: ObjectId
+    quantity: int
+    price: Optional[float] = None
+
+    @field_validator("quantity")
+    @classmethod
+    def _positive(cls, value):
+        if value < 1:
+            raise ValueError("quantity must be at least 1")
+        return value
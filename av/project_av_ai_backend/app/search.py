@@ -0,0 +1,157 @@
+"""
+Product search keys.
+
+Products carry two derived fields, maintained whenever product_name or
+category is written:
+
+  search_key    the normalised "name category" text
+  search_grams  edge n-grams (prefixes) of every token, both as written and
+                folded, indexed as a multikey index
+
+A query matches products whose grams contain, for every query token, either
+the token as typed or its folded form, so "tata sal" finds "Tata Salt" through
+an index lookup instead of a case-insensitive regex scan of the whole
+collection.
+
+Folding collapses the spelling variants common in Indian product names: doubled
+letters and long vowels (atta/aata/ata, paneer/panir), aspirated consonants
+(dhal/dal, bhindi/bindi), w/v, ph/f, and a trailing y/ie/i (chilly/chilli).
+Folding a partial word can differ from the matching prefix of the folded word
+("pane" vs "panir"), which is why the unfolded grams are kept alongside: a
+prefix typed as written always matches.
+"""
+import re
+import unicodedata
+
+SEARCH_MIN_GRAM = 2
+# Tokens longer than this are indexed by their first SEARCH_MAX_GRAM letters; rank_products() checks the rest
+SEARCH_MAX_GRAM = 10
+SEARCH_MAX_QUERY_TOKENS = 6
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+_FOLD_RULES = [
+    (re.compile(r"aa"), "a"),           # aata -> ata, daal -> dal
+    (re.compile(r"ee"), "i"),           # paneer -> panir
+    (re.compile(r"oo|ou"), "u"),
+    (re.compile(r"ph"), "f"),
+    (re.compile(r"w"), "v"),            # chawal -> chaval
+    (re.compile(r"([bdgk])h"), r"\1"),  # dhal -> dal, bhindi -> bindi, ghee -> gi; sh/th/ch are kept
+    (re.compile(r"(?<=[a-z])(y|ie)$"), "i"),   # chilly -> chili, maggie -> maggi
+    (re.compile(r"(.)\1+"), r"\1"),     # atta -> ata, chilli -> chili
+]
+
+
+def normalize(text) -> str:
+    """Lowercases, strips accents and punctuation, collapses whitespace."""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode()
+    return " ".join(_NON_ALNUM.sub(" ", text.lower()).split())
+
+
+def fold_token(token: str) -> str:
+    """Maps spelling variants of one normalised token to the same key."""
+    if token.isdigit():
+        return token
+    for pattern, replacement in _FOLD_RULES:
+        token = pattern.sub(replacement, token)
+    return token
+
+
+def token_forms(text) -> list:
+    """(as written, folded) for every normalised token."""
+    return [(token, fold_token(token)) for token in normalize(text).split()]
+
+
+def edge_grams(token: str) -> list:
+    if len(token) < SEARCH_MIN_GRAM:
+        return [token] if token else []
+    return [token[:n] for n in range(SEARCH_MIN_GRAM, min(len(token), SEARCH_MAX_GRAM) + 1)]
+
+
+def search_fields(product_name, category=None) -> dict:
+    """The derived fields to $set on a product whenever its name or category changes."""
+    grams = set()
+    for token, folded in token_forms(product_name) + token_forms(category):
+        grams.update(edge_grams(token))
+        grams.update(edge_grams(folded))
+    return {
+        "search_key": " ".join(part for part in (normalize(product_name), normalize(category)) if part),
+        "search_grams": sorted(grams)
+    }
+
+
+def query_tokens(query) -> list:
+    """
+    (as written, folded) query tokens, longest first so the most selective one
+    leads the filter. Single letters are dropped when the query has longer
+    tokens: they would match nearly everything.
+    """
+    forms = list(dict.fromkeys(token_forms(query)))
+    longer = [form for form in forms if len(form[0]) >= SEARCH_MIN_GRAM]
+    return sorted(longer or forms, key=lambda form: len(form[0]), reverse=True)[:SEARCH_MAX_QUERY_TOKENS]
+
+
+def _token_clause(token: str, folded: str) -> dict:
+    if len(token) < SEARCH_MIN_GRAM:
+        # No one-letter grams are stored; an anchored regex is still a bounded scan of the index
+        return {"search_grams": {"$regex": f"^{re.escape(token)}"}}
+    grams = list(dict.fromkeys(form[:SEARCH_MAX_GRAM] for form in (token, folded) if len(form) >= SEARCH_MIN_GRAM))
+    return {"search_grams": grams[0] if len(grams) == 1 else {"$in": grams}}
+
+
+def search_filter(query) -> dict:
+    """
+    Mongo filter for products matching every query token as a prefix, as
+    written or folded. Returns None only for a query with no letters or
+    digits, so callers can decide what that means.
+    """
+    forms = query_tokens(query)
+    if not forms:
+        return None
+    clauses = [_token_clause(token, folded) for token, folded in forms]
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def _position(forms: list, query_form: tuple, prefix: bool):
+    """Index of the first token matching the query token as written or folded, or None."""
+    for i, form in enumerate(forms):
+        for token, query_token in zip(form, query_form):
+            if token.startswith(query_token) if prefix else token == query_token:
+                return i
+    return None
+
+
+def score(product: dict, query_forms: list) -> float:
+    """
+    Relevance of one product: whole-word matches beat prefix matches, name
+    matches beat category matches, and shorter names (closer to the query)
+    break ties. Returns 0 when a long query token only shares its indexed
+    prefix with the product.
+    """
+    name_forms = token_forms(product.get("product_name"))
+    category_forms = token_forms(product.get("category"))
+    total = 0.0
+    for query_form in query_forms:
+        position = _position(name_forms, query_form, prefix=False)
+        if position is not None:
+            best = 3.0 if position == 0 else 2.5
+        elif _position(name_forms, query_form, prefix=True) is not None:
+            best = 2.0
+        elif _position(category_forms, query_form, prefix=False) is not None:
+            best = 1.0
+        elif _position(category_forms, query_form, prefix=True) is not None:
+            best = 0.5
+        else:
+            return 0.0
+        total += best
+    return total + 1.0 / (1 + len(name_forms))
+
+
+def rank_products(products: list, query) -> list:
+    """Drops false prefix matches and orders products by score, best first."""
+    forms = query_tokens(query)
+    scored = [(score(product, forms), product) for product in products]
+    scored = [item for item in scored if item[0] > 0]
+    scored.sort(key=lambda item: item[0], reverse=True)
+    return [product for _, product in scored]
@@ -0,0 +1,151 @@
+"""
+shop_daily_metrics: views, sales and revenue per shop and UTC day.
+
+  _id          "<shop_id>|<YYYY-MM-DD>"
+  shop_id      the shop's ObjectId
+  date         "YYYY-MM-DD"
+  views, sales (units), revenue
+  products     {product_id: {views, sales, revenue}}
+  updated_at
+
+Documents are read by _id, so a dashboard over N days fetches N small
+documents instead of grouping raw product_views/product_sales.
+
+They are kept up to date from the event buffer: after each flush writes
+view and sale events, record() folds them in with one bulk $inc upsert.
+Revenue is quantity x the sale's price when the event carries one,
+otherwise the product's current price (salePrice during a promotion).
+python -m app.migrations.shop_daily_metrics rebuilds days from the raw
+events.
+"""
+import logging
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from app.db import products_collection, shop_daily_metrics_collection
+from app.price_index import effective_price
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def day_key(timestamp: datetime) -> str:
+    return timestamp.strftime("%Y-%m-%d")
+
+
+def metrics_id(shop_id, day: str) -> str:
+    return f"{shop_id}|{day}"
+
+
+def day_range(days: int, end: datetime = None) -> list:
+    """The last `days` UTC day keys up to and including end's, oldest first."""
+    end = end or datetime.utcnow()
+    return [day_key(end - timedelta(days=offset)) for offset in range(days - 1, -1, -1)]
+
+
+def _id_string(value):
+    value = str(value) if value is not None else None
+    return value if value and ObjectId.is_valid(value) else None
+
+
+def event_rows(views=(), sales=()) -> list:
+    """
+    One row per event in the shape the backfill's $group produces: shop_id,
+    product_id (or None), day, and views or quantity/revenue/unpriced.
+    """
+    rows = []
+    for view in views:
+        shop_id = _id_string(view.get("shop_id"))
+        if shop_id and isinstance(view.get("timestamp"), datetime):
+            rows.append({"shop_id": shop_id, "product_id": _id_string(view.get("product_id")),
+                         "day": day_key(view["timestamp"]), "views": 1})
+    for sale in sales:
+        shop_id = _id_string(sale.get("shop_id"))
+        quantity = sale.get("quantity") or 0
+        if not shop_id or not isinstance(sale.get("timestamp"), datetime) or not isinstance(quantity, (int, float)):
+            continue
+        price = sale.get("price")
+        priced = isinstance(price, (int, float))
+        rows.append({"shop_id": shop_id, "product_id": _id_string(sale.get("product_id")),
+                     "day": day_key(sale["timestamp"]), "quantity": quantity,
+                     "revenue": price * quantity if priced else 0, "unpriced": 0 if priced else quantity})
+    return rows
+
+
+async def current_prices(rows) -> dict:
+    """product_id -> current effective price, for the rows with unpriced units."""
+    product_ids = {row["product_id"] for row in rows if row.get("unpriced") and row.get("product_id")}
+    if not product_ids:
+        return {}
+    products = await products_collection.find(
+        {"_id": {"$in": [ObjectId(product_id) for product_id in product_ids]}},
+        {"price": 1, "salePrice": 1, "isOnSale": 1, "saleEndDate": 1}
+    ).to_list(None)
+    return {str(product["_id"]): effective_price(product) for product in products}
+
+
+def totals(rows, prices: dict) -> dict:
+    """(shop_id, day) -> {views, sales, revenue, products: {product_id: {views, sales, revenue}}}."""
+    result = {}
+    for row in rows:
+        total = result.setdefault((row["shop_id"], row["day"]), {"views": 0, "sales": 0, "revenue": 0, "products": {}})
+        price = prices.get(row.get("product_id"))
+        revenue = (row.get("revenue") or 0) + (row.get("unpriced") or 0) * (price if isinstance(price, (int, float)) else 0)
+        counts = {"views": row.get("views") or 0, "sales": row.get("quantity") or 0, "revenue": revenue}
+        for field, amount in counts.items():
+            total[field] += amount
+        if row.get("product_id"):
+            product = total["products"].setdefault(row["product_id"], {"views": 0, "sales": 0, "revenue": 0})
+            for field, amount in counts.items():
+                product[field] += amount
+    return result
+
+
+def document(shop_id: str, day: str, total: dict, now: datetime = None) -> dict:
+    return {
+        "_id": metrics_id(shop_id, day),
+        "shop_id": ObjectId(shop_id),
+        "date": day,
+        "views": total["views"],
+        "sales": total["sales"],
+        "revenue": round(total["revenue"], 2),
+        "products": {product_id: {**counts, "revenue": round(counts["revenue"], 2)}
+                     for product_id, counts in total["products"].items()},
+        "updated_at": now or datetime.utcnow()
+    }
+
+
+async def record(views=(), sales=()):
+    """Folds freshly written view/sale events into the rollup. Never raises into the flush."""
+    try:
+        rows = event_rows(views, sales)
+        if not rows:
+            return
+        now = datetime.utcnow()
+        updates = []
+        for (shop_id, day), total in totals(rows, await current_prices(rows)).items():
+            increments = {field: total[field] for field in ("views", "sales", "revenue") if total[field]}
+            for product_id, counts in total["products"].items():
+                for field, amount in counts.items():
+                    if amount:
+                        increments[f"products.{product_id}.{field}"] = amount
+            updates.append(UpdateOne(
+                {"_id": metrics_id(shop_id, day)},
+                {"$inc": increments, "$set": {"updated_at": now},
+                 "$setOnInsert": {"shop_id": ObjectId(shop_id), "date": day}},
+                upsert=True
+            ))
+        await shop_daily_metrics_collection.bulk_write(updates, ordered=False)
+    except Exception as e:
+        # python -m app.migrations.shop_daily_metrics rebuilds the affected days from the raw events
+        logger.warning(f"Shop metrics rollup failed for {len(views)} views, {len(sales)} sales: {e}")
+
+
+async def daily(shop_ids, days: list) -> dict:
+    """(shop_id string, day) -> rollup document, for every shop and day that has one."""
+    ids = [metrics_id(shop_id, day) for shop_id in shop_ids for day in days]
+    if not ids:
+        return {}
+    documents = await shop_daily_metrics_collection.find({"_id": {"$in": ids}}).to_list(None)
+    return {(str(document["shop_id"]), document["date"]): document for document in documents}
@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger("uvicorn.error")
+
+META_SUFFIX = ".json"
+
+
+class TempFileStore:
+    """
+    Lifecycle manager for uploads parked in temp_uploads/ between
+    /upload-and-predict/ and /add-product/.
+
+    Each file gets a <name>.json sidecar with its size and expiry. Unclaimed
+    files expire after ttl_seconds; claim() extends that to claimed_ttl_seconds
+    while the image upload worker owns the file. sweep() deletes expired
+    files, stray files without metadata older than ttl_seconds, and then the
+    oldest unclaimed files until the directory is under max_bytes. The sweep
+    scans the directory itself, so it also cleans up after other workers.
+    """
+
+    def __init__(self, directory: str, ttl_seconds: float = 3600, claimed_ttl_seconds: float = 86400,
+                 max_bytes: int = 512 * 1024 * 1024):
+        self.directory = directory
+        self.ttl = ttl_seconds
+        self.claimed_ttl = claimed_ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        self._stats = {
+            "files": 0,
+            "bytes_held": 0,
+            "saved_total": 0,
+            "expired_total": 0,
+            "evicted_total": 0,
+            "last_sweep_at": None,
+            "last_sweep_ms": None,
+        }
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, temp_id: str) -> str:
+        # Client-supplied ids must not escape the directory or address a sidecar
+        name = os.path.basename(temp_id)
+        if not name or name.endswith(META_SUFFIX):
+            raise ValueError(f"Invalid temp file id '{temp_id}'")
+        return os.path.join(self.directory, name)
+
+    def _write_meta(self, path: str, meta: dict):
+        tmp_path = f"{path}{META_SUFFIX}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, f"{path}{META_SUFFIX}")
+
+    def _read_meta(self, path: str):
+        try:
+            with open(f"{path}{META_SUFFIX}") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, data: bytes, extension: str = "") -> str:
+        """Writes data under a new unique id and returns the id."""
+        temp_id = f"{uuid.uuid4()}{extension}"
+        path = self.path(temp_id)
+        now = time.time()
+        self._write_meta(path, {"created_at": now, "expires_at": now + self.ttl, "size": len(data), "claimed": False})
+        with open(f"{path}.part", "wb") as f:
+            f.write(data)
+        os.replace(f"{path}.part", path)
+
+        with self._lock:
+            self._stats["saved_total"] += 1
+            self._stats["files"] += 1
+            self._stats["bytes_held"] += len(data)
+            over_cap = self._stats["bytes_held"] > self.max_bytes
+        if over_cap:
+            self.sweep()
+        return temp_id
+
+    def claim(self, temp_id: str) -> bool:
+        """Marks a file as owned by a pending upload. Returns False if it no longer exists."""
+        path = self.path(temp_id)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return False
+        meta = self._read_meta(path) or {"created_at": time.time(), "size": size}
+        meta.update(claimed=True, expires_at=time.time() + self.claimed_ttl)
+        self._write_meta(path, meta)
+        return True
+
+    def remove(self, temp_id: str):
+        path = self.path(temp_id)
+        size = self._delete(path)
+        if size is not None:
+            with self._lock:
+                self._stats["files"] = max(0, self._stats["files"] - 1)
+                self._stats["bytes_held"] = max(0, self._stats["bytes_held"] - size)
+
+    def _delete(self, path: str):
+        """Removes a file and its sidecar; returns the freed size or None if the file was gone."""
+        size = None
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        try:
+            os.remove(f"{path}{META_SUFFIX}")
+        except FileNotFoundError:
+            pass
+        return size
+
+    def sweep(self) -> dict:
+        """Deletes expired and stray files, then evicts oldest-first down to max_bytes."""
+        if not self._sweep_lock.acquire(blocking=False):
+            return {} # Another sweep is already running
+        try:
+            started = time.perf_counter()
+            now = time.time()
+            live = []
+            expired = 0
+            with os.scandir(self.directory) as it:
+                entries = [entry for entry in it if entry.is_file()]
+            names = {entry.name for entry in entries}
+            for entry in entries:
+                name = entry.name
+                stat = entry.stat()
+                if name.endswith((".tmp", ".part")) or (name.endswith(META_SUFFIX) and name[:-len(META_SUFFIX)] not in names):
+                    # Leftovers of an interrupted write, or the sidecar of a file that is gone
+                    if now - stat.st_mtime > self.ttl:
+                        try:
+                            os.remove(entry.path)
+                        except FileNotFoundError:
+                            pass
+                    continue
+                if name.endswith(META_SUFFIX):
+                    continue
+                meta = self._read_meta(entry.path) if f"{name}{META_SUFFIX}" in names else None
+                if meta is None:
+                    # Stray file (no sidecar): age it by mtime
+                    meta = {"created_at": stat.st_mtime, "expires_at": stat.st_mtime + self.ttl, "claimed": False}
+                if meta["expires_at"] <= now:
+                    self._delete(entry.path)
+                    expired += 1
+                    continue
+                live.append((meta["created_at"], stat.st_size, bool(meta.get("claimed")), entry.path))
+
+            bytes_held = sum(size for _, size, _, _ in live)
+            evicted = 0
+            if bytes_held > self.max_bytes:
+                for created_at, size, claimed, path in sorted(live):
+                    if bytes_held <= self.max_bytes:
+                        break
+                    if claimed:
+                        continue # Still needed by the upload worker
+                    self._delete(path)
+                    bytes_held -= size
+                    evicted += 1
+                if bytes_held > self.max_bytes:
+                    logger.warning(f"temp uploads hold {bytes_held} bytes of claimed files, above the {self.max_bytes} byte cap")
+
+            with self._lock:
+                self._stats.update(
+                    files=len(live) - evicted,
+                    bytes_held=bytes_held,
+                    last_sweep_at=now,
+                    last_sweep_ms=round((time.perf_counter() - started) * 1000, 1)
+                )
+                self._stats["expired_total"] += expired
+                self._stats["evicted_total"] += evicted
+            if expired or evicted:
+                logger.info(f"Temp upload sweep removed {expired} expired and {evicted} evicted files ({bytes_held} bytes held)")
+            return {"expired": expired, "evicted": evicted, "bytes_held": bytes_held}
+        finally:
+            self._sweep_lock.release()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {"max_bytes": self.max_bytes, "ttl_seconds": self.ttl, **self._stats}
@@ -0,0 +1,265 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import cloudinary.uploader
+from bson import ObjectId
+
+from app.db import products_collection
+from app.temp_files import TempFileStore
+
+logger = logging.getLogger("uvicorn.error")
+
+# Job states stored in product["upload_job"]["state"]
+PENDING = "pending"
+UPLOADING = "uploading"
+RETRYING = "retrying"
+DONE = "done"
+FAILED = "failed"
+# An "uploading" job not touched for this long belongs to a process that died mid-upload
+UPLOAD_LEASE_SECONDS = 600
+
+
+def _claimable_filter() -> dict:
+    stale = datetime.utcnow() - timedelta(seconds=UPLOAD_LEASE_SECONDS)
+    return {"$or": [
+        {"upload_job.state": {"$in": [PENDING, RETRYING]}},
+        {"upload_job.state": UPLOADING, "upload_job.updated_at": {"$lt": stale}}
+    ]}
+
+
+class ImageUploadWorker:
+    """
+    Uploads product images parked in the TempFileStore to Cloudinary.
+
+    Jobs are persisted on the product document as upload_job before they are
+    queued, so a restart re-queues anything still pending. A fixed number of
+    worker tasks drain a bounded queue and run the blocking Cloudinary SDK call
+    on their own thread pool, keeping the event loop free. Failed uploads are
+    retried with exponential backoff and jitter up to max_attempts.
+    """
+
+    def __init__(self, temp_files: TempFileStore, concurrency: int = 4, max_queue_size: int = 256,
+                 max_attempts: int = 5, retry_base_seconds: float = 2, retry_max_seconds: float = 120):
+        self.temp_files = temp_files
+        self.concurrency = max(1, concurrency)
+        self.max_queue_size = max_queue_size
+        self.max_attempts = max(1, max_attempts)
+        self.retry_base = retry_base_seconds
+        self.retry_max = retry_max_seconds
+        self._queue = None
+        self._workers = []
+        self._executor = None
+        self._tracked = set() # Product ids queued, uploading or waiting for a retry
+        self._retry_handles = {}
+        self._stats = {
+            "enqueued_total": 0,
+            "uploaded_total": 0,
+            "failed_total": 0,
+            "retries_total": 0,
+            "in_flight": 0,
+        }
+
+    async def start(self):
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="image-upload")
+        self._workers = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+        resumed = await self.resume_pending()
+        logger.info(f"Image upload worker started (concurrency={self.concurrency}, resumed {resumed} pending uploads)")
+
+    async def stop(self):
+        for handle in self._retry_handles.values():
+            handle.cancel()
+        self._retry_handles.clear()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        # Anything left stays persisted as pending and is resumed on the next start
+
+    async def enqueue(self, product_id: ObjectId, temp_image_id: str):
+        """Persists an upload job on the product and queues it."""
+        now = datetime.utcnow()
+        await products_collection.update_one(
+            {"_id": product_id},
+            {"$set": {"upload_job": {
+                "state": PENDING,
+                "temp_image_id": temp_image_id,
+                "attempts": 0,
+                "next_attempt_at": now,
+                "last_error": None,
+                "created_at": now,
+                "updated_at": now
+            }}}
+        )
+        self._stats["enqueued_total"] += 1
+        self._offer(product_id)
+
+    def _offer(self, product_id: ObjectId):
+        key = str(product_id)
+        if key in self._tracked or self._queue is None:
+            return
+        try:
+            self._queue.put_nowait(product_id)
+            self._tracked.add(key)
+        except asyncio.QueueFull:
+            # The job is persisted; resume_pending() picks it up once the queue drains
+            logger.warning(f"Upload queue full; product {product_id} will be retried from the database")
+
+    async def resume_pending(self) -> int:
+        """Re-queues persisted jobs that are not already queued here. Also run periodically."""
+        if self._queue is None:
+            return 0
+        now = datetime.utcnow()
+        resumed = 0
+        jobs = products_collection.find(
+            _claimable_filter(),
+            {"upload_job.next_attempt_at": 1}
+        ).limit(self.max_queue_size)
+        async for product in jobs:
+            if str(product["_id"]) in self._tracked:
+                continue
+            next_attempt_at = product["upload_job"].get("next_attempt_at") or now
+            delay = (next_attempt_at - now).total_seconds()
+            if delay > 0:
+                self._schedule_retry(product["_id"], delay)
+            else:
+                self._offer(product["_id"])
+            resumed += 1
+        return resumed
+
+    def _schedule_retry(self, product_id: ObjectId, delay: float):
+        key = str(product_id)
+        self._tracked.add(key)
+
+        def _requeue():
+            self._retry_handles.pop(key, None)
+            self._tracked.discard(key)
+            self._offer(product_id)
+
+        self._retry_handles[key] = asyncio.get_running_loop().call_later(delay, _requeue)
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.retry_max, self.retry_base * (2 ** (attempts - 1)))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def _run(self):
+        while True:
+            product_id = await self._queue.get()
+            try:
+                await self._process(product_id)
+            except Exception:
+                logger.error(f"Upload worker error for product {product_id}", exc_info=True)
+            finally:
+                if str(product_id) not in self._retry_handles:
+                    self._tracked.discard(str(product_id))
+
+    def _upload(self, path: str) -> dict:
+        # format="png" keeps transparency; quality "auto" trims size without changing the format
+        return cloudinary.uploader.upload(
+            path,
+            folder="project_av_products",
+            format="png",
+            transformation=[
+                {'quality': "auto"}
+            ]
+        )
+
+    async def _process(self, product_id: ObjectId):
+        product = await products_collection.find_one_and_update(
+            {"_id": product_id, **_claimable_filter()},
+            {"$set": {"upload_job.state": UPLOADING, "upload_job.updated_at": datetime.utcnow()},
+             "$inc": {"upload_job.attempts": 1}},
+            projection={"upload_job": 1}
+        )
+        if not product:
+            return # Finished, claimed by another process, or the product was deleted
+        job = product["upload_job"]
+        attempts = job["attempts"] + 1
+        temp_image_id = job["temp_image_id"]
+        temp_file_path = self.temp_files.path(temp_image_id)
+
+        if not os.path.exists(temp_file_path):
+            logger.error(f"BG Upload Failed: Temp file {temp_file_path} not found for product {product_id}.")
+            await self._fail(product_id, "temp file not found")
+            return
+
+        self._stats["in_flight"] += 1
+        started = time.perf_counter()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._executor, self._upload, temp_file_path)
+            image_url = result.get("secure_url")
+            if not image_url:
+                raise RuntimeError("secure_url not found in upload response")
+        except Exception as e:
+            if attempts >= self.max_attempts:
+                logger.error(f"BG Upload Failed: product {product_id} after {attempts} attempts: {e}")
+                await self._fail(product_id, str(e))
+                self._remove_temp_file(temp_image_id)
+                return
+            delay = self._backoff(attempts)
+            await products_collection.update_one(
+                {"_id": product_id},
+                {"$set": {
+                    "upload_job.state": RETRYING,
+                    "upload_job.last_error": str(e),
+                    "upload_job.next_attempt_at": datetime.utcnow() + timedelta(seconds=delay),
+                    "upload_job.updated_at": datetime.utcnow()
+                }}
+            )
+            self._stats["retries_total"] += 1
+            logger.warning(f"BG Upload attempt {attempts} failed for product {product_id}, retrying in {delay:.1f}s: {e}")
+            self._schedule_retry(product_id, delay)
+            return
+        finally:
+            self._stats["in_flight"] -= 1
+
+        await products_collection.update_one(
+            {"_id": product_id},
+            {"$set": {
+                "imageUrl": image_url,
+                "status": "visible",
+                "upload_job.state": DONE,
+                "upload_job.last_error": None,
+                "upload_job.updated_at": datetime.utcnow()
+            }}
+        )
+        self._stats["uploaded_total"] += 1
+        logger.info(f"BG Upload Success: product {product_id} in {time.perf_counter() - started:.2f}s")
+        self._remove_temp_file(temp_image_id)
+
+    async def _fail(self, product_id: ObjectId, error: str):
+        await products_collection.update_one(
+            {"_id": product_id},
+            {"$set": {
+                "status": "upload_failed",
+                "upload_job.state": FAILED,
+                "upload_job.last_error": error,
+                "upload_job.updated_at": datetime.utcnow()
+            }}
+        )
+        self._stats["failed_total"] += 1
+
+    def _remove_temp_file(self, temp_image_id: str):
+        try:
+            self.temp_files.remove(temp_image_id)
+            logger.info(f"BG Cleanup: Removed temp file {temp_image_id}")
+        except Exception as e:
+            logger.error(f"BG Cleanup Failed: Could not remove {temp_image_id}: {e}")
+
+    def metrics(self) -> dict:
+        return {
+            "running": bool(self._workers),
+            "concurrency": self.concurrency,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "waiting_for_retry": len(self._retry_handles),
+            **self._stats,
+        }
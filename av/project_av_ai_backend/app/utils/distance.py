@@ -1,5 +1,7 @@
 from math import radians, sin, cos, sqrt, asin
 
+import numpy as np
+
 def haversine(lat1, lon1, lat2, lon2):
     """Calculate distance between two points using Haversine formula"""
     # Convert to radians
@@ -12,6 +14,29 @@ def haversine(lat1, lon1, lat2, lon2):
     c = 2 * asin(sqrt(a)) 
     return c * 6371  # Earth radius in km
 
+def haversine_matrix(lats1, lngs1, lats2, lngs2):
+    """Distances in km from every point of the first set to every point of the second, shape (len1, len2)"""
+    lat1 = np.radians(np.asarray(lats1, dtype=float))[:, None]
+    lng1 = np.radians(np.asarray(lngs1, dtype=float))[:, None]
+    lat2 = np.radians(np.asarray(lats2, dtype=float))[None, :]
+    lng2 = np.radians(np.asarray(lngs2, dtype=float))[None, :]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * np.arcsin(np.sqrt(np.clip(a, 0, 1))) * 6371
+
+def extract_shop_coordinates(shop):
+    """(lat, lng) of a shop document, preferring the latitude/longitude fields over GeoJSON location"""
+    # Priority 1: Direct fields
+    if 'latitude' in shop and 'longitude' in shop:
+        return float(shop['latitude']), float(shop['longitude'])
+    
+    # Priority 2: GeoJSON format (corrected order)
+    if 'location' in shop and 'coordinates' in shop['location']:
+        coords = shop['location']['coordinates']
+        if len(coords) >= 2:
+            return float(coords[1]), float(coords[0])
+    
+    return None, None
+
 def isValidIndianCoordinate(lat, lng):
     """Validate if coordinates are within India"""
     return (
@@ -0,0 +1,53 @@
+from math import cos, radians, sqrt
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_KM_PER_DEGREE = 111.32
+
+
+def _bounds(lat: float, lng: float, precision: int):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits, bit_count, even = 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars), lat_range, lng_range
+
+
+def geohash(lat: float, lng: float, precision: int = 6):
+    """Returns (hash, centre_lat, centre_lng, half_diagonal_km) of the cell containing the point."""
+    cell, lat_range, lng_range = _bounds(lat, lng, precision)
+    centre_lat = (lat_range[0] + lat_range[1]) / 2
+    centre_lng = (lng_range[0] + lng_range[1]) / 2
+    height_km = (lat_range[1] - lat_range[0]) * _KM_PER_DEGREE
+    width_km = (lng_range[1] - lng_range[0]) * _KM_PER_DEGREE * cos(radians(centre_lat))
+    return cell, centre_lat, centre_lng, sqrt(height_km ** 2 + width_km ** 2) / 2
+
+
+def cells_covering(lat: float, lng: float, radius_km: float, precision: int) -> list:
+    """Geohash cells of the given precision that together cover every point within radius_km."""
+    _, lat_range, lng_range = _bounds(lat, lng, precision)
+    cell_height = lat_range[1] - lat_range[0]
+    cell_width = lng_range[1] - lng_range[0]
+    lat_span = radius_km / _KM_PER_DEGREE
+    lng_span = radius_km / (_KM_PER_DEGREE * max(cos(radians(min(abs(lat) + lat_span, 89.9))), 1e-6))
+
+    cells = set()
+    # Sample one point per cell row/column across the bounding box, plus its far edges
+    lats = [lat - lat_span + i * cell_height for i in range(int(2 * lat_span / cell_height) + 1)] + [lat + lat_span]
+    lngs = [lng - lng_span + j * cell_width for j in range(int(2 * lng_span / cell_width) + 1)] + [lng + lng_span]
+    for point_lat in lats:
+        for point_lng in lngs:
+            cells.add(_bounds(max(-90.0, min(90.0, point_lat)), ((point_lng + 180) % 360) - 180, precision)[0])
+    return sorted(cells)
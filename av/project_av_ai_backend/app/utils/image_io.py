@@ -0,0 +1,51 @@
+# project_av_ai_backend/app/utils/image_io.py
+
+from io import BytesIO
+
+from fastapi import HTTPException, UploadFile
+from PIL import Image
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+async def read_upload_limited(file: UploadFile, max_bytes: int) -> bytes:
+    """
+    Reads an upload in chunks and raises 413 as soon as it grows past max_bytes,
+    instead of buffering the whole body before checking its size.
+    """
+    chunks = []
+    size = 0
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(status_code=413, detail=f"File too large (limit {max_bytes // (1024 * 1024)}MB)")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def decode_for_inference(data: bytes, min_side: int = 256) -> Image.Image:
+    """
+    Decodes an upload straight to a small RGB image whose shortest side is about
+    min_side (never less). JPEGs are decoded at 1/2, 1/4 or 1/8 scale via
+    Image.draft(), so a 12MP photo never exists at full resolution in memory;
+    other formats are decoded fully and then downscaled.
+
+    CLIP resizes the shortest side to 224px before cropping, so predictions are
+    unchanged as long as min_side stays at or above that.
+    """
+    try:
+        image = Image.open(BytesIO(data))
+        # Picks the largest DCT scale that keeps both sides >= min_side; a no-op for non-JPEGs
+        image.draft("RGB", (min_side, min_side))
+        image = image.convert("RGB")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not decode image: {e}")
+
+    scale = min_side / min(image.size)
+    if scale < 1:
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.BICUBIC, reducing_gap=3.0)
+    return image
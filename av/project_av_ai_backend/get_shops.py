@@ -1,15 +1,9 @@
 from fastapi import APIRouter, Query
-from pymongo import MongoClient
 from math import radians, cos, sin, asin, sqrt
-import os
+from app.db import shops_collection
 
 router = APIRouter()
 
-# MongoDB setup
-client = MongoClient(os.getenv("MONGO_URL"))
-db = client["project_av"]
-shops_collection = db["shops"]
-
 # Haversine function
 def haversine(lat1, lon1, lat2, lon2):
     lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
@@ -22,7 +16,7 @@ def haversine(lat1, lon1, lat2, lon2):
 
 @router.get("/get-shops")
 async def get_shops(product: str = Query(""), latitude: float = Query(...), longitude: float = Query(...)):
-    shops = list(shops_collection.find({}))
+    shops = await shops_collection.find({}).to_list(None)
     nearby_shops = []
 
     for shop in shops:
@@ -0,0 +1,104 @@
+"""
+Parity check and benchmark for the CLIP image backends.
+
+    python scripts/backend_benchmark.py --images scripts/sample_images
+
+Each backend runs in its own process so peak RSS is measured in isolation.
+Top-1 predictions of every backend are compared with the fp32 "torch" backend;
+the script exits non-zero if any image disagrees.
+"""
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+BACKEND_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def run_worker(backend, image_paths, batch_size, rounds):
+    os.environ["CLIP_BACKEND"] = backend
+    sys.path.insert(0, BACKEND_ROOT)
+    from PIL import Image
+    from app import clip_model
+
+    started = time.perf_counter()
+    clip_model.load_model()
+    load_seconds = time.perf_counter() - started
+
+    images = [Image.open(path).convert("RGB") for path in image_paths]
+    top1 = [clip_model.predict_candidate_batch([image], 1)[0][0]["label"] for image in images]
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for start in range(0, len(images), batch_size):
+            batch_started = time.perf_counter()
+            clip_model.predict_candidate_batch(images[start:start + batch_size], 1)
+            latencies.append(time.perf_counter() - batch_started)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(json.dumps({
+        "backend": backend,
+        "load_seconds": round(load_seconds, 2),
+        "top1": top1,
+        "p50_batch_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p95_batch_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+        "images_per_second": round(len(images) * rounds / elapsed, 2),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default=os.path.join(BACKEND_ROOT, "scripts", "sample_images"))
+    parser.add_argument("--backends", nargs="+", default=["torch", "torch-int8", "onnx"])
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    image_paths = sorted(
+        path for pattern in ("*.jpg", "*.jpeg", "*.png")
+        for path in glob.glob(os.path.join(args.images, pattern))
+    )
+    if not image_paths:
+        sys.exit(f"No sample images found in {args.images}")
+
+    if args.worker:
+        run_worker(args.worker, image_paths, args.batch_size, args.rounds)
+        return
+
+    backends = ["torch"] + [b for b in args.backends if b != "torch"]
+    results = []
+    for backend in backends:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", backend, "--images", args.images,
+             "--batch-size", str(args.batch_size), "--rounds", str(args.rounds)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    reference = results[0]["top1"]
+    mismatches = 0
+    print(f"{len(image_paths)} images, batch size {args.batch_size}")
+    print(f"{'backend':>11} {'load s':>7} {'p50 ms':>8} {'p95 ms':>8} {'img/s':>7} {'RSS MB':>8} {'top-1 parity':>13}")
+    for result in results:
+        agree = sum(a == b for a, b in zip(reference, result["top1"]))
+        mismatches += len(reference) - agree
+        print(f"{result['backend']:>11} {result['load_seconds']:>7} {result['p50_batch_ms']:>8} {result['p95_batch_ms']:>8} "
+              f"{result['images_per_second']:>7} {result['peak_rss_mb']:>8} {agree:>6}/{len(reference)}")
+        for path, expected, got in zip(image_paths, reference, result["top1"]):
+            if expected != got:
+                print(f"    {os.path.basename(path)}: torch={expected!r} {result['backend']}={got!r}")
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Per-product vs price-index competitor prices for /products/best-price.
+
+    python scripts/best_price_benchmark.py --uri mongodb://localhost:27017 --shops 2000 --page-size 10
+
+Seeds a scratch database on a local mongod with shops around one point. Each
+shop stocks a random subset of a shared catalogue at slightly different
+prices, some on sale. Pages of products are then priced two ways:
+
+  per-product   the old compute_discount: find_one on the shop, then
+                $geoNear + $lookup for the nearest other shop with the name
+  price-index   app/pricing.py: the page's shops, one product_price_index
+                read, and the distances in memory
+
+For both paths the script reports ms per page and database round trips, and
+checks that both give the same discountPercentage for every product. The
+scratch index is built with app/price_index.summarise(), as the migration
+does.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+from bson import ObjectId
+from pymongo import GEOSPHERE, MongoClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import PRICE_INDEX_GEOHASH_PRECISION  # noqa: E402
+from app.db import shop_products_lookup  # noqa: E402
+from app.price_index import name_key, summarise  # noqa: E402
+from app.pricing import (  # noqa: E402
+    COMPETITOR_RADIUS_KM,
+    current_price,
+    discount_percentage,
+    nearest_competitor_prices
+)
+from app.utils.distance import extract_shop_coordinates  # noqa: E402
+from app.utils.geohash import geohash, cells_covering  # noqa: E402
+
+DB_NAME = "project_av_pricing_benchmark"
+CENTER = (77.5946, 12.9716) # Bengaluru
+CATALOGUE = [f"Product {i}" for i in range(300)]
+
+
+def seed(db, shops):
+    if db.shops.estimated_document_count() == shops:
+        return
+    db.shops.drop()
+    db.products.drop()
+    base_prices = {name: round(random.uniform(10, 500), 2) for name in CATALOGUE}
+    shop_docs = []
+    for i in range(shops):
+        lng = CENTER[0] + random.uniform(-0.15, 0.15)
+        lat = CENTER[1] + random.uniform(-0.15, 0.15)
+        shop_docs.append({"name": f"Shop {i}", "owner_id": f"owner-{i}", "latitude": lat, "longitude": lng,
+                          "location": {"type": "Point", "coordinates": [lng, lat]}})
+    shop_ids = db.shops.insert_many(shop_docs).inserted_ids
+    db.shops.create_index([("location", GEOSPHERE)])
+
+    products = []
+    for i, shop_id in enumerate(shop_ids):
+        for name in random.sample(CATALOGUE, 40):
+            price = round(base_prices[name] * random.uniform(0.85, 1.15), 2)
+            on_sale = random.random() < 0.2
+            products.append({"product_name": name, "shop_id": shop_id, "owner_id": f"owner-{i}", "price": price,
+                             "isOnSale": on_sale, "salePrice": round(price * 0.9, 2) if on_sale else None,
+                             "inStock": True, "count": random.randint(0, 20), "category": "Staples"})
+    db.products.insert_many(products)
+    db.products.create_index([("shop_id", 1), ("category", 1)])
+
+
+def build_index(db):
+    db.product_price_index.drop()
+    shops = {}
+    for shop in db.shops.find({}, {"owner_id": 1, "latitude": 1, "longitude": 1}):
+        lat, lng = extract_shop_coordinates(shop)
+        shops[shop["owner_id"]] = (str(shop["_id"]), lat, lng)
+    groups = {}
+    for product in db.products.find():
+        shop = shops[product["owner_id"]]
+        cell = geohash(shop[1], shop[2], PRICE_INDEX_GEOHASH_PRECISION)[0]
+        groups.setdefault((name_key(product["product_name"]), cell), []).append(product)
+    db.product_price_index.insert_many([summarise(key, cell, products, shops) for (key, cell), products in groups.items()])
+    db.product_price_index.create_index([("name_key", 1), ("cell", 1)])
+
+
+def page(db, size):
+    sample = list(db.products.aggregate([{"$sample": {"size": size}}]))
+    return [{**product, "shop_id": str(product["shop_id"])} for product in sample]
+
+
+def per_product(db, products, counter):
+    """The old compute_discount, one product at a time."""
+    discounts = []
+    for product in products:
+        counter["round_trips"] += 2
+        shop = db.shops.find_one({"_id": ObjectId(product["shop_id"])})
+        lat, lng = extract_shop_coordinates(shop)
+        other = list(db.shops.aggregate([
+            {"$geoNear": {"near": {"type": "Point", "coordinates": [lng, lat]}, "distanceField": "distance",
+                          "maxDistance": COMPETITOR_RADIUS_KM * 1000, "spherical": True,
+                          "query": {"_id": {"$ne": ObjectId(product["shop_id"])}}}},
+            *shop_products_lookup("product_match", [{"$match": {"product_name": product["product_name"]}}]),
+            {"$unwind": "$product_match"},
+            {"$limit": 1},
+            {"$project": {"price": "$product_match.price"}}
+        ]))
+        discounts.append(discount_percentage(current_price(product), other[0]["price"] if other else None))
+    return discounts
+
+
+def from_index(db, products, counter):
+    counter["round_trips"] += 2
+    shop_ids = list({ObjectId(product["shop_id"]) for product in products})
+    shop_coordinates = {str(shop["_id"]): extract_shop_coordinates(shop)
+                        for shop in db.shops.find({"_id": {"$in": shop_ids}})}
+    cells = set()
+    for lat, lng in shop_coordinates.values():
+        cells.update(cells_covering(lat, lng, COMPETITOR_RADIUS_KM, PRICE_INDEX_GEOHASH_PRECISION))
+    names = list({name_key(product["product_name"]) for product in products})
+    groups = db.product_price_index.find({"name_key": {"$in": names}, "cell": {"$in": list(cells)}},
+                                         {"name_key": 1, "offers": 1})
+    offers = [{**offer, "name_key": group["name_key"]} for group in groups for offer in group["offers"]]
+    prices = nearest_competitor_prices(products, shop_coordinates, offers)
+    return [discount_percentage(current_price(product), price) for product, price in zip(products, prices)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--shops", type=int, default=2000)
+    parser.add_argument("--page-size", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--drop", action="store_true", help="Drop the scratch database afterwards")
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri)
+    db = client[DB_NAME]
+    seed(db, args.shops)
+    build_index(db)
+
+    pages = [page(db, args.page_size) for _ in range(args.pages)]
+    results = {}
+    print(f"{args.shops} shops, {args.pages} pages of {args.page_size} products")
+    print(f"{'path':>12} {'ms/page':>9} {'round trips/page':>17}")
+    for name, price_page in (("per-product", per_product), ("price-index", from_index)):
+        counter = {"round_trips": 0}
+        started = time.perf_counter()
+        results[name] = [price_page(db, products, counter) for products in pages]
+        elapsed = (time.perf_counter() - started) / args.pages * 1000
+        print(f"{name:>12} {elapsed:>9.1f} {counter['round_trips'] / args.pages:>17.1f}")
+
+    mismatches = sum(a != b for old, new in zip(results["per-product"], results["price-index"]) for a, b in zip(old, new))
+    print(f"{mismatches} of {args.pages * args.page_size} discounts differ between the two paths")
+
+    if args.drop:
+        client.drop_database(DB_NAME)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Concurrent checkouts against one hot product: blind $inc vs app/inventory.py.
+
+    python scripts/checkout_stress.py --uri mongodb://localhost:27017 --checkouts 500 --stock 100
+
+Seeds a scratch database on a local mongod with a hot product (--stock units)
+and a scarce side product, then fires --checkouts carts at once. Every cart
+asks for 1-3 of the hot product; every fifth also asks for one of the side
+product, so late carts fail on it after their hot line succeeded and must be
+rolled back. Two paths run over the same carts:
+
+  blind       what /checkout-cart/ used to do: $inc count by -quantity
+  inventory   Inventory.reserve(): one ordered bulk write of conditional
+              decrements, rollback of the lines taken before a short one
+
+For each path the script reports the final counts, units sold, carts
+accepted and wall time, and checks that no count went negative and that
+stock left + units sold == stock seeded. A final pass creates holds with a
+one-second TTL, lets them expire alongside concurrent checkouts and checks
+the sweep returns every unit exactly once.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.inventory import Inventory, RESERVED  # noqa: E402
+
+DB_NAME = "project_av_checkout_stress"
+
+
+async def seed(db, stock, side_stock):
+    await db.products.drop()
+    await db.stock_holds.drop()
+    hot, side = (await db.products.insert_many([
+        {"product_name": "Hot product", "count": stock},
+        {"product_name": "Side product", "count": side_stock}
+    ])).inserted_ids
+    return hot, side
+
+
+def carts(hot, side, checkouts):
+    return [{hot: random.randint(1, 3), **({side: 1} if i % 5 == 0 else {})} for i in range(checkouts)]
+
+
+async def counts(db, hot, side):
+    products = {product["_id"]: product["count"] async for product in db.products.find({})}
+    return products[hot], products[side]
+
+
+async def blind(db, inventory, lines):
+    await asyncio.gather(*(db.products.update_one({"_id": product_id}, {"$inc": {"count": -quantity}})
+                           for product_id, quantity in lines.items()))
+    return True, lines
+
+
+async def reserve(db, inventory, lines):
+    ok, results = await inventory.reserve(lines)
+    return ok, {product_id: quantity for (product_id, quantity), result in zip(lines.items(), results)
+                if result["status"] == RESERVED}
+
+
+async def run(db, name, checkout, args):
+    hot, side = await seed(db, args.stock, args.side_stock)
+    inventory = Inventory(db.products, db.stock_holds)
+    orders = carts(hot, side, args.checkouts)
+    started = time.perf_counter()
+    outcomes = await asyncio.gather(*(checkout(db, inventory, lines) for lines in orders))
+    elapsed = (time.perf_counter() - started) * 1000
+
+    sold = {hot: 0, side: 0}
+    for ok, taken in outcomes:
+        if ok:
+            for product_id, quantity in taken.items():
+                sold[product_id] += quantity
+    left = await counts(db, hot, side)
+    conserved = left[0] + sold[hot] == args.stock and left[1] + sold[side] == args.side_stock
+    accepted = sum(ok for ok, _ in outcomes)
+    print(f"{name:>10} {elapsed:>8.0f} {accepted:>9} {sold[hot]:>9} {left[0]:>9} {left[1]:>9} "
+          f"{'yes' if min(left) >= 0 else 'NO':>9} {'yes' if conserved else 'NO':>10}")
+    return min(left) >= 0 and conserved
+
+
+async def holds(db, args):
+    """Holds expire while carts keep checking out; the sweep must return each held unit once."""
+    hot, side = await seed(db, args.stock, args.side_stock)
+    inventory = Inventory(db.products, db.stock_holds, hold_ttl_seconds=1)
+    created = await asyncio.gather(*(inventory.create_hold(f"user-{i}", {hot: 1}) for i in range(args.stock // 2)))
+    held = sum(hold is not None for hold, _ in created)
+
+    await asyncio.sleep(1.5)
+    outcomes = await asyncio.gather(
+        *(inventory.reserve({hot: 1}) for _ in range(args.checkouts)),
+        *(inventory.expire_holds() for _ in range(4))
+    )
+    bought = sum(ok for ok, _ in outcomes[:args.checkouts])
+    returned = sum(sum(units.values()) for units in outcomes[args.checkouts:])
+    left = (await counts(db, hot, side))[0]
+    ok = returned == held and left + bought == args.stock and left >= 0
+    print(f"holds: {held} created, {returned} returned by 4 racing sweeps, {bought} bought, {left} left "
+          f"-> {'ok' if ok else 'FAILED'}")
+    return ok
+
+
+async def main(args):
+    client = AsyncIOMotorClient(args.uri, maxPoolSize=args.pool_size)
+    db = client[DB_NAME]
+    print(f"{args.checkouts} concurrent checkouts, {args.stock} hot units, {args.side_stock} side units")
+    print(f"{'path':>10} {'ms':>8} {'accepted':>9} {'hot sold':>9} {'hot left':>9} {'side left':>9} "
+          f"{'>= 0':>9} {'conserved':>10}")
+    await run(db, "blind", blind, args) # Expected to oversell: shown for comparison only
+    ok = await run(db, "inventory", reserve, args)
+    ok = await holds(db, args) and ok
+    if args.drop:
+        await client.drop_database(DB_NAME)
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--checkouts", type=int, default=500)
+    parser.add_argument("--stock", type=int, default=100)
+    parser.add_argument("--side-stock", type=int, default=10)
+    parser.add_argument("--pool-size", type=int, default=100)
+    parser.add_argument("--drop", action="store_true", help="Drop the scratch database afterwards")
+    sys.exit(0 if asyncio.run(main(parser.parse_args())) else 1)
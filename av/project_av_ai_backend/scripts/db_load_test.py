@@ -0,0 +1,117 @@
+"""
+Shows what a blocking driver call does to an asyncio server under concurrent load.
+
+    python scripts/db_load_test.py --uri mongodb://localhost:27017 --concurrency 64 --requests 2000
+
+Seeds a scratch database on a local mongod. It then simulates the API's
+traffic inside one event loop: many cheap lookups (find_one by _id) run
+concurrently with a stream of slow queries (an unindexed regex count). The same
+workload runs twice, once with synchronous PyMongo called from async handlers
+(the old data layer) and once with Motor. Reported latencies are for the cheap
+lookups only: with PyMongo they queue behind every slow query that blocks the
+loop, while with Motor they don't.
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient
+
+DB_NAME = "project_av_load_test"
+
+
+def seed(uri, documents):
+    collection = MongoClient(uri)[DB_NAME]["products"]
+    if collection.estimated_document_count() == documents:
+        return [doc["_id"] for doc in collection.find({}, {"_id": 1}).limit(1000)]
+    collection.drop()
+    words = ["tata", "salt", "amul", "butter", "parle", "maggi", "coca", "cola", "dal", "atta", "rice", "sugar"]
+    batch = []
+    for i in range(documents):
+        batch.append({
+            "product_name": " ".join(random.choices(words, k=3)) + f" {i}",
+            "price": round(random.uniform(5, 500), 2),
+            "count": random.randint(0, 50),
+            "owner_id": f"owner-{i % 500}"
+        })
+        if len(batch) == 5000:
+            collection.insert_many(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch)
+    return [doc["_id"] for doc in collection.find({}, {"_id": 1}).limit(1000)]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))] * 1000
+
+
+async def run(mode, uri, ids, concurrency, requests, slow_every):
+    if mode == "pymongo":
+        collection = MongoClient(uri)[DB_NAME]["products"]
+
+        async def fast(_id):
+            return collection.find_one({"_id": _id})
+
+        async def slow():
+            return collection.count_documents({"product_name": {"$regex": "^(?:x|y)*salt.*9$"}})
+    else:
+        collection = AsyncIOMotorClient(uri)[DB_NAME]["products"]
+
+        async def fast(_id):
+            return await collection.find_one({"_id": _id})
+
+        async def slow():
+            return await collection.count_documents({"product_name": {"$regex": "^(?:x|y)*salt.*9$"}})
+
+    await fast(ids[0]) # Open a connection before timing
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def request(i):
+        async with semaphore:
+            if i % slow_every == 0:
+                await slow()
+                return
+            started = time.perf_counter()
+            await fast(random.choice(ids))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(request(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    return {
+        "mode": mode,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "throughput": requests / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--documents", type=int, default=200000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--slow-every", type=int, default=50, help="Every Nth request is a slow query")
+    parser.add_argument("--drop", action="store_true", help="Drop the scratch database afterwards")
+    args = parser.parse_args()
+
+    ids = seed(args.uri, args.documents)
+    print(f"{args.requests} requests, concurrency {args.concurrency}, 1 in {args.slow_every} slow")
+    print(f"{'driver':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8}")
+    for mode in ("pymongo", "motor"):
+        result = asyncio.run(run(mode, args.uri, ids, args.concurrency, args.requests, args.slow_every))
+        print(f"{result['mode']:>8} {result['p50']:>8.1f} {result['p95']:>8.1f} {result['p99']:>8.1f} {result['throughput']:>8.0f}")
+
+    if args.drop:
+        MongoClient(args.uri).drop_database(DB_NAME)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Local stand-in for the Cloudinary upload API, for exercising the image upload
+worker without network access or credentials.
+
+    python scripts/fake_cloudinary.py --port 8765 --fail-rate 0.3 --delay 0.5
+    CLOUDINARY_UPLOAD_PREFIX=http://127.0.0.1:8765 CLOUDINARY_CLOUD_NAME=demo uvicorn app.main:app
+
+Every POST to /v1_1/<cloud>/image/upload is answered with a secure_url, or
+with a 500 error for a --fail-rate fraction of requests. Counts are printed
+on every request.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+counts = {"requests": 0, "succeeded": 0, "failed": 0}
+counts_lock = threading.Lock()
+
+
+def make_handler(fail_rate, delay):
+    class FakeUploadHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            # Consume the multipart body so the client sees a clean response
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(delay)
+
+            if not self.path.endswith("/image/upload"):
+                self._reply(404, {"error": {"message": f"Unknown path {self.path}"}})
+                return
+            failed = random.random() < fail_rate
+            with counts_lock:
+                counts["requests"] += 1
+                counts["failed" if failed else "succeeded"] += 1
+                print(f"{self.path} -> {'500' if failed else '200'}  {counts}", flush=True)
+            if failed:
+                self._reply(500, {"error": {"message": "Simulated upstream failure"}})
+                return
+            public_id = f"project_av_products/{uuid.uuid4().hex}"
+            host = self.headers.get("Host", "127.0.0.1")
+            self._reply(200, {
+                "public_id": public_id,
+                "format": "png",
+                "secure_url": f"http://{host}/fake/{public_id}.png"
+            })
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeUploadHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of uploads answered with a 500")
+    parser.add_argument("--delay", type=float, default=0.2, help="Seconds to sleep per upload, like a slow uplink")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args.fail_rate, args.delay))
+    print(f"Fake Cloudinary listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
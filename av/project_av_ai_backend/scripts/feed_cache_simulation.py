@@ -0,0 +1,214 @@
+"""
+City-wide load simulation for the home feed cache (app/feed_cache.py).
+
+    python scripts/feed_cache_simulation.py --shops 2000 --rps 500 --seconds 60 --writes-per-second 5
+
+No database is needed. A synthetic city (shops with products spread over a
+Bengaluru-sized area) stands in for MongoDB. Each feed computation costs a
+simulated query time proportional to the shops in its radius, and the result
+is ranked the way the real pipelines rank it. Users arrive as a Poisson stream
+from a few dozen neighbourhood hotspots. They ask for the four feeds,
+categories and pages with a realistic skew, while owners update products at
+--writes-per-second (each write invalidates the entries it could change).
+
+The same request stream is replayed with the cache disabled and enabled. The
+script reports latency percentiles, database computations, the hit rate and
+invalidations. It also checks how closely cached pages match pages computed
+from the user's exact location.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.feed_cache import FeedCache, SHOP_LAT_FIELD, SHOP_LNG_FIELD  # noqa: E402
+from app.utils.distance import haversine_matrix  # noqa: E402
+
+CENTRE = (12.9716, 77.5946)
+CATEGORIES = ["Dairy & Beverages", "Fruits & Vegetables", "Snacks", "Staples", "Personal Care"]
+# feed -> (min_km, max_km, order_by_distance, ranking)
+FEEDS = {
+    "deals": (0, 5, True, "distance"),
+    "deals-extended": (5, 50, False, "sales"),
+    "trending": (0, 5, False, "sales"),
+    "best-price": (0, 5, True, "distance"),
+}
+
+
+def build_city(shops, products_per_shop, seed):
+    """
+    Shops plus their products pre-bucketed by (on sale, category), as the
+    indexes would serve them. Each bucket holds parallel arrays of shop index,
+    sold count and product id.
+    """
+    rng = np.random.default_rng(seed)
+    lats = CENTRE[0] + rng.uniform(-0.15, 0.15, shops)
+    lngs = CENTRE[1] + rng.uniform(-0.15, 0.15, shops)
+    total = shops * products_per_shop
+    shop_index = np.repeat(np.arange(shops), products_per_shop)
+    on_sale = rng.random(total) < 0.15
+    category = rng.integers(0, len(CATEGORIES), total)
+    sold = (rng.pareto(1.5, total) + 1).astype(int)
+    product_ids = np.array([f"{i}-{j}" for i in range(shops) for j in range(products_per_shop)])
+    buckets = {}
+    for sale in (True, False):
+        for c, name in [(None, "All")] + list(enumerate(CATEGORIES)):
+            mask = (on_sale == sale) & ((category == c) if c is not None else True)
+            buckets[(sale, name)] = (shop_index[mask], sold[mask], product_ids[mask])
+    return {"lat": lats, "lng": lngs, "shop_ids": [str(i) for i in range(shops)], "buckets": buckets,
+            "product_shop": shop_index, "product_ids": product_ids, "product_category": category}
+
+
+def make_compute(city, query_ms, per_shop_us, counter):
+    def compute_for(feed, category):
+        _, _, _, ranking = FEEDS[feed]
+        shop_index, sold, product_ids = city["buckets"][(feed.startswith("deals"), category or "All")]
+
+        async def compute(lat, lng, lo_km, hi_km, count):
+            counter["computations"] += 1
+            shop_distance = haversine_matrix([lat], [lng], city["lat"], city["lng"])[0]
+            shops_in_radius = int(((shop_distance >= lo_km) & (shop_distance <= hi_km)).sum())
+            distance = shop_distance[shop_index]
+            candidates = np.flatnonzero((distance >= lo_km) & (distance <= hi_km))
+            # lexsort sorts by the last key first
+            keys = (distance[candidates], -sold[candidates]) if ranking == "sales" \
+                else (-sold[candidates], distance[candidates])
+            top = candidates[np.lexsort(keys)[:count]]
+            rows = [{"_id": product_ids[i], "shop_id": city["shop_ids"][shop_index[i]], "sold_count": int(sold[i]),
+                     "distance": float(distance[i]), SHOP_LAT_FIELD: float(city["lat"][shop_index[i]]),
+                     SHOP_LNG_FIELD: float(city["lng"][shop_index[i]])}
+                    for i in top]
+            # Simulated database time: a fixed round trip plus the per-shop $lookup work
+            await asyncio.sleep((query_ms + shops_in_radius * per_shop_us / 1000) / 1000)
+            return rows
+        return compute
+    return compute_for
+
+
+def hotspots(count, seed):
+    rng = random.Random(seed)
+    spots = [(CENTRE[0] + rng.uniform(-0.12, 0.12), CENTRE[1] + rng.uniform(-0.12, 0.12)) for _ in range(count)]
+    weights = [1 / (rank + 1) for rank in range(count)] # Zipf: a few busy neighbourhoods
+    return spots, weights
+
+
+def request_stream(args):
+    rng = random.Random(args.seed + 1)
+    spots, weights = hotspots(args.hotspots, args.seed)
+    now = 0.0
+    stream = []
+    while now < args.seconds:
+        now += rng.expovariate(args.rps)
+        spot = rng.choices(spots, weights)[0]
+        lat = spot[0] + rng.gauss(0, 0.01) # Neighbourhoods are a couple of km across
+        lng = spot[1] + rng.gauss(0, 0.01)
+        feed = rng.choices(list(FEEDS), [3, 1, 3, 2])[0]
+        category = "All" if rng.random() < 0.6 else rng.choice(CATEGORIES)
+        page = rng.choices([0, 1, 2], [70, 20, 10])[0]
+        stream.append(("read", now, lat, lng, feed, category, page * 10, 10))
+    now = 0.0
+    while args.writes_per_second > 0 and now < args.seconds:
+        now += rng.expovariate(args.writes_per_second)
+        stream.append(("write", now, rng.randrange(args.shops * args.products_per_shop)))
+    stream.sort(key=lambda event: event[1])
+    return stream
+
+
+async def replay(stream, city, cache, args):
+    counter = {"computations": 0}
+    compute_for = make_compute(city, args.query_ms, args.per_shop_us, counter)
+    latencies = []
+    started = time.perf_counter()
+
+    async def read(lat, lng, feed, category, skip, limit):
+        min_km, max_km, order_by_distance, _ = FEEDS[feed]
+        request_started = time.perf_counter()
+        await cache.get_page(feed, lat, lng, category, skip, limit, compute_for(feed, category),
+                             max_km=max_km, min_km=min_km, order_by_distance=order_by_distance)
+        latencies.append(time.perf_counter() - request_started)
+
+    tasks = []
+    for event in stream:
+        delay = event[1] - (time.perf_counter() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if event[0] == "write":
+            shop = city["product_shop"][event[2]]
+            cache.invalidate_near(float(city["lat"][shop]), float(city["lng"][shop]), city["shop_ids"][shop],
+                                  city["product_ids"][event[2]], None,
+                                  CATEGORIES[city["product_category"][event[2]]])
+        else:
+            tasks.append(asyncio.create_task(read(*event[2:])))
+    await asyncio.gather(*tasks)
+    return latencies, counter["computations"]
+
+
+async def accuracy(stream, city, args, samples=200):
+    """Overlap between cached pages and pages computed from the user's exact position."""
+    rng = random.Random(args.seed + 2)
+    reads = [event for event in stream if event[0] == "read"]
+    compute_for = make_compute(city, 0, 0, {"computations": 0})
+    cached = FeedCache(ttl_seconds=3600, max_entries=100000, max_items=args.max_items, precision=args.precision)
+    exact = FeedCache(max_entries=0)
+    overlaps = []
+    for _, _, lat, lng, feed, category, skip, limit in rng.sample(reads, min(samples, len(reads))):
+        min_km, max_km, order_by_distance, _ = FEEDS[feed]
+        pages = []
+        for cache in (cached, exact):
+            page = await cache.get_page(feed, lat, lng, category, skip, limit, compute_for(feed, category),
+                                        max_km=max_km, min_km=min_km, order_by_distance=order_by_distance)
+            pages.append({item["_id"] for item in page})
+        if pages[1]:
+            overlaps.append(len(pages[0] & pages[1]) / len(pages[1]))
+    return sum(overlaps) / len(overlaps) if overlaps else None
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shops", type=int, default=2000)
+    parser.add_argument("--products-per-shop", type=int, default=40)
+    parser.add_argument("--hotspots", type=int, default=40)
+    parser.add_argument("--rps", type=float, default=500)
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--writes-per-second", type=float, default=5)
+    parser.add_argument("--query-ms", type=float, default=8, help="Simulated fixed cost of one feed query")
+    parser.add_argument("--per-shop-us", type=float, default=60, help="Simulated $lookup cost per shop in radius")
+    parser.add_argument("--ttl", type=float, default=60)
+    parser.add_argument("--max-items", type=int, default=200)
+    parser.add_argument("--precision", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    city = build_city(args.shops, args.products_per_shop, args.seed)
+    stream = request_stream(args)
+    reads = sum(1 for event in stream if event[0] == "read")
+    print(f"{args.shops} shops, {reads} feed requests over {args.seconds:.0f}s ({args.rps:.0f} rps), "
+          f"{len(stream) - reads} product writes")
+    print(f"{'cache':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'db queries':>11} {'hit rate':>9} {'invalidated':>12}")
+    for label, cache in (
+        ("off", FeedCache(max_entries=0)),
+        ("on", FeedCache(args.ttl, 5000, args.max_items, args.precision)),
+    ):
+        latencies, computations = asyncio.run(replay(stream, city, cache, args))
+        metrics = cache.metrics()
+        hit_rate = f"{metrics['hit_rate']:.1%}" if metrics["hit_rate"] is not None else "-"
+        print(f"{label:>8} {percentile(latencies, 50):>8.1f} {percentile(latencies, 95):>8.1f} "
+              f"{percentile(latencies, 99):>8.1f} {computations:>11} {hit_rate:>9} {metrics['invalidations']:>12}")
+
+    overlap = asyncio.run(accuracy(stream, city, args))
+    print(f"Cached pages share {overlap:.1%} of items with pages computed from the exact location")
+
+
+if __name__ == "__main__":
+    main()
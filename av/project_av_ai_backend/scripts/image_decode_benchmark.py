@@ -0,0 +1,151 @@
+"""
+Benchmarks full-resolution decoding against the draft/downscale path used by
+/upload-and-predict/ on phone-sized (12 MP) JPEGs.
+
+    python scripts/image_decode_benchmark.py --count 20
+    python scripts/image_decode_benchmark.py --images ~/Pictures/shop-photos --parity
+
+Both paths end with CLIP's own resize of the shortest side to 224px. Each path
+runs in its own process so peak RSS is measured in isolation. --parity also
+loads the CLIP model and compares top-1 labels of the two paths.
+"""
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BACKEND_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_ROOT)
+
+CLIP_SIDE = 224
+
+
+def synthetic_photos(directory, count, width, height, seed):
+    """Smooth gradients, blocks and sensor-like noise, so file sizes resemble real 12 MP photos."""
+    from PIL import Image
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    paths = []
+    for i in range(count):
+        base = rng.uniform(0, 255, 3)
+        direction = rng.uniform(-1, 1, (2, 3))
+        pixels = base + (x[..., None] / width) * direction[0] * 120 + (y[..., None] / height) * direction[1] * 120
+        for _ in range(12):
+            x0, y0 = rng.integers(0, width - 400), rng.integers(0, height - 400)
+            pixels[y0:y0 + rng.integers(100, 400), x0:x0 + rng.integers(100, 400)] = rng.uniform(0, 255, 3)
+        pixels += rng.normal(0, 6, pixels.shape)
+        path = os.path.join(directory, f"synthetic-{i:03d}.jpg")
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(path, "JPEG", quality=90)
+        paths.append(path)
+    return paths
+
+
+def full_decode(data):
+    from io import BytesIO
+    from PIL import Image
+    return Image.open(BytesIO(data)).convert("RGB")
+
+
+def to_clip_size(image):
+    from PIL import Image
+    scale = CLIP_SIDE / min(image.size)
+    return image.resize((round(image.width * scale), round(image.height * scale)), Image.BICUBIC)
+
+
+def run_worker(mode, image_paths, min_side, rounds):
+    from app.utils.image_io import decode_for_inference
+    blobs = [open(path, "rb").read() for path in image_paths]
+    decode = full_decode if mode == "full" else lambda data: decode_for_inference(data, min_side)
+
+    latencies = []
+    for _ in range(rounds):
+        for data in blobs:
+            started = time.perf_counter()
+            to_clip_size(decode(data))
+            latencies.append(time.perf_counter() - started)
+
+    latencies.sort()
+    print(json.dumps({
+        "mode": mode,
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }))
+
+
+def check_parity(image_paths, min_side):
+    from app import clip_model
+    from app.utils.image_io import decode_for_inference
+    clip_model.load_model()
+    agree = 0
+    for path in image_paths:
+        data = open(path, "rb").read()
+        full = clip_model.predict_product_candidates(full_decode(data), 1)[0]["label"]
+        reduced = clip_model.predict_product_candidates(decode_for_inference(data, min_side), 1)[0]["label"]
+        agree += full == reduced
+        if full != reduced:
+            print(f"    {os.path.basename(path)}: full={full!r} reduced={reduced!r}")
+    return agree
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", help="Directory of JPEGs to use instead of synthetic 12 MP photos")
+    parser.add_argument("--count", type=int, default=20, help="Synthetic photos to generate")
+    parser.add_argument("--size", type=int, nargs=2, default=[4000, 3000], metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--min-side", type=int, default=256)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--parity", action="store_true", help="Compare CLIP top-1 labels of both paths")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--generate", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.generate:
+        synthetic_photos(args.generate, args.count, args.size[0], args.size[1], args.seed)
+        return
+    if args.worker:
+        image_paths = sorted(glob.glob(os.path.join(args.images, "*.jp*g")))
+        run_worker(args.worker, image_paths, args.min_side, args.rounds)
+        return
+
+    with tempfile.TemporaryDirectory() as scratch:
+        if args.images is None:
+            # Generated in a child process: forked workers inherit the parent's peak RSS
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--generate", scratch, "--count", str(args.count),
+                 "--size", str(args.size[0]), str(args.size[1]), "--seed", str(args.seed)],
+                check=True
+            )
+            args.images = scratch
+        image_paths = sorted(glob.glob(os.path.join(args.images, "*.jp*g")))
+        if not image_paths:
+            sys.exit(f"No JPEGs found in {args.images}")
+
+        sizes = [os.path.getsize(path) / (1024 * 1024) for path in image_paths]
+        print(f"{len(image_paths)} JPEGs, {np.mean(sizes):.1f}MB average, min side {args.min_side}px")
+        print(f"{'decode':>8} {'p50 ms':>8} {'p95 ms':>8} {'RSS MB':>8}")
+        for mode in ("full", "draft"):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--worker", mode, "--images", args.images,
+                 "--min-side", str(args.min_side), "--rounds", str(args.rounds)],
+                check=True, capture_output=True, text=True
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{result['mode']:>8} {result['p50_ms']:>8} {result['p95_ms']:>8} {result['peak_rss_mb']:>8}")
+
+        if args.parity:
+            agree = check_parity(image_paths, args.min_side)
+            print(f"top-1 parity: {agree}/{len(image_paths)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Compares the exact and IVF label indexes on synthetic CLIP-like embeddings.
+
+    python scripts/label_index_benchmark.py --sizes 1000 10000 50000 200000
+
+Labels are drawn around random topic centres (product families) and queries are
+noisy copies of random labels. Recall@k is measured against the exact index, and
+p@1 err is the mean absolute difference from the exact top-1 probability where both
+indexes agree on the label (IVF estimates the unprobed part of the softmax).
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.label_index import BruteForceLabelIndex, IVFLabelIndex  # noqa: E402
+
+LOGIT_SCALE = 100.0
+
+
+def normalise(x):
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def synthetic_catalogue(n, dim, rng):
+    centres = normalise(rng.standard_normal((max(8, n // 50), dim)).astype(np.float32))
+    members = centres[rng.integers(0, len(centres), n)]
+    noise = rng.standard_normal((n, dim)).astype(np.float32) / np.sqrt(dim)
+    return normalise(members + 0.8 * noise)
+
+
+def timed_search(index, queries, k, batch_size):
+    results = []
+    started = time.perf_counter()
+    for start in range(0, len(queries), batch_size):
+        results.extend(index.search(queries[start:start + batch_size], k, LOGIT_SCALE))
+    elapsed = time.perf_counter() - started
+    return results, elapsed / len(queries) * 1000
+
+
+def recall(truth, approx, k):
+    hits = 0
+    for t, a in zip(truth, approx):
+        hits += len({c["label"] for c in t[:k]} & {c["label"] for c in a[:k]})
+    return hits / (len(truth) * k)
+
+
+def probability_error(truth, approx):
+    errors = [abs(t[0]["probability"] - a[0]["probability"])
+              for t, a in zip(truth, approx) if t and a and t[0]["label"] == a[0]["label"]]
+    return float(np.mean(errors)) if errors else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000, 200000])
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=8, help="Images per forward pass, as in the batcher")
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'labels':>8} {'index':>12} {'build s':>8} {'ms/query':>9} {'recall@1':>9} {'recall@5':>9} {'p@1 err':>8}")
+    for n in args.sizes:
+        embeddings = synthetic_catalogue(n, args.dim, rng)
+        labels = [f"product-{i}" for i in range(n)]
+        picks = rng.integers(0, n, args.queries)
+        noise = rng.standard_normal((args.queries, args.dim)).astype(np.float32) / np.sqrt(args.dim)
+        queries = normalise(embeddings[picks] + 0.5 * noise)
+
+        started = time.perf_counter()
+        exact = BruteForceLabelIndex(labels, embeddings)
+        build = time.perf_counter() - started
+        truth, latency = timed_search(exact, queries, 5, args.batch_size)
+        print(f"{n:>8} {'exact':>12} {build:>8.2f} {latency:>9.3f} {1.0:>9.3f} {1.0:>9.3f} {0.0:>8.4f}")
+
+        started = time.perf_counter()
+        ivf = IVFLabelIndex(labels, embeddings, seed=args.seed)
+        build = time.perf_counter() - started
+        for n_probe in args.n_probe:
+            ivf.n_probe = n_probe
+            approx, latency = timed_search(ivf, queries, 5, args.batch_size)
+            name = f"ivf/p{n_probe}"
+            print(f"{n:>8} {name:>12} {build:>8.2f} {latency:>9.3f} {recall(truth, approx, 1):>9.3f} {recall(truth, approx, 5):>9.3f} "
+                  f"{probability_error(truth, approx):>8.4f}")
+
+
+if __name__ == "__main__":
+    main()
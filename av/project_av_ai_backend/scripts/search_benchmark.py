@@ -0,0 +1,120 @@
+"""
+Compares product search through the search_grams index with the old
+unanchored, case-insensitive $regex on product_name/category.
+
+    python scripts/search_benchmark.py --uri mongodb://localhost:27017 --documents 1000000
+
+Seeds a scratch database on a local mongod with synthetic product names,
+including the spelling variants the folding rules cover, and indexes it the
+way app/db.py does. Each query in QUERIES is run --repeat times per path. For
+each query the script reports p50/p95 latency, documents examined (from
+explain), and hits. Variant spellings show where the two paths differ in
+recall: the regex finds "atta" but not "aata".
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+from pymongo import MongoClient, UpdateOne
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.search import search_fields, search_filter, rank_products  # noqa: E402
+
+DB_NAME = "project_av_search_benchmark"
+BRANDS = ["tata", "amul", "aashirvaad", "parle", "britannia", "haldiram", "mdh", "everest", "fortune", "patanjali"]
+ITEMS = ["atta", "aata", "salt", "daal", "dal", "dhal", "chawal", "paneer", "ghee", "biscuit", "namkeen",
+         "chilli powder", "chilly sauce", "haldi", "besan", "maggi noodles", "moong dal", "rajma", "poha", "sugar"]
+SIZES = ["100g", "250g", "500g", "1kg", "5kg", "1l", "pack"]
+CATEGORIES = ["groceries", "dairy", "snacks", "spices", "staples", "beverages"]
+QUERIES = ["atta", "aata", "tata salt", "dal", "dhal", "paneer", "pane", "chilli", "chilly", "maggi", "ha", "xyz"]
+
+
+def seed(collection, documents):
+    if collection.estimated_document_count() == documents:
+        return
+    collection.drop()
+    batch = []
+    for i in range(documents):
+        name = f"{random.choice(BRANDS)} {random.choice(ITEMS)} {random.choice(SIZES)}".title()
+        category = random.choice(CATEGORIES)
+        batch.append({
+            "product_name": name,
+            "category": category,
+            "price": round(random.uniform(5, 500), 2),
+            "count": random.randint(0, 50),
+            "inStock": True,
+            "owner_id": f"owner-{i % 5000}",
+            **search_fields(name, category)
+        })
+        if len(batch) == 10000:
+            collection.insert_many(batch)
+            batch = []
+            print(f"... seeded {i + 1}", end="\r", flush=True)
+    if batch:
+        collection.insert_many(batch)
+    print()
+
+
+def regex_query(text):
+    pattern = {"$regex": text, "$options": "i"}
+    return {"$or": [{"product_name": pattern}, {"category": pattern}], "inStock": True, "count": {"$gt": 0}}
+
+
+def index_query(text):
+    return {**search_filter(text), "inStock": True, "count": {"$gt": 0}}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))] * 1000
+
+
+def measure(collection, query, repeat, rank_text=None):
+    latencies = []
+    hits = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        products = list(collection.find(query, {"product_name": 1, "category": 1}))
+        if rank_text is not None:
+            products = rank_products(products, rank_text)
+        latencies.append(time.perf_counter() - started)
+        hits = len(products)
+    stats = collection.find(query).explain()["executionStats"]
+    return percentile(latencies, 50), percentile(latencies, 95), stats["totalDocsExamined"], hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--documents", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--reindex", action="store_true", help="Recompute search fields on the seeded data")
+    parser.add_argument("--drop", action="store_true", help="Drop the scratch database afterwards")
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri)
+    collection = client[DB_NAME]["products"]
+    seed(collection, args.documents)
+    if args.reindex:
+        collection.bulk_write([
+            UpdateOne({"_id": p["_id"]}, {"$set": search_fields(p["product_name"], p["category"])})
+            for p in collection.find({}, {"product_name": 1, "category": 1})
+        ], ordered=False)
+    collection.create_index([("search_grams", 1), ("inStock", 1), ("count", 1)])
+
+    print(f"{args.documents} products, {args.repeat} runs per query (latency includes fetching and ranking)")
+    print(f"{'query':>12} {'path':>6} {'p50 ms':>9} {'p95 ms':>9} {'examined':>10} {'hits':>8}")
+    for text in QUERIES:
+        for path, query, rank_text in (("regex", regex_query(text), None), ("index", index_query(text), text)):
+            p50, p95, examined, hits = measure(collection, query, args.repeat, rank_text)
+            print(f"{text:>12} {path:>6} {p50:>9.1f} {p95:>9.1f} {examined:>10} {hits:>8}")
+
+    if args.drop:
+        client.drop_database(DB_NAME)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Before/after explain plans for the shop -> products join.
+
+    python scripts/shop_lookup_benchmark.py --uri mongodb://localhost:27017 --shops 2000 --products-per-shop 200
+
+Seeds a scratch database on a local mongod with shops around one point and
+products whose shop_id is the shop's _id as a string, as the API used to write
+it. It then explains a trending-style pipeline (the $geoNear within 5 km
+followed by the per-shop $lookup) in three shapes:
+
+  before      let/$toString + $expr $eq (the old pipelines)
+  dual-read   shop_products_lookup() with PRODUCT_SHOP_ID_DUAL_READ on
+  after       shop_products_lookup() with dual read off, after converting
+              shop_id to ObjectId
+
+For each shape it prints the docs/keys examined by the $lookup, whether it
+used an index or scanned products, and the wall time.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+from pymongo import GEOSPHERE, MongoClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app.db as app_db  # noqa: E402
+
+DB_NAME = "project_av_lookup_benchmark"
+CENTER = (77.5946, 12.9716) # Bengaluru
+
+
+def seed(db, shops, products_per_shop):
+    if db.shops.estimated_document_count() == shops and db.products.estimated_document_count() == shops * products_per_shop:
+        return
+    db.shops.drop()
+    db.products.drop()
+    shop_docs = []
+    for i in range(shops):
+        # Spread over roughly 30 km so only part of the catalogue is within 5 km
+        lng = CENTER[0] + random.uniform(-0.15, 0.15)
+        lat = CENTER[1] + random.uniform(-0.15, 0.15)
+        shop_docs.append({"name": f"Shop {i}", "owner_id": f"owner-{i}", "latitude": lat, "longitude": lng,
+                          "location": {"type": "Point", "coordinates": [lng, lat]}})
+    shop_ids = db.shops.insert_many(shop_docs).inserted_ids
+    db.shops.create_index([("location", GEOSPHERE)])
+
+    batch = []
+    for shop_id in shop_ids:
+        for j in range(products_per_shop):
+            batch.append({"product_name": f"Product {j}", "category": random.choice(["Dairy", "Snacks", "Staples"]),
+                          "shop_id": str(shop_id), "inStock": True, "count": random.randint(0, 20),
+                          "sale_count": random.randint(0, 100)})
+        if len(batch) >= 10000:
+            db.products.insert_many(batch)
+            batch = []
+    if batch:
+        db.products.insert_many(batch)
+
+
+def pipeline(lookup_stages):
+    return [
+        {"$geoNear": {"near": {"type": "Point", "coordinates": list(CENTER)}, "distanceField": "distance_in_meters",
+                      "maxDistance": 5000, "spherical": True}},
+        *lookup_stages,
+        {"$unwind": "$products"},
+        {"$match": {"products.inStock": True}},
+        {"$sort": {"products.sale_count": -1, "distance_in_meters": 1}},
+        {"$limit": 10}
+    ]
+
+
+def old_lookup():
+    return [{"$lookup": {
+        "from": "products",
+        "let": {"shop_id_str": {"$toString": "$_id"}},
+        "pipeline": [{"$match": {"$expr": {"$eq": ["$shop_id", "$$shop_id_str"]}}}],
+        "as": "products"
+    }}]
+
+
+def new_lookup(dual_read):
+    app_db.PRODUCT_SHOP_ID_DUAL_READ = dual_read
+    return app_db.shop_products_lookup("products")
+
+
+def lookup_stats(db, stages):
+    explain = db.command("explain", {"aggregate": "shops", "pipeline": pipeline(stages), "cursor": {}},
+                         verbosity="executionStats")
+    for stage in explain.get("stages", []):
+        if "$lookup" in stage:
+            return {
+                "docs_examined": stage.get("totalDocsExamined"),
+                "keys_examined": stage.get("totalKeysExamined"),
+                "collection_scans": stage.get("collectionScans"),
+                "indexes_used": stage.get("indexesUsed")
+            }
+    return {}
+
+
+def timed(db, stages, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        list(db.shops.aggregate(pipeline(stages)))
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def report(name, db, stages, repeat):
+    stats = lookup_stats(db, stages)
+    print(f"{name:>10} {timed(db, stages, repeat):>9.1f} {str(stats.get('docs_examined')):>14} "
+          f"{str(stats.get('keys_examined')):>14} {str(stats.get('collection_scans')):>8}  {stats.get('indexes_used')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--shops", type=int, default=2000)
+    parser.add_argument("--products-per-shop", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--drop", action="store_true", help="Drop the scratch database afterwards")
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri)
+    db = client[DB_NAME]
+    seed(db, args.shops, args.products_per_shop)
+    db.products.create_index([("shop_id", 1), ("category", 1)])
+
+    print(f"{args.shops} shops x {args.products_per_shop} products; $lookup stats from explain(executionStats)")
+    print(f"{'shape':>10} {'ms/query':>9} {'docs examined':>14} {'keys examined':>14} {'scans':>8}  indexes used")
+    report("before", db, old_lookup(), args.repeat)
+    report("dual-read", db, new_lookup(True), args.repeat)
+
+    db.products.update_many({"shop_id": {"$type": "string"}}, [{"$set": {"shop_id": {"$toObjectId": "$shop_id"}}}])
+    report("after", db, new_lookup(False), args.repeat)
+    # Leave the data as seeded for the next run
+    db.products.update_many({"shop_id": {"$type": "objectId"}}, [{"$set": {"shop_id": {"$toString": "$shop_id"}}}])
+
+    if args.drop:
+        client.drop_database(DB_NAME)
+
+
+if __name__ == "__main__":
+    main()
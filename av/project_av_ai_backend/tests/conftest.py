@@ -0,0 +1,4 @@
+import os
+
+# app/config.py requires this at import time; the tests never issue tokens
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
@@ -0,0 +1,90 @@
+import asyncio
+import itertools
+
+import pytest
+
+pytest.importorskip("motor")
+
+from app.checkout import CheckoutWriter  # noqa: E402
+
+_ids = itertools.count(1)
+
+
+class FakeCollection:
+    """The slice of a Motor collection CheckoutWriter uses; fails the named method when asked to."""
+
+    def __init__(self, name, fail=None):
+        self.name = name
+        self.fail = fail
+        self.documents = {}
+
+    def _check(self, method):
+        if self.fail == method:
+            raise RuntimeError(f"{self.name}.{method} failed")
+
+    async def insert_one(self, document, session=None):
+        document.setdefault("_id", next(_ids))
+        self._check("insert_one")
+        self.documents[document["_id"]] = document
+
+    async def insert_many(self, documents, session=None):
+        for document in documents:
+            document.setdefault("_id", next(_ids))
+        # Like an ordered insert_many that fails part-way: the first document lands
+        self.documents[documents[0]["_id"]] = documents[0]
+        self._check("insert_many")
+        for document in documents[1:]:
+            self.documents[document["_id"]] = document
+
+    async def delete_many(self, query):
+        for _id in query["_id"]["$in"]:
+            self.documents.pop(_id, None)
+
+    async def find_one_and_update(self, query, update, projection=None, return_document=None, session=None):
+        self._check("find_one_and_update")
+        user = self.documents[query["_id"]]
+        for field, amount in update["$inc"].items():
+            user[field] = user.get(field, 0) + amount
+        return user
+
+
+def _writer(fail=None):
+    collections = {name: FakeCollection(name, fail.get(name) if fail else None)
+                   for name in ("orders", "cart", "rewards", "users")}
+    collections["users"].documents["user-1"] = {"_id": "user-1", "coins": 10}
+    return CheckoutWriter(**collections), collections
+
+
+def _checkout(writer):
+    return asyncio.run(writer.write(
+        {"items": ["Atta"]}, [{"product_name": "Atta"}, {"product_name": "Dal"}], {"coins": 6}, "user-1", 6
+    ))
+
+
+def test_writes_every_record():
+    writer, collections = _writer()
+
+    user = _checkout(writer)
+
+    assert user["coins"] == 16
+    assert len(collections["orders"].documents) == 1
+    assert len(collections["cart"].documents) == 2
+    assert len(collections["rewards"].documents) == 1
+
+
+@pytest.mark.parametrize("collection, method", [
+    ("orders", "insert_one"),
+    ("cart", "insert_many"),
+    ("rewards", "insert_one"),
+    ("users", "find_one_and_update"),
+])
+def test_a_failed_write_undoes_the_others(collection, method):
+    writer, collections = _writer(fail={collection: method})
+
+    with pytest.raises(RuntimeError):
+        _checkout(writer)
+
+    assert collections["orders"].documents == {}
+    assert collections["cart"].documents == {}
+    assert collections["rewards"].documents == {}
+    assert collections["users"].documents["user-1"]["coins"] == 10
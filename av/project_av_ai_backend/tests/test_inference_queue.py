@@ -0,0 +1,61 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.inference_queue import InferenceBatcher
+
+
+def test_batches_concurrent_requests():
+    async def scenario():
+        batcher = InferenceBatcher(lambda images: [image * 2 for image in images], max_batch_size=4, max_wait_ms=20)
+        await batcher.start()
+        try:
+            results = await asyncio.gather(*(batcher.submit(i) for i in range(8)))
+        finally:
+            await batcher.stop()
+        return results, batcher.metrics()
+
+    results, metrics = asyncio.run(scenario())
+
+    assert results == [i * 2 for i in range(8)]
+    assert metrics["batches_total"] == 2
+
+
+def test_stop_fails_in_flight_and_queued_requests():
+    release = threading.Event()
+    started = threading.Event()
+
+    def predict_batch(images):
+        started.set()
+        release.wait(5)
+        return images
+
+    async def scenario():
+        batcher = InferenceBatcher(predict_batch, max_batch_size=2, max_wait_ms=0)
+        await batcher.start()
+        requests = [asyncio.create_task(batcher.submit(i)) for i in range(5)]
+        # Wait until the first batch is on the worker thread; the rest stay queued
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        await batcher.stop()
+        results = await asyncio.wait_for(asyncio.gather(*requests, return_exceptions=True), 1)
+        release.set()
+        return results
+
+    results = asyncio.run(scenario())
+
+    assert len(results) == 5
+    for result in results:
+        assert isinstance(result, RuntimeError)
+        assert "stopped" in str(result)
+
+
+def test_submit_after_stop_is_rejected():
+    async def scenario():
+        batcher = InferenceBatcher(lambda images: images)
+        await batcher.start()
+        await batcher.stop()
+        await batcher.submit(1)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(scenario())
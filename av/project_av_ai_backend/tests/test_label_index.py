@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from app.label_index import BruteForceLabelIndex, IVFLabelIndex
+
+
+def _catalogue(n, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((n, dim)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return [f"label-{i}" for i in range(n)], embeddings
+
+
+@pytest.mark.parametrize("index_class", [BruteForceLabelIndex, IVFLabelIndex])
+def test_add_with_a_label_repeated_in_the_batch_keeps_its_last_vector(index_class):
+    labels, embeddings = _catalogue(200)
+    index = index_class(labels, embeddings)
+    first, last = embeddings[0], embeddings[1]
+
+    index.add(["new", "new"], np.stack([first, last]))
+
+    assert len(index) == 201
+    assert index.search(last[None, :], 1, 100.0)[0][0]["label"] in ("new", "label-1")
+    assert all(result["label"] != "new" for result in index.search(first[None, :], 2, 100.0)[0])
+
+
+def test_ivf_probabilities_match_brute_force():
+    labels, embeddings = _catalogue(2000)
+    exact = BruteForceLabelIndex(labels, embeddings)
+    ivf = IVFLabelIndex(labels, embeddings, n_probe=8)
+    queries = embeddings[:20] + 0.02 * np.random.default_rng(1).standard_normal((20, 32)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    for truth, approx in zip(exact.search(queries, 1, 30.0), ivf.search(queries, 1, 30.0)):
+        assert approx[0]["label"] == truth[0]["label"]
+        assert approx[0]["probability"] == pytest.approx(truth[0]["probability"], abs=0.05)
+
+
+def test_ivf_search_after_every_label_is_removed():
+    labels, embeddings = _catalogue(50)
+    index = IVFLabelIndex(labels, embeddings)
+    index.remove(labels)
+
+    assert index.search(embeddings[:2], 3) == [[], []]
@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+
+from app import prediction_cache
+from app.prediction_cache import PredictionCache
+
+
+def _cache(monkeypatch, **kwargs):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(prediction_cache, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    cache = PredictionCache(**kwargs)
+    cache.get(0, version=1) # Puts are only stored against the version last looked up
+    return cache, clock
+
+
+def test_near_duplicate_hit(monkeypatch):
+    cache, _ = _cache(monkeypatch, max_distance=4)
+    cache.put(0b1011, "milk", version=1)
+
+    assert cache.get(0b1010, version=1) == "milk"
+    assert cache.metrics()["near_hits"] == 1
+
+
+def test_expired_exact_entry_falls_back_to_a_fresh_neighbour(monkeypatch):
+    cache, clock = _cache(monkeypatch, ttl_seconds=10, max_distance=4)
+    cache.put(0b1011, "stale", version=1)
+    clock.now += 8
+    cache.put(0b1010, "fresh", version=1)
+    clock.now += 5 # The exact entry has expired, its neighbour has not
+
+    assert cache.get(0b1011, version=1) == "fresh"
+    metrics = cache.metrics()
+    assert metrics["expirations"] == 1
+    assert metrics["entries"] == 1
+
+
+def test_expired_entry_without_neighbours_is_a_miss(monkeypatch):
+    cache, clock = _cache(monkeypatch, ttl_seconds=10)
+    cache.put(0b1011, "stale", version=1)
+    clock.now += 11
+
+    assert cache.get(0b1011, version=1) is None
+    assert cache.metrics()["entries"] == 0
+
+
+def test_new_version_empties_the_cache(monkeypatch):
+    cache, _ = _cache(monkeypatch)
+    cache.put(1, "milk", version=1)
+
+    assert cache.get(1, version=2) is None
+    assert cache.metrics()["invalidations"] == 1
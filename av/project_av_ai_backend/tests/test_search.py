@@ -0,0 +1,82 @@
+import re
+
+import pytest
+
+from app.search import search_fields, search_filter, rank_products
+
+CATALOGUE = [
+    ("Good Day Biscuits", "snacks"),
+    ("Colgate Toothpaste", "personal care"),
+    ("Oreo Cookies", "snacks"),
+    ("Amul Paneer 200g", "dairy"),
+    ("Tata Salt 1kg", "staples"),
+    ("Clinic Plus Shampoo", "personal care"),
+    ("Aashirvaad Atta 5kg", "staples"),
+    ("Toor Dal", "staples"),
+    ("Bhindi", "vegetables"),
+    ("Wheat Flour", "staples"),
+    ("Chilli Powder", "spices"),
+    ("Dhania Powder", "spices"),
+]
+
+
+def _matches(grams: set, query: dict) -> bool:
+    """Evaluates the filter shapes search_filter() builds against one product's grams."""
+    if "$and" in query:
+        return all(_matches(grams, clause) for clause in query["$and"])
+    condition = query["search_grams"]
+    if isinstance(condition, str):
+        return condition in grams
+    if "$all" in condition:
+        return all(gram in grams for gram in condition["$all"])
+    if "$in" in condition:
+        return any(gram in grams for gram in condition["$in"])
+    return any(re.match(condition["$regex"], gram) for gram in grams)
+
+
+def search(text) -> list:
+    query = search_filter(text)
+    assert query is not None
+    products = [{"product_name": name, "category": category, **search_fields(name, category)}
+                for name, category in CATALOGUE]
+    found = [product for product in products if _matches(set(product["search_grams"]), query)]
+    return [product["product_name"] for product in rank_products(found, text)]
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("go", "Good Day Biscuits"),
+    ("to", "Colgate Toothpaste"),
+    ("co", "Oreo Cookies"),
+    ("pane", "Amul Paneer 200g"),
+    ("sha", "Clinic Plus Shampoo"),
+    ("wh", "Wheat Flour"),
+    ("bh", "Bhindi"),
+    ("tata sal", "Tata Salt 1kg"),
+])
+def test_prefixes_as_typed(query, expected):
+    assert expected in search(query)
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("panir", "Amul Paneer 200g"),
+    ("aata", "Aashirvaad Atta 5kg"),
+    ("daal", "Toor Dal"),
+    ("dhal", "Toor Dal"),
+    ("bindi", "Bhindi"),
+    ("chilly", "Chilli Powder"),
+])
+def test_spelling_variants(query, expected):
+    assert expected in search(query)
+
+
+def test_sh_is_not_folded_into_s():
+    assert "Tata Salt 1kg" not in search("sha")
+
+
+@pytest.mark.parametrize("query", ["w", "b v", "dh", "T"])
+def test_short_queries_still_match(query):
+    assert search(query)
+
+
+def test_query_without_letters_or_digits():
+    assert search_filter("  -- ") is None